@@ -0,0 +1,57 @@
+"""
+Compares deserializing the rendered output of the Jinja2 templates in
+templates/default with the pure-Python YAML loader, the libyaml loader,
+and the parse cache used by discovery (for nodes that render the same text).
+
+Usage: python benchmarks/deserialize.py [number of iterations]
+"""
+import os
+import sys
+import timeit
+from typing import Dict
+
+os.environ.setdefault("SOVEREIGN_CONFIG", "file://test/config/config.yaml")
+os.environ.setdefault("SOVEREIGN_ENVIRONMENT_TYPE", "local")
+
+import yaml  # noqa: E402
+from sovereign import XDS_TEMPLATES, discovery, template_context  # noqa: E402
+from sovereign.utils.mock import mock_discovery_request  # noqa: E402
+
+
+def rendered_templates() -> Dict[str, str]:
+    request = mock_discovery_request(service_cluster="T1")
+    ret = dict()
+    for xds_type, template in XDS_TEMPLATES["default"].items():
+        if template.is_python_source:
+            continue
+        ret[xds_type] = template(
+            discovery_request=request,
+            host_header="example.com",
+            resource_names=request.resources,
+            **template_context.get_context(request, template),
+        )
+    return ret
+
+
+def main(number: int) -> None:
+    loaders = {
+        "python": lambda text: yaml.load(text, Loader=yaml.SafeLoader),
+        "libyaml": lambda text: yaml.load(text, Loader=yaml.CSafeLoader),
+        "cached": discovery.deserialize_config,
+    }
+    if not hasattr(yaml, "CSafeLoader"):
+        del loaders["libyaml"]
+    print(f"{'template':>10} {'bytes':>8} " + " ".join(f"{n:>10}" for n in loaders))
+    for xds_type, text in rendered_templates().items():
+        timings = [
+            min(timeit.repeat(lambda: load(text), number=number, repeat=5)) / number
+            for load in loaders.values()
+        ]
+        print(
+            f"{xds_type:>10} {len(text):>8} "
+            + " ".join(f"{t * 1000:>8.3f}ms" for t in timings)
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if sys.argv[1:] else 200)
@@ -0,0 +1,72 @@
+"""
+Times polling sources whose instances are spread over many match keys:
+the first poll, which fingerprints every match key, a poll in which one
+instance changed, and a poll in which nothing changed.
+
+Usage: python benchmarks/fingerprints.py [instances] [match keys]
+"""
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+os.environ.setdefault("SOVEREIGN_CONFIG", "file://test/config/config.yaml")
+os.environ.setdefault("SOVEREIGN_ENVIRONMENT_TYPE", "local")
+
+from sovereign import logs, stats  # noqa: E402
+from sovereign.schemas import ConfiguredSource  # noqa: E402
+from sovereign.sources import SourcePoller  # noqa: E402
+
+
+def instances(count: int, match_keys: int) -> List[Dict[str, Any]]:
+    return [
+        {
+            "name": f"service-{i}",
+            "service_clusters": [f"cluster-{i % match_keys}"],
+            "domains": [f"service-{i}.example.com"],
+            "endpoints": [
+                {"address": f"10.0.{i % 250}.{j}", "port": 443} for j in range(3)
+            ],
+        }
+        for i in range(count)
+    ]
+
+
+def timed(poller: SourcePoller) -> float:
+    start = time.perf_counter()
+    poller.poll()
+    return time.perf_counter() - start
+
+
+def main(count: int, match_keys: int) -> None:
+    source = ConfiguredSource(
+        type="inline",
+        scope="default",
+        config={"instances": instances(count, match_keys)},
+    )
+    poller = SourcePoller(
+        sources=[source],
+        matching_enabled=True,
+        node_match_key="cluster",
+        source_match_key="service_clusters",
+        source_refresh_rate=30,
+        logger=logs,
+        stats=stats,
+    )
+    print(f"{count} instances, {match_keys} match keys")
+    print(f"{'first poll':>20} {timed(poller) * 1000:>9.1f}ms")
+
+    changed = instances(count, match_keys)
+    changed[0]["domains"].append("changed.example.com")
+    poller.sources[0].instances = changed  # type: ignore[attr-defined]
+    duration = timed(poller)
+    print(
+        f"{'one instance changed':>20} {duration * 1000:>9.1f}ms"
+        f" ({len(poller.changed_match_keys)} match keys changed)"
+    )
+    print(f"{'unchanged':>20} {timed(poller) * 1000:>9.1f}ms")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [5000, 300][len(args) :]))
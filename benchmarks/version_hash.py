@@ -0,0 +1,82 @@
+"""
+Compares the previous version hash (repr + crc32 of the whole content) with
+canonical JSON + blake2b, both for whole documents and when combining
+per-resource hashes, on payloads shaped like rendered clusters.
+
+Usage: python benchmarks/version_hash.py [number of clusters ...]
+"""
+import os
+import sys
+import timeit
+import zlib
+from typing import Any, Dict, List
+
+os.environ.setdefault("SOVEREIGN_CONFIG", "file://test/config/config.yaml")
+os.environ.setdefault("SOVEREIGN_ENVIRONMENT_TYPE", "local")
+
+from sovereign.schemas import ProcessedTemplate  # noqa: E402
+from sovereign.utils.version_info import combine_hashes, compute_hash  # noqa: E402
+
+
+def legacy_compute_hash(*args: Any) -> str:
+    data: bytes = repr(args).encode()
+    return str(zlib.crc32(data) & 0xFFFFFFFF)
+
+
+def clusters(count: int) -> List[Dict[str, Any]]:
+    return [
+        {
+            "@type": "type.googleapis.com/envoy.config.cluster.v3.Cluster",
+            "name": f"service-{i}",
+            "type": "STRICT_DNS",
+            "connect_timeout": "5.000s",
+            "load_assignment": {
+                "cluster_name": f"service-{i}_cluster",
+                "endpoints": [
+                    {
+                        "locality": {"zone": zone},
+                        "priority": priority,
+                        "lb_endpoints": [
+                            {
+                                "endpoint": {
+                                    "address": {
+                                        "socket_address": {
+                                            "address": f"10.{i % 250}.{j}.{priority}",
+                                            "port_value": 8080 + j,
+                                        }
+                                    }
+                                }
+                            }
+                            for j in range(4)
+                        ],
+                    }
+                    for priority, zone in enumerate(["us-east-1", "us-west-2"])
+                ],
+            },
+        }
+        for i in range(count)
+    ]
+
+
+def per_resource(resources: List[Dict[str, Any]]) -> str:
+    return combine_hashes(ProcessedTemplate(resources, None).resource_hashes)
+
+
+def main(sizes: List[int]) -> None:
+    print(f"{'clusters':>10} {'legacy':>10} {'canonical':>10} {'combined':>10}")
+    for size in sizes:
+        content = {"resources": clusters(size)}
+        number = max(1, 2000 // size)
+        timings = [
+            min(timeit.repeat(lambda: fn(content), number=number, repeat=5)) / number
+            for fn in (
+                legacy_compute_hash,
+                compute_hash,
+                lambda c: per_resource(c["resources"]),
+            )
+        ]
+        print(f"{size:>10} " + " ".join(f"{t * 1000:>8.2f}ms" for t in timings))
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10, 100, 1000, 10000])
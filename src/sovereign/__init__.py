@@ -62,6 +62,8 @@ except ValidationError:
     old_config = SovereignConfig(**parse_raw_configuration(config_path))
     config = SovereignConfigv2.from_legacy_config(old_config)
 asgi_config = SovereignAsgiConfig()
+if config.template_cache.enabled:
+    config_loader.configure_bytecode_cache(config.template_cache.directory)
 XDS_TEMPLATES = config.xds_templates()
 
 logs = LoggerBootstrapper(config)
@@ -91,6 +93,8 @@ template_context = TemplateContext(
     disabled_suite=create_cipher_suite(b"", logs),
     logger=logs.application_log,
     stats=stats,
+    cache_size=config.template_context.cache_size,
+    load_timeout=config.template_context.load_timeout,
 )
 poller.lazy_load_modifiers(config.modifiers)
 poller.lazy_load_global_modifiers(config.global_modifiers)
@@ -0,0 +1,279 @@
+"""
+Aggregated Discovery Service
+----------------------------
+
+Serves discovery responses over gRPC (ADS), alongside the REST endpoints.
+Envoy keeps a single stream open, subscribes to each xDS type on it, and is
+only sent a response when the resources of a type change, instead of polling.
+
+Responses are determined the same way as for REST discovery requests (see
+:func:`sovereign.views.discovery.perform_discovery`), and converted to
+protobuf from the same serialized JSON.
+
+Requires ``grpcio`` and ``xds-protos``, which provides envoy's protobuf
+definitions (``pip install sovereign[grpc]``).
+"""
+import asyncio
+import importlib
+import itertools
+import pkgutil
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from pydantic import ValidationError
+from starlette.exceptions import HTTPException
+
+from sovereign import discovery, logs, stats
+from sovereign.schemas import (
+    DiscoveryRequest,
+    GrpcConfiguration,
+    ProcessedTemplate,
+    Resources,
+)
+from sovereign.snapshot import generations
+from sovereign.views.discovery import perform_discovery
+
+try:
+    import grpc
+    from google.protobuf import json_format  # type: ignore[import]
+    from envoy.service.discovery.v3 import ads_pb2_grpc, discovery_pb2
+except ImportError:
+    grpc = None
+
+# (API version, xDS type) by type URL
+xds_types = {
+    type_url: (api_version, xds_type)
+    for api_version, types in discovery.type_urls.items()
+    for xds_type, type_url in types.items()
+}
+
+# Queued by the watcher of a stream when there may be new resources
+CHANGED = object()
+# Queued once the client stops sending requests
+CLOSED = object()
+
+# (rendered response, type URL, nonce)
+Push = Tuple[ProcessedTemplate, str, str]
+
+
+class Subscription:
+    def __init__(
+        self, request: DiscoveryRequest, api_version: str, xds_type: str
+    ) -> None:
+        self.request = request
+        self.api_version = api_version
+        self.xds_type = xds_type
+        # Version of the last response sent for this type
+        self.version: Optional[str] = None
+
+
+class AdsStream:
+    """
+    The node of a stream and the xDS types that it subscribed to.
+
+    Requests are dicts in the JSON mapping of envoy's DiscoveryRequest
+    message, so that this doesn't depend on gRPC.
+    """
+
+    def __init__(self, host: str) -> None:
+        self.host = host
+        self.node: Optional[Dict[str, Any]] = None
+        self.authenticated = False
+        self.subscriptions: Dict[str, Subscription] = dict()
+        self.nonces = itertools.count(1)
+
+    async def receive(self, message: Dict[str, Any]) -> Optional[Push]:
+        """
+        Handles a request of the stream, which either subscribes to a type,
+        changes the requested resources, or acknowledges (or rejects) a response.
+        """
+        type_url = message.get("type_url", "")
+        if type_url not in xds_types:
+            raise HTTPException(status_code=400, detail=f"Unknown type_url {type_url}")
+        api_version, xds_type = xds_types[type_url]
+        # Envoy only sends its node with the first request of a stream
+        self.node = message.get("node", self.node)
+        if self.node is None:
+            raise HTTPException(
+                status_code=400, detail="The first request must include the node"
+            )
+        if error := message.get("error_detail"):
+            stats.increment(f"ads.{xds_type}.rejected")
+            logs.application_log(
+                event="Envoy rejected a discovery response",
+                node=self.node.get("id"),
+                type_url=type_url,
+                version_info=message.get("version_info"),
+                error=error.get("message"),
+            )
+        try:
+            request = DiscoveryRequest(
+                node=self.node,
+                version_info=message.get("version_info", ""),
+                resource_names=Resources(message.get("resource_names", [])),
+                type_url=type_url,
+                desired_controlplane=self.host,
+            )
+        except ValidationError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        subscription = self.subscriptions.get(type_url)
+        if subscription is None:
+            subscription = Subscription(request, api_version, xds_type)
+            self.subscriptions[type_url] = subscription
+            return await self.respond(subscription)
+        renamed = request.resource_names != subscription.request.resource_names
+        subscription.request = request
+        return await self.respond(subscription, force=renamed)
+
+    async def changed(self) -> List[Push]:
+        """
+        Responds to every subscription whose resources changed
+        """
+        responses = []
+        for subscription in list(self.subscriptions.values()):
+            if response := await self.respond(subscription):
+                responses.append(response)
+        return responses
+
+    async def respond(
+        self, subscription: Subscription, force: bool = False
+    ) -> Optional[Push]:
+        """
+        Returns a response unless the client already has the resources, or
+        was already sent them. A response that the client rejected is only
+        sent again once the resources change.
+        """
+        request = subscription.request
+        if force:
+            # Otherwise the response is empty if the client's version is
+            # current, such as when it only changed the requested resources
+            request = request.copy(update={"version_info": ""})
+        processed = await perform_discovery(
+            request,
+            subscription.api_version,
+            subscription.xds_type,
+            skip_auth=self.authenticated,
+        )
+        # The node, and its auth, doesn't change for the rest of the stream
+        self.authenticated = True
+        if not force and processed.version in (
+            request.version_info,
+            subscription.version,
+        ):
+            return None
+        subscription.version = processed.version
+        stats.increment(f"ads.{subscription.xds_type}.pushed")
+        return processed, str(request.type_url), str(next(self.nonces))
+
+
+async def watch(events: "asyncio.Queue[Any]") -> None:
+    generation = generations.latest()
+    while True:
+        await generations.wait(generation)
+        generation = generations.latest()
+        events.put_nowait(CHANGED)
+
+
+async def read(requests: AsyncIterator[Any], events: "asyncio.Queue[Any]") -> None:
+    try:
+        async for request in requests:
+            events.put_nowait(request)
+    finally:
+        events.put_nowait(CLOSED)
+
+
+def to_protobuf(push: Push) -> Any:
+    processed, type_url, nonce = push
+    response = json_format.Parse(processed.rendered, discovery_pb2.DiscoveryResponse())
+    response.type_url = type_url
+    response.nonce = nonce
+    return response
+
+
+def grpc_status(status_code: int) -> Any:
+    return {
+        400: grpc.StatusCode.INVALID_ARGUMENT,
+        401: grpc.StatusCode.UNAUTHENTICATED,
+        403: grpc.StatusCode.PERMISSION_DENIED,
+        404: grpc.StatusCode.NOT_FOUND,
+        503: grpc.StatusCode.UNAVAILABLE,
+    }.get(status_code, grpc.StatusCode.INTERNAL)
+
+
+class AggregatedDiscoveryService:
+    async def StreamAggregatedResources(
+        self, requests: AsyncIterator[Any], context: Any
+    ) -> AsyncIterator[Any]:
+        metadata = dict(context.invocation_metadata())
+        stream = AdsStream(host=metadata.get(":authority", "no_host_provided"))
+        events: "asyncio.Queue[Any]" = asyncio.Queue()
+        tasks = [
+            asyncio.ensure_future(read(requests, events)),
+            asyncio.ensure_future(watch(events)),
+        ]
+        stats.increment("ads.streams.opened")
+        try:
+            while (event := await events.get()) is not CLOSED:
+                responses: Sequence[Optional[Push]]
+                try:
+                    if event is CHANGED:
+                        responses = await stream.changed()
+                    else:
+                        message = json_format.MessageToDict(
+                            event, preserving_proto_field_name=True
+                        )
+                        responses = [await stream.receive(message)]
+                except HTTPException as e:
+                    await context.abort(grpc_status(e.status_code), str(e.detail))
+                for response in responses:
+                    if response is not None:
+                        yield to_protobuf(response)
+        finally:
+            stats.increment("ads.streams.closed")
+            for task in tasks:
+                task.cancel()
+
+    async def DeltaAggregatedResources(
+        self, requests: AsyncIterator[Any], context: Any
+    ) -> None:
+        await context.abort(
+            grpc.StatusCode.UNIMPLEMENTED,
+            "Use the REST delta discovery endpoint for incremental xDS",
+        )
+
+
+def load_envoy_types() -> None:
+    """
+    Resources are packed into protobuf Any messages by their @type, which
+    only works for types that were imported, including those of extensions.
+    """
+    for package in ("envoy", "xds", "udpa"):
+        try:
+            module = importlib.import_module(package)
+        except ImportError:
+            continue
+        for info in pkgutil.walk_packages(module.__path__, f"{package}."):
+            if info.name.endswith("_pb2"):
+                try:
+                    importlib.import_module(info.name)
+                # pylint: disable=broad-except
+                except Exception:
+                    continue
+
+
+async def serve(grpc_config: GrpcConfiguration) -> Any:
+    if grpc is None:
+        raise ImportError(
+            "grpcio and xds-protos must be installed to serve discovery over gRPC. "
+            "Use ``pip install sovereign[grpc]``"
+        )
+    load_envoy_types()
+    server = grpc.aio.server()
+    ads_pb2_grpc.add_AggregatedDiscoveryServiceServicer_to_server(
+        AggregatedDiscoveryService(), server
+    )
+    address = f"{grpc_config.host}:{grpc_config.port}"
+    server.add_insecure_port(address)
+    await server.start()
+    logs.application_log(event=f"Serving discovery over gRPC on {address}")
+    return server
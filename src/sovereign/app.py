@@ -14,7 +14,9 @@ from sovereign import (
     template_context,
     logs,
 )
+from sovereign import ads
 from sovereign.error_info import ErrorInfo
+from sovereign.snapshot import PRERENDER, prerenderer
 from sovereign.views import crypto, discovery, healthchecks, admin, interface
 from sovereign.middlewares import (
     RequestContextLogMiddleware,
@@ -113,6 +115,22 @@ def init_app() -> FastAPI:
     async def refresh_template_context() -> None:
         asyncio.create_task(template_context.start_refresh_context())
 
+    if PRERENDER:
+
+        @application.on_event("startup")
+        async def prerender_snapshots() -> None:
+            asyncio.create_task(prerenderer.refresh_forever())
+
+    if config.grpc.enabled:
+
+        @application.on_event("startup")
+        async def serve_grpc() -> None:
+            application.state.grpc_server = await ads.serve(config.grpc)
+
+        @application.on_event("shutdown")
+        async def stop_grpc() -> None:
+            await application.state.grpc_server.stop(grace=5)
+
     return application
 
 
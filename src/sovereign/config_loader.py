@@ -1,7 +1,7 @@
 import os
 import json
 from enum import Enum
-from typing import Any, Dict, Callable, Union
+from typing import Any, Dict, Callable, Optional, Tuple, Union
 from types import ModuleType
 import yaml
 import jinja2
@@ -39,6 +39,42 @@ class Protocol(Enum):
 jinja_env = jinja2.Environment(autoescape=True)
 
 
+def configure_bytecode_cache(directory: Optional[str] = None) -> None:
+    """
+    Keeps compiled templates on disk, so that they can be shared between
+    workers and survive restarts. Without a directory, Jinja2 uses a
+    per-user directory in the system temp dir.
+    """
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+    jinja_env.bytecode_cache = jinja2.FileSystemBytecodeCache(directory)
+
+
+def compile_template(
+    source: str, checksum: str, template_ast: Optional[jinja2.nodes.Template] = None
+) -> jinja2.Template:
+    """
+    Same as ``jinja_env.from_string``, but goes through the bytecode cache
+    if one is configured. Entries are keyed by the checksum of the source and
+    the version of Jinja2.
+
+    An already parsed template can be supplied to avoid parsing it again
+    when it isn't in the cache.
+    """
+    cache = jinja_env.bytecode_cache
+    if cache is None:
+        return jinja_env.from_string(template_ast or source)
+    bucket = cache.get_bucket(
+        jinja_env, f"{jinja2.__version__}:{checksum}", None, source
+    )
+    if bucket.code is None:
+        bucket.code = jinja_env.compile(template_ast or source)
+        cache.set_bucket(bucket)
+    return jinja_env.template_class.from_code(
+        jinja_env, bucket.code, jinja_env.make_globals(None), None
+    )
+
+
 def passthrough(item: Any) -> Any:
     return item
 
@@ -99,6 +135,12 @@ except ImportError:
     boto3 = None
 
 
+class NotModified(Exception):
+    """
+    Raised by conditional loads when the data didn't change
+    """
+
+
 class Loadable(BaseModel):
     protocol: Protocol = Protocol.http
     serialization: Serialization = Serialization.yaml
@@ -112,6 +154,21 @@ class Loadable(BaseModel):
                 return default
             raise
 
+    def load_if_changed(self, validator: Any = None) -> Tuple[Any, Any]:
+        """
+        Loads the data along with a validator, which identifies the version
+        that was loaded: the ETag or Last-Modified of HTTP responses, the
+        ETag of S3 objects, or the modification time of files. Other
+        protocols have no validator, and are always loaded.
+
+        Given the validator of a previous load, raises NotModified instead
+        of loading the same data again.
+        """
+        loader = conditional_loaders.get(self.protocol)
+        if loader is None:
+            return self.load(), None
+        return loader(self.path, self.serialization, validator)
+
     @staticmethod
     def from_legacy_fmt(s: str) -> "Loadable":
         if "://" not in s:
@@ -154,6 +211,16 @@ def load_file(path: str, loader: Serialization) -> Any:
             raise FileNotFoundError(f"Unable to load {path}")
 
 
+def load_file_if_changed(
+    path: str, loader: Serialization, validator: Any = None
+) -> Tuple[Any, Any]:
+    stat = os.stat(path)
+    modified = (stat.st_mtime_ns, stat.st_size)
+    if modified == validator:
+        raise NotModified(path)
+    return load_file(path, loader), modified
+
+
 def load_package_data(path: str, loader: Serialization) -> Any:
     pkg, pkg_file = path.split(":")
     data = resource_string(pkg, pkg_file)
@@ -169,6 +236,21 @@ def load_http(path: str, loader: Serialization) -> Any:
     return serializers[loader](data)
 
 
+def load_http_if_changed(
+    path: str, loader: Serialization, validator: Any = None
+) -> Tuple[Any, Any]:
+    response = requests.get(path, headers=validator or {})
+    if response.status_code == 304:
+        raise NotModified(path)
+    response.raise_for_status()
+    headers = dict()
+    if etag := response.headers.get("ETag"):
+        headers["If-None-Match"] = etag
+    if last_modified := response.headers.get("Last-Modified"):
+        headers["If-Modified-Since"] = last_modified
+    return serializers[loader](response.text), headers or None
+
+
 def load_env(variable: str, loader: Serialization = Serialization.raw) -> Any:
     data = os.getenv(variable)
     try:
@@ -202,6 +284,28 @@ def load_s3(path: str, loader: Serialization = Serialization.raw) -> Any:
     return serializers[loader](data)
 
 
+def load_s3_if_changed(
+    path: str, loader: Serialization, validator: Any = None
+) -> Tuple[Any, Any]:
+    if isinstance(boto3, type(None)):
+        raise ImportError(
+            "boto3 must be installed to load S3 paths. Use ``pip install sovereign[boto]``"
+        )
+    bucket, key = path.split("/", maxsplit=1)
+    s3 = boto3.client("s3")
+    try:
+        if validator is None:
+            response = s3.get_object(Bucket=bucket, Key=key)
+        else:
+            response = s3.get_object(Bucket=bucket, Key=key, IfNoneMatch=validator)
+    except s3.exceptions.ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("304", "NotModified"):
+            raise NotModified(path)
+        raise
+    data = "".join([chunk.decode() for chunk in response["Body"]])
+    return serializers[loader](data), response.get("ETag")
+
+
 def load_python(path: str, _: Serialization = Serialization.raw) -> ModuleType:
     p = str(Path(path).absolute())
     loader = SourceFileLoader(p, path=p)
@@ -223,3 +327,12 @@ loaders: Dict[Protocol, Callable[[str, Serialization], Union[str, Any]]] = {
     Protocol.python: load_python,
     Protocol.inline: load_inline,
 }
+
+conditional_loaders: Dict[
+    Protocol, Callable[[str, Serialization, Any], Tuple[Any, Any]]
+] = {
+    Protocol.file: load_file_if_changed,
+    Protocol.http: load_http_if_changed,
+    Protocol.https: load_http_if_changed,
+    Protocol.s3: load_s3_if_changed,
+}
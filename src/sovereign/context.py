@@ -1,11 +1,34 @@
-from typing import Dict, Any, Generator, Iterable, NoReturn, Optional
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Mapping,
+    NoReturn,
+    Optional,
+    Tuple,
+)
+import asyncio
+import threading
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from copy import deepcopy
+from functools import partial
 from fastapi import HTTPException
-from sovereign.config_loader import Loadable
-from sovereign.schemas import DiscoveryRequest, XdsTemplate
+from sovereign.config_loader import Loadable, NotModified, Protocol
+from sovereign.schemas import ContextLoadable, DiscoveryRequest, XdsTemplate
 from sovereign.sources import SourcePoller
 from sovereign.utils.crypto import CipherSuite, CipherContainer
-from sovereign.utils.timer import poll_forever, poll_forever_cron
+from sovereign.utils.frozen import FrozenDict, freeze
+from sovereign.utils.lru import LRUCache
+from sovereign.utils.version_info import compute_hash, fingerprint_of
+from sovereign.utils.timer import poll_forever, poll_forever_cron, timed_stage
+
+# Loaded in the calling thread. Modules can't be imported in other threads
+# while the thread that loads the initial context is importing sovereign
+LOADED_IN_PLACE = (Protocol.module, Protocol.python, Protocol.inline, Protocol.env)
 
 
 class TemplateContext:
@@ -13,12 +36,14 @@ class TemplateContext:
         self,
         refresh_rate: Optional[int],
         refresh_cron: Optional[str],
-        configured_context: Dict[str, Loadable],
+        configured_context: Mapping[str, Loadable],
         poller: SourcePoller,
         encryption_suite: CipherContainer,
         disabled_suite: CipherSuite,
         logger: Any,
         stats: Any,
+        cache_size: int = 1024,
+        load_timeout: Optional[float] = None,
     ) -> None:
         self.poller = poller
         self.refresh_rate = refresh_rate
@@ -26,22 +51,93 @@ class TemplateContext:
         self.configured_context = configured_context
         self.crypto = encryption_suite
         self.disabled_suite = disabled_suite
-        # initial load
-        self.context = self.load_context_variables()
         self.logger = logger
         self.stats = stats
+        self.load_timeout = load_timeout
+        # Context variables are loaded in threads, so that loading one doesn't
+        # wait for the others, and a refresh doesn't block the event loop
+        self.executor = ThreadPoolExecutor(thread_name_prefix="context")
+        # Loads by loadable, which a load that timed out is left running in
+        self.loading: Dict[Tuple[str, str, str], "Future[Any]"] = dict()
+        # Last loaded value and validator by loadable, to only load it again
+        # when it changed (see Loadable.load_if_changed)
+        self.loaded: Dict[Tuple[str, str, str], Tuple[Any, Any]] = dict()
+        self._lock = threading.Lock()
+        self.context: Dict[str, Any] = dict()
+        # initial load
+        self.context = self.load_context_variables()
+        # Incremented every time a refresh changes the context
+        self.generation = 0
+        # Same in every process that loaded the same context, unlike the generation
+        self.fingerprints = self.fingerprint_context(self.context)
+        self.fingerprint = compute_hash(self.fingerprints)
+        # Fingerprints of only the variables that each template uses, by checksum
+        self.template_fingerprints: Dict[str, Tuple[str, str]] = dict()
+        # Called after a refresh changed the context
+        self.on_change: List[Callable[[], None]] = []
+        # Contexts built for (node key, hide_private_keys, template variables),
+        # for as long as neither sources nor context change
+        self.built = LRUCache(maxsize=cache_size)
 
-    async def start_refresh_context(self) -> NoReturn:
-        if self.refresh_cron is not None:
-            await poll_forever_cron(self.refresh_cron, self.refresh_context)
-        elif self.refresh_rate is not None:
-            await poll_forever(self.refresh_rate, self.refresh_context)
+    def schedules(self) -> Dict[Tuple[Optional[int], Optional[str]], List[str]]:
+        """
+        Context variables by (refresh_rate, refresh_cron). Variables without
+        a schedule of their own are refreshed on the one of the context.
+        """
+        ret: Dict[Tuple[Optional[int], Optional[str]], List[str]] = defaultdict(list)
+        ret[(self.refresh_rate, self.refresh_cron)] = []
+        for k, v in self.configured_context.items():
+            if isinstance(v, ContextLoadable) and (
+                v.refresh_rate is not None or v.refresh_cron is not None
+            ):
+                ret[(v.refresh_rate, v.refresh_cron)].append(k)
+            else:
+                ret[(self.refresh_rate, self.refresh_cron)].append(k)
+        return ret
 
+    async def start_refresh_context(self) -> NoReturn:
+        await asyncio.gather(
+            *(
+                self.refresh_on_schedule(rate, cron, keys)
+                for (rate, cron), keys in self.schedules().items()
+            )
+        )
         raise RuntimeError("Failed to start refresh_context, this should never happen")
 
-    async def refresh_context(self) -> None:
+    async def refresh_on_schedule(
+        self, refresh_rate: Optional[int], refresh_cron: Optional[str], keys: List[str]
+    ) -> None:
+        refresh = partial(self.refresh_context, keys)
+        if refresh_cron is not None:
+            await poll_forever_cron(refresh_cron, refresh)
+        elif refresh_rate is not None:
+            await poll_forever(refresh_rate, refresh)
+
+    async def refresh_context(self, keys: Optional[Iterable[str]] = None) -> None:
+        """
+        Loads the given context variables again, or all of them.
+        """
         try:
-            self.context = self.load_context_variables()
+            loaded = await asyncio.get_running_loop().run_in_executor(
+                None, self.load_variables, keys
+            )
+            # Variables on other schedules may have been refreshed meanwhile
+            context = {**self.context, **loaded}
+            if context != self.context:
+                fingerprints = self.fingerprint_context(context)
+                self.context = context
+                self.stats.increment(
+                    "context.refresh.changed",
+                    value=sum(
+                        fingerprints.get(k) != self.fingerprints.get(k)
+                        for k in fingerprints.keys() | self.fingerprints.keys()
+                    ),
+                )
+                self.fingerprints = fingerprints
+                self.fingerprint = compute_hash(fingerprints)
+                self.generation += 1
+                for callback in self.on_change:
+                    callback()
             self.stats.increment("context.refresh.success")
         # pylint: disable=broad-except
         except Exception as e:
@@ -49,27 +145,147 @@ class TemplateContext:
             self.stats.increment("context.refresh.error")
 
     def load_context_variables(self) -> Dict[str, Any]:
-        ret = dict()
-        for k, v in self.configured_context.items():
-            if isinstance(v, Loadable):
-                ret[k] = v.load()
-            elif isinstance(v, str):
-                ret[k] = Loadable.from_legacy_fmt(v).load()
+        ret = self.load_variables()
         if "crypto" not in ret:
             ret["crypto"] = self.crypto
         return ret
 
-    def build_new_context_from_instances(self, node_value: str) -> Dict[str, Any]:
-        matches = self.poller.match_node(node_value=node_value)
+    def load_variables(self, keys: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        Loads context variables as read-only values, which every request shares.
+
+        Variables are loaded concurrently, and variables with the same
+        loadable are loaded once. A variable that fails to load, or isn't
+        loaded within ``load_timeout``, keeps its previous value. Without
+        a previous value, the error is raised.
+        """
+        if keys is None:
+            keys = self.configured_context.keys()
+        loadables: Dict[str, Loadable] = dict()
+        for k in keys:
+            v = self.configured_context[k]
+            if isinstance(v, Loadable):
+                loadables[k] = v
+            elif isinstance(v, str):
+                loadables[k] = Loadable.from_legacy_fmt(v)
+        futures = {
+            loadable_key(loadable): self.start_loading(loadable)
+            for loadable in loadables.values()
+        }
+        done, _ = wait(futures.values(), timeout=self.load_timeout)
         ret = dict()
-        for key, value in self.context.items():
+        for k, loadable in loadables.items():
+            future = futures[loadable_key(loadable)]
+            try:
+                if future not in done:
+                    raise TimeoutError(
+                        f"Did not load {loadable.path} within {self.load_timeout}s"
+                    )
+                ret[k] = future.result()
+            except Exception as e:
+                if k not in self.context:
+                    raise
+                self.logger(
+                    event=f"Failed to load template context variable {k}, "
+                    "keeping its previous value",
+                    error=repr(e),
+                )
+                self.stats.increment("context.load.error", tags=[f"key:{k}"])
+                ret[k] = self.context[k]
+        return ret
+
+    def start_loading(self, loadable: Loadable) -> "Future[Any]":
+        """
+        Starts loading the loadable, unless a previous load of it is still
+        running, which is waited for instead.
+        """
+        if loadable.protocol in LOADED_IN_PLACE:
+            future: "Future[Any]" = Future()
             try:
-                ret[key] = deepcopy(value)
-            except TypeError:
-                ret[key] = value
+                future.set_result(self.load_variable(loadable))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        key = loadable_key(loadable)
+        with self._lock:
+            running = self.loading.get(key)
+            if running is None or running.done():
+                running = self.executor.submit(self.load_variable, loadable)
+                self.loading[key] = running
+            return running
+
+    def load_variable(self, loadable: Loadable) -> Any:
+        """
+        Loads the loadable unless it's known not to have changed since the
+        last time, in which case the previously loaded value is returned.
+        """
+        key = loadable_key(loadable)
+        previous = self.loaded.get(key)
+        try:
+            data, validator = loadable.load_if_changed(
+                None if previous is None else previous[1]
+            )
+        except NotModified:
+            assert previous is not None
+            self.stats.increment("context.load.not_modified")
+            return previous[0]
+        value = freeze(data)
+        if validator is not None:
+            self.loaded[key] = (value, validator)
+        return value
+
+    def fingerprint_context(self, context: Dict[str, Any]) -> Dict[str, str]:
+        """
+        Hashes each of the configured context variables. The encryption suite
+        that is added by default is left out, it's derived from static configuration.
+        Variables that weren't loaded again keep their fingerprint.
+        """
+        previous = getattr(self, "fingerprints", {})
+        return {
+            k: (
+                previous[k]
+                if k in previous and v is self.context.get(k)
+                else fingerprint_of(v)
+            )
+            for k, v in context.items()
+            if k in self.configured_context
+        }
+
+    def template_fingerprint(self, template: XdsTemplate) -> str:
+        """
+        Fingerprint of the context variables that the template uses, which
+        doesn't change when only other variables are refreshed.
+        """
+        cached = self.template_fingerprints.get(template.checksum)
+        if cached is not None and cached[0] == self.fingerprint:
+            return cached[1]
+        fingerprint = compute_hash(
+            sorted((k, v) for k, v in self.fingerprints.items() if template.uses(k))
+        )
+        self.template_fingerprints[template.checksum] = (self.fingerprint, fingerprint)
+        return fingerprint
+
+    def build_new_context_from_instances(
+        self, node_value: str, mutable: bool = False
+    ) -> Dict[str, Any]:
+        with timed_stage("match_node"):
+            matches = self.poller.match_node(node_value=node_value)
+        ret = dict()
+        with timed_stage("context"):
+            if mutable:
+                # Copies of the context that the template is free to modify
+                for key, value in self.context.items():
+                    try:
+                        ret[key] = deepcopy(value)
+                    except TypeError:
+                        ret[key] = value
+            else:
+                ret.update(self.context)
 
         to_add = dict()
         for scope, instances in matches.scopes.items():
+            # Shared by every node with the same match key, like the context
+            instances = deepcopy(instances) if mutable else freeze(instances)
             if scope in ("default", None):
                 to_add["instances"] = instances
             else:
@@ -90,14 +306,43 @@ class TemplateContext:
 
     def get_context(
         self, request: DiscoveryRequest, template: XdsTemplate
+    ) -> Dict[str, Any]:
+        """
+        Returns the context to render the template with for the request.
+        Nodes with the same match key share the same (read-only) context,
+        unless the template modifies it.
+        """
+        node_value = self.poller.extract_node_key(request.node)
+        if template.mutable_context:
+            return self.prepare_context(request, template, node_value)
+        variables = template.variables
+        key = (
+            # Match keys can be lists or dicts, e.g. from node metadata
+            compute_hash(node_value),
+            request.hide_private_keys,
+            None if variables is None else frozenset(variables),
+        )
+        generation = (self.poller.generation, self.generation)
+        cached: Optional[Dict[str, Any]] = self.built.get(key, generation)
+        if cached is not None:
+            self.stats.increment("context.build.cache_hit")
+            return cached
+        self.stats.increment("context.build.cache_miss")
+        ret = FrozenDict(self.prepare_context(request, template, node_value))
+        self.built.set(key, ret, generation)
+        return ret
+
+    def prepare_context(
+        self, request: DiscoveryRequest, template: XdsTemplate, node_value: str
     ) -> Dict[str, Any]:
         ret = self.build_new_context_from_instances(
-            node_value=self.poller.extract_node_key(request.node),
+            node_value=node_value,
+            mutable=template.mutable_context,
         )
         if request.hide_private_keys:
             ret["crypto"] = self.disabled_suite
-        if not template.is_python_source:
-            keys_to_remove = self.unused_variables(list(ret), template.jinja_variables)
+        if template.variables is not None:
+            keys_to_remove = self.unused_variables(list(ret), template.variables)
             for key in keys_to_remove:
                 ret.pop(key, None)
         return ret
@@ -112,3 +357,7 @@ class TemplateContext:
 
     def get(self, *args: Any, **kwargs: Any) -> Any:
         return self.context.get(*args, **kwargs)
+
+
+def loadable_key(loadable: Loadable) -> Tuple[str, str, str]:
+    return loadable.protocol.value, loadable.serialization.value, loadable.path
@@ -7,12 +7,20 @@ Functions used to render and return discovery responses to Envoy proxies.
 The templates are configurable. `todo See ref:Configuration#Templates`
 """
 from enum import Enum
-from typing import List, Dict, Any, Optional
+from functools import lru_cache
+from types import ModuleType
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 
 import yaml
 from yaml.parser import ParserError, ScannerError  # type: ignore
 from starlette.exceptions import HTTPException
 
+try:
+    # libyaml bindings, if PyYAML was built with them
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader  # type: ignore[assignment]
+
 try:
     import sentry_sdk
 
@@ -20,9 +28,26 @@ try:
 except ImportError:
     SENTRY_INSTALLED = False
 
-from sovereign import XDS_TEMPLATES, config, logs, template_context
-from sovereign.utils.version_info import compute_hash
-from sovereign.schemas import XdsTemplate, DiscoveryRequest, ProcessedTemplate
+from sovereign import (
+    XDS_TEMPLATES,
+    __version__,
+    config,
+    logs,
+    poller,
+    stats,
+    template_context,
+)
+from sovereign.utils.lru import LRUCache
+from sovereign.utils.timer import timed_stage
+from sovereign.utils.version_info import combine_hashes, compute_hash, digest
+from sovereign.schemas import (
+    CacheStrategy,
+    XdsTemplate,
+    DiscoveryRequest,
+    ProcessedTemplate,
+    Resources,
+    resource_name,
+)
 
 
 try:
@@ -34,6 +59,9 @@ except KeyError:
     )
 
 cache_strategy = config.source_config.cache_strategy
+content_cache = LRUCache(maxsize=config.source_config.content_cache_size)
+# Deserialized templates, by a hash of their rendered text
+parse_cache = LRUCache(maxsize=config.source_config.parse_cache_size)
 
 # Create an enum that bases all the available discovery types off what has been configured
 discovery_types = (_type for _type in sorted(XDS_TEMPLATES["__any__"].keys()))
@@ -41,6 +69,56 @@ discovery_types_base: Dict[str, str] = {t: t for t in discovery_types}
 # TODO: this needs to be typed somehow, but I have no idea how
 DiscoveryTypes = Enum("DiscoveryTypes", discovery_types_base)  # type: ignore
 
+type_urls = {
+    "v2": {
+        "listeners": "type.googleapis.com/envoy.api.v2.Listener",
+        "clusters": "type.googleapis.com/envoy.api.v2.Cluster",
+        "endpoints": "type.googleapis.com/envoy.api.v2.ClusterLoadAssignment",
+        "secrets": "type.googleapis.com/envoy.api.v2.auth.Secret",
+        "routes": "type.googleapis.com/envoy.api.v2.RouteConfiguration",
+        "scoped-routes": "type.googleapis.com/envoy.api.v2.ScopedRouteConfiguration",
+    },
+    "v3": {
+        "listeners": "type.googleapis.com/envoy.config.listener.v3.Listener",
+        "clusters": "type.googleapis.com/envoy.config.cluster.v3.Cluster",
+        "endpoints": "type.googleapis.com/envoy.config.endpoint.v3.ClusterLoadAssignment",
+        "secrets": "type.googleapis.com/envoy.extensions.transport_sockets.tls.v3.Secret",
+        "routes": "type.googleapis.com/envoy.config.route.v3.RouteConfiguration",
+        "scoped-routes": "type.googleapis.com/envoy.config.route.v3.ScopedRouteConfiguration",
+        "runtime": "type.googleapis.com/envoy.service.runtime.v3.Runtime",
+    },
+}
+
+
+class VersionIndex:
+    """
+    Selects the configured template version for an envoy version, which is
+    the last configured version (in order of configuration) that the envoy
+    version starts with, or "default".
+
+    Instead of checking every configured version, only the prefixes of the
+    envoy version that are as long as a configured version are looked up.
+    Selections are memoized per envoy version.
+    """
+
+    def __init__(self, versions: Iterable[str], maxsize: int = 1024) -> None:
+        self.precedence = {version: i for i, version in enumerate(versions)}
+        self.lengths = sorted({len(version) for version in self.precedence})
+        self.select = lru_cache(maxsize=maxsize)(self._select)
+
+    def _select(self, version: str) -> str:
+        matches = [
+            version[:length]
+            for length in self.lengths
+            if length <= len(version) and version[:length] in self.precedence
+        ]
+        if not matches:
+            return "default"
+        return max(matches, key=self.precedence.__getitem__)
+
+
+template_versions = VersionIndex(XDS_TEMPLATES)
+
 
 def select_template(
     request: DiscoveryRequest,
@@ -50,10 +128,7 @@ def select_template(
     if templates is None:
         templates = XDS_TEMPLATES
     version = request.envoy_version
-    selection = "default"
-    for v in templates.keys():
-        if version.startswith(v):
-            selection = v
+    selection = select_version(version, templates)
     selected_version = templates[selection]
     try:
         resource_type = discovery_type
@@ -65,7 +140,21 @@ def select_template(
         )
 
 
-def response(request: DiscoveryRequest, xds_type: str) -> ProcessedTemplate:
+def select_version(
+    version: str, templates: Optional[Dict[str, Dict[str, XdsTemplate]]] = None
+) -> str:
+    """
+    Returns the name of the configured template version that should be
+    used for the given envoy version
+    """
+    if templates is None or templates is XDS_TEMPLATES:
+        return template_versions.select(version)
+    return VersionIndex(templates).select(version)
+
+
+def response(
+    request: DiscoveryRequest, xds_type: str, type_url: Optional[str] = None
+) -> ProcessedTemplate:
     """
     A Discovery **Request** typically looks something like:
 
@@ -92,20 +181,114 @@ def response(request: DiscoveryRequest, xds_type: str) -> ProcessedTemplate:
             "resources": []
         }
 
-    The version_info is derived from :func:`sovereign.discovery.version_hash`
+    With the ``context`` cache strategy, the version_info is derived from
+    everything that goes into rendering the response
+    (see :func:`sovereign.discovery.input_version`), so that clients which
+    are already up-to-date can be answered without rendering anything.
+    With the ``content`` cache strategy it is derived from the rendered
+    resources instead, and renders are cached for unchanged inputs.
 
     :param request: An envoy Discovery Request
     :param xds_type: what type of XDS template to use when rendering
+    :param type_url: added as ``@type`` to resources which do not specify one
     :return: An envoy Discovery Response
     """
+    processed = cached_response(request, xds_type, type_url)
+    if processed is None:
+        processed = rendered_response(request, xds_type, type_url)
+    return processed
+
+
+def cached_response(
+    request: DiscoveryRequest, xds_type: str, type_url: Optional[str] = None
+) -> Optional[ProcessedTemplate]:
+    """
+    Returns the response if it can be determined without rendering, because
+    the client is up-to-date or the content was already rendered.
+    Otherwise returns None, and :func:`rendered_response` has to be used.
+    """
     template: XdsTemplate = select_template(request, xds_type)
+    if cache_strategy == CacheStrategy.content:
+        key = content_cache_key(request, xds_type, template, type_url)
+        # Changes to sources and template context are covered by the key,
+        # only for the matched instances and context variables that the template uses
+        processed = content_cache.get(key)
+        if processed is None:
+            stats.increment(f"discovery.{xds_type}.cache_miss")
+            return None
+        stats.increment(f"discovery.{xds_type}.cache_hit")
+        return skip_unchanged(request, processed)
+
+    version_info = input_version(request, xds_type, template, type_url)
+    if version_info == request.version_info and not config.discovery_cache.enabled:
+        stats.increment(f"discovery.{xds_type}.unchanged")
+        return ProcessedTemplate(version_info=version_info, resources=[])
+    return None
+
+
+def rendered_response(
+    request: DiscoveryRequest, xds_type: str, type_url: Optional[str] = None
+) -> ProcessedTemplate:
+    key = render_key(request, xds_type, type_url)
+    processed = render_response(request, xds_type, type_url)
+    return store_response(request, processed, key)
+
+
+def render_response(
+    request: DiscoveryRequest, xds_type: str, type_url: Optional[str] = None
+) -> ProcessedTemplate:
+    """
+    Renders the response to the request, versioned according to the cache strategy
+    """
+    template: XdsTemplate = select_template(request, xds_type)
+    if cache_strategy == CacheStrategy.content:
+        return render(request, template, type_url)
+    version_info = input_version(request, xds_type, template, type_url)
+    return render(request, template, type_url, version_info)
+
+
+def store_response(
+    request: DiscoveryRequest, processed: ProcessedTemplate, key: Tuple[Any, ...]
+) -> ProcessedTemplate:
+    """
+    Caches a rendered response when using the content strategy, under the
+    key of the inputs it was rendered from (see :func:`render_key`).
+    """
+    if cache_strategy == CacheStrategy.content:
+        content_cache.set(key, processed)
+    return skip_unchanged(request, processed)
+
+
+def skip_unchanged(
+    request: DiscoveryRequest, processed: ProcessedTemplate
+) -> ProcessedTemplate:
+    # Early return if the template is identical
+    if (
+        processed.version_info == request.version_info
+        and not config.discovery_cache.enabled
+    ):
+        return ProcessedTemplate(version_info=processed.version_info, resources=[])
+    return processed
+
+
+def render(
+    request: DiscoveryRequest,
+    template: XdsTemplate,
+    type_url: Optional[str] = None,
+    version_info: Optional[str] = None,
+) -> ProcessedTemplate:
+    """
+    Renders the template for the request. Unless a version is given,
+    the result is versioned by its content.
+    """
     context = dict(
         discovery_request=request,
         host_header=request.desired_controlplane,
         resource_names=request.resources,
         **template_context.get_context(request, template),
     )
-    content = template(**context)
+    with timed_stage("render"):
+        content = template(**context)
 
     # Deserialize YAML output from Jinja2
     if not template.is_python_source:
@@ -113,22 +296,155 @@ def response(request: DiscoveryRequest, xds_type: str) -> ProcessedTemplate:
             raise RuntimeError(
                 f"Attempting to deserialize potential non-string data: {content}"
             )
-        content = deserialize_config(content)
-
-    # Early return if the template is identical
-    config_version = compute_hash(content)
-    if config_version == request.version_info and not config.discovery_cache.enabled:
-        return ProcessedTemplate(version_info=config_version, resources=[])
+        with timed_stage("deserialize"):
+            content = deserialize_config(content)
 
     if not isinstance(content, dict):
         raise RuntimeError(f"Attempting to filter unstructured data: {content}")
-    resources = filter_resources(content["resources"], request.resources)
-    return ProcessedTemplate(resources=resources, version_info=config_version)
+    resources = content["resources"]
+    if type_url is not None:
+        with timed_stage("inject_type"):
+            # Deserialized templates are shared, so resources are copied rather than modified.
+            # Resources that were encoded by a Python template must include their own @type
+            resources = [
+                resource
+                if isinstance(resource, bytes) or resource.get("@type")
+                else {**resource, "@type": type_url}
+                for resource in resources
+            ]
+    processed = ProcessedTemplate(resources=resources, version_info=version_info)
+    if version_info is None:
+        with timed_stage("hash"):
+            processed.version_info = content_version(content, processed)
+    with timed_stage("filter"):
+        return filter_template(processed, request.resources)
+
+
+def input_version(
+    request: DiscoveryRequest,
+    xds_type: str,
+    template: XdsTemplate,
+    type_url: Optional[str] = None,
+) -> str:
+    """
+    Versions a response by its inputs: the template, the template context
+    variables and the instances matched for the node that it uses, and the
+    relevant fields of the request
+    (see :attr:`sovereign.schemas.DiscoveryRequest.uid`).
+
+    Only fingerprints of content are used, so every process arrives at the
+    same version for the same inputs.
+    """
+    with timed_stage("hash"):
+        return compute_hash(content_cache_key(request, xds_type, template, type_url))
+
+
+def content_version(content: Dict[str, Any], processed: ProcessedTemplate) -> str:
+    """
+    Versions rendered content by combining the hashes of every resource with
+    a hash of anything else the template returned. The resource hashes come
+    from the same serialization that is used in responses.
+    """
+    remainder = {key: value for key, value in content.items() if key != "resources"}
+    return combine_hashes([compute_hash(remainder), *processed.resource_hashes])
+
+
+def content_generation() -> Tuple[int, int]:
+    """
+    Rendered content can only change when the sources or the template context
+    change, so anything rendered is tied to both of their generations.
+    """
+    return poller.generation, template_context.generation
+
+
+def matched_instances_fingerprint(
+    request: DiscoveryRequest, template: XdsTemplate
+) -> Tuple[Any, ...]:
+    """
+    Fingerprint of the instances that the template receives for this node,
+    which only changes when those particular instances change.
+    Nodes that don't use a known match key fall back to a fingerprint of
+    all the sources.
+    """
+    node_value = poller.extract_node_key(request.node)
+    fingerprint = poller.match_fingerprint(node_value, include=template.uses_scope)
+    if fingerprint is None:
+        return str(node_value), poller.fingerprint
+    return (fingerprint,)
+
+
+def version_salt() -> str:
+    """
+    A hash of what responses depend on besides their inputs, which doesn't
+    change for the life of the process: the version of sovereign, its
+    configuration (such as legacy_fields, used by sovereign.utils.eds), and
+    the code of modules in the template context, which are only hashed by name.
+    """
+    modules = dict()
+    for name, value in sorted(template_context.context.items()):
+        if not isinstance(value, ModuleType):
+            continue
+        try:
+            with open(str(value.__file__), "rb") as f:
+                modules[name] = digest(f.read())
+        except (AttributeError, OSError):
+            modules[name] = value.__name__
+    return compute_hash(__version__, digest(config.json().encode()), modules)
+
+
+salt = version_salt()
+
+
+def content_cache_key(
+    request: DiscoveryRequest,
+    xds_type: str,
+    template: XdsTemplate,
+    type_url: Optional[str],
+) -> Tuple[Any, ...]:
+    """
+    Identifies a render by the template, the instances and context variables
+    that it uses for the node, and the parts of the request that adjacent
+    proxies share, along with the version salt.
+    """
+    return (
+        salt,
+        xds_type,
+        type_url,
+        template.checksum,
+        matched_instances_fingerprint(request, template),
+        template_context.template_fingerprint(template),
+        request.uid,
+        request.hide_private_keys,
+    )
+
+
+def render_key(
+    request: DiscoveryRequest, xds_type: str, type_url: Optional[str] = None
+) -> Tuple[Any, ...]:
+    """
+    Identifies renders of identical responses, which can be shared by
+    requests that are being answered at the same time. It has to be
+    determined before rendering, in case the inputs change in the meantime.
+    """
+    template = select_template(request, xds_type)
+    return content_cache_key(request, xds_type, template, type_url)
 
 
 def deserialize_config(content: str) -> Dict[str, Any]:
+    """
+    Parses the YAML output of a template.
+
+    Proxies often render identical text, so the result is cached by a hash
+    of the text and shared between renders. It must not be modified.
+    """
+    key = digest(content.encode())
+    envoy_configuration = parse_cache.get(key)
+    if envoy_configuration is not None:
+        stats.increment("discovery.deserialize.cache_hit")
+        return envoy_configuration  # type: ignore[no-any-return]
+    stats.increment("discovery.deserialize.cache_miss")
     try:
-        envoy_configuration = yaml.safe_load(content)
+        envoy_configuration = yaml.load(content, Loader=SafeLoader)
     except (ParserError, ScannerError) as e:
         logs.queue_log_fields(
             error=repr(e),
@@ -152,24 +468,45 @@ def deserialize_config(content: str) -> Dict[str, Any]:
         raise RuntimeError(
             f"Deserialized configuration is of unexpected format: {envoy_configuration}"
         )
+    parse_cache.set(key, envoy_configuration)
     return envoy_configuration
 
 
 def filter_resources(
-    generated: List[Dict[str, Any]], requested: List[str]
+    generated: List[Dict[str, Any]],
+    requested: List[str],
+    index: Optional[Dict[str, List[int]]] = None,
 ) -> List[Dict[str, Any]]:
     """
     If Envoy specifically requested a resource, this removes everything
     that does not match the name of the resource.
     If Envoy did not specifically request anything, every resource is retained.
+
+    When given an index of resource positions by name (see
+    :attr:`sovereign.schemas.ProcessedTemplate.index`) only the requested
+    names are looked up, instead of checking every generated resource.
     """
-    return [resource for resource in generated if resource_name(resource) in requested]
+    if index is None:
+        return [
+            resource for resource in generated if resource_name(resource) in requested
+        ]
+    if isinstance(requested, Resources) and len(requested) == 0:
+        return list(generated)
+    return [generated[position] for position in requested_positions(index, requested)]
+
+
+def filter_template(
+    processed: ProcessedTemplate, requested: List[str]
+) -> ProcessedTemplate:
+    """
+    Same as :func:`filter_resources`, but keeps the serialized
+    resources of the template so that they can be reused.
+    """
+    if isinstance(requested, Resources) and len(requested) == 0:
+        return processed
+    return processed.select(requested_positions(processed.index, requested))
 
 
-def resource_name(resource: Dict[str, Any]) -> str:
-    name = resource.get("name") or resource.get("cluster_name")
-    if isinstance(name, str):
-        return name
-    raise KeyError(
-        f"Failed to determine the name or cluster_name of the following resource: {resource}"
-    )
+def requested_positions(index: Dict[str, List[int]], requested: List[str]) -> List[int]:
+    positions = {position for name in requested for position in index.get(name, ())}
+    return sorted(positions)
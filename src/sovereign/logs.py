@@ -102,6 +102,10 @@ class LoggerBootstrapper:
         self._ensure_threadlocal()
         LOG_QUEUE.fields.update(kwargs)
 
+    def get_log_fields(self) -> Dict[str, Any]:
+        self._ensure_threadlocal()
+        return dict(LOG_QUEUE.fields)
+
     def configured_log_format(
         self, format: Optional[Dict[str, str]] = _configured_log_fmt
     ) -> Dict[str, str]:
@@ -0,0 +1,299 @@
+"""
+Rendering
+---------
+
+Renders discovery responses away from the event loop, either in a pool of
+threads or a pool of worker processes (see ``rendering`` in the configuration).
+
+Worker processes aren't limited by the GIL of the process serving requests.
+Instead of sending the sources and template context along with every
+render, they are written to a file once per generation (in /dev/shm when
+available), which the workers memory-map and load when they are handed a
+new one. Template context variables that can't be pickled, such as
+modules, are loaded by the workers themselves. Workers send back only the
+serialized response, resources and their hashes, rather than the resources.
+"""
+import asyncio
+import atexit
+import mmap
+import multiprocessing
+import os
+import pickle
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from starlette.exceptions import HTTPException
+
+from sovereign import config, discovery, logs, poller, stats, template_context
+from sovereign.schemas import (
+    DiscoveryRequest,
+    ProcessedTemplate,
+    RenderExecutor,
+    RenderingConfiguration,
+)
+from sovereign.utils.executor import BoundedExecutor
+from sovereign.utils.singleflight import SingleFlight
+from sovereign.utils.timer import timed_stage
+
+
+class Renderer:
+    def __init__(self, executor: BoundedExecutor) -> None:
+        self.executor = executor
+        # Identical requests that arrive together, such as when proxies of the
+        # same cluster poll after a change, wait for the same render
+        self.in_flight = SingleFlight(stats)
+
+    async def rendered_response(
+        self, request: DiscoveryRequest, xds_type: str, type_url: Optional[str]
+    ) -> ProcessedTemplate:
+        key = discovery.render_key(request, xds_type, type_url)
+        processed = await self.in_flight.run(
+            key, self.render, request, xds_type, type_url
+        )
+        return discovery.store_response(request, processed, key)
+
+    async def render(
+        self, request: DiscoveryRequest, xds_type: str, type_url: Optional[str]
+    ) -> ProcessedTemplate:
+        return await self.executor.run(render_serialized, request, xds_type, type_url)
+
+
+class SharedState:
+    """
+    The sources and template context of this process, written to a file for
+    render workers. A new file is written for every generation, and removed
+    once no render is using it anymore.
+    """
+
+    def __init__(self, directory: Optional[str] = None) -> None:
+        if directory is None:
+            directory = "/dev/shm"
+        if not os.path.isdir(directory):
+            directory = tempfile.gettempdir()
+        self.directory = directory
+        self.path: Optional[str] = None
+        self.generation: Any = None
+        self.users: Dict[str, int] = dict()
+        self._lock = threading.Lock()
+        # Held while writing a generation, so that releases don't wait for it
+        self._writing = threading.Lock()
+        atexit.register(self.close)
+
+    def write(self) -> str:
+        context = dict()
+        for key, value in template_context.context.items():
+            if key not in template_context.configured_context:
+                continue
+            try:
+                context[key] = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            except (pickle.PicklingError, TypeError, AttributeError):
+                continue
+        state = dict(
+            sources=poller.source_data_modified,
+            match_fingerprints=poller.match_fingerprints,
+            fingerprint=poller.fingerprint,
+            generation=poller.generation,
+            context=context,
+            context_fingerprints=template_context.fingerprints,
+            context_fingerprint=template_context.fingerprint,
+            context_generation=template_context.generation,
+        )
+        fd, path = tempfile.mkstemp(
+            prefix=f"sovereign-{os.getpid()}-", suffix=".state", dir=self.directory
+        )
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        stats.increment("render.shared_state.written")
+        return path
+
+    def acquire(self) -> str:
+        """
+        Returns the file holding the current generation, which must be
+        released once the render is done.
+        """
+        if not hasattr(poller, "source_data_modified"):
+            poller.poll()
+        with self._writing:
+            generation = discovery.content_generation()
+            path = self.path
+            if path is None or generation != self.generation:
+                path = self.write()
+                with self._lock:
+                    previous, self.path = self.path, path
+                    self.generation = generation
+                    if previous is not None and previous not in self.users:
+                        remove(previous)
+            with self._lock:
+                self.users[path] = self.users.get(path, 0) + 1
+                return path
+
+    def release(self, path: str) -> None:
+        with self._lock:
+            self.users[path] -= 1
+            if self.users[path] == 0:
+                del self.users[path]
+                if path != self.path:
+                    remove(path)
+
+    def close(self) -> None:
+        with self._lock:
+            for path in {self.path, *self.users}:
+                if path is not None:
+                    remove(path)
+            self.path = None
+            self.users.clear()
+
+
+class WorkerHTTPException(Exception):
+    """
+    HTTPExceptions can't be unpickled, so workers send them back as this
+    """
+
+    def __init__(self, status_code: int, detail: Any) -> None:
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class ProcessRenderer(Renderer):
+    def __init__(self, executor: BoundedExecutor, shared: SharedState) -> None:
+        super().__init__(executor)
+        self.shared = shared
+
+    async def render(
+        self, request: DiscoveryRequest, xds_type: str, type_url: Optional[str]
+    ) -> ProcessedTemplate:
+        path = await self.acquire()
+        try:
+            version, rendered, fragments, hashes = await self.executor.run(
+                render_in_worker, path, request, xds_type, type_url
+            )
+        except WorkerHTTPException as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        finally:
+            self.shared.release(path)
+        return ProcessedTemplate(
+            # Decoded from the fragments if needed
+            resources=fragments,
+            version_info=version,
+            fragments=list(fragments),
+            hashes=list(hashes),
+            rendered=rendered,
+        )
+
+    async def acquire(self) -> str:
+        """
+        Acquires the shared state in a thread, since writing a new
+        generation would hold up the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(None, self.shared.acquire)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # It's acquired anyway, and must still be released
+            future.add_done_callback(self._release_acquired)
+            raise
+
+    def _release_acquired(self, future: "asyncio.Future[str]") -> None:
+        if not future.cancelled() and future.exception() is None:
+            self.shared.release(future.result())
+
+
+def remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# Path of the shared state that a worker process has loaded
+attached: Optional[str] = None
+
+
+def attach(path: str) -> None:
+    """
+    Replaces the sources and template context of this (worker) process
+    with the ones in the shared state file, unless it was already loaded.
+    """
+    global attached
+    if path == attached:
+        return
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as shared:
+            state = pickle.loads(shared)
+    poller.source_data = state["sources"]
+    poller.source_data_modified = state["sources"]
+    poller.match_fingerprints = state["match_fingerprints"]
+    poller.fingerprint = state["fingerprint"]
+    poller.generation = state["generation"]
+    context = dict(template_context.context)
+    for key, value in state["context"].items():
+        context[key] = pickle.loads(value)
+    template_context.context = context
+    template_context.fingerprints = state["context_fingerprints"]
+    template_context.fingerprint = state["context_fingerprint"]
+    template_context.generation = state["context_generation"]
+    attached = path
+
+
+def render_serialized(
+    request: DiscoveryRequest, xds_type: str, type_url: Optional[str]
+) -> ProcessedTemplate:
+    processed = discovery.render_response(request, xds_type, type_url)
+    # Serialized by the executor as well, rather than on the event loop
+    with timed_stage("serialize"):
+        _ = processed.rendered
+    return processed
+
+
+# The version, rendered response, serialized resources and their hashes
+WorkerResult = Tuple[str, bytes, List[bytes], List[str]]
+
+
+def render_in_worker(
+    path: str, request: DiscoveryRequest, xds_type: str, type_url: Optional[str]
+) -> WorkerResult:
+    attach(path)
+    # Sources are kept up-to-date by the parent process
+    poller.last_updated = datetime.now()
+    try:
+        processed = render_serialized(request, xds_type, type_url)
+    except HTTPException as e:
+        raise WorkerHTTPException(e.status_code, e.detail)
+    return (
+        processed.version,
+        processed.rendered,
+        processed.fragments,
+        processed.resource_hashes,
+    )
+
+
+def configure_renderer(rendering: RenderingConfiguration) -> Renderer:
+    if rendering.executor == RenderExecutor.process:
+        pool = ProcessPoolExecutor(
+            max_workers=rendering.concurrency,
+            # Forking a process with running threads and an event loop isn't safe
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        executor = BoundedExecutor(
+            pool,
+            logs,
+            stats,
+            concurrency=rendering.concurrency,
+            max_queued=rendering.max_queued,
+        )
+        return ProcessRenderer(executor, SharedState(rendering.shared_state_directory))
+    if rendering.executor == RenderExecutor.thread:
+        return Renderer(
+            BoundedExecutor.threads(
+                rendering.concurrency, logs, stats, max_queued=rendering.max_queued
+            )
+        )
+    return Renderer(BoundedExecutor(None, logs, stats))
+
+
+renderer = configure_renderer(config.rendering)
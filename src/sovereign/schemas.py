@@ -1,3 +1,5 @@
+import inspect
+import json
 from os import getenv
 import warnings
 import multiprocessing
@@ -11,12 +13,33 @@ from pydantic import (
     validator,
     root_validator,
 )
-from typing import List, Any, Dict, Union, Optional, Tuple, Type
+from typing import (
+    List,
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Sequence,
+    Union,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+)
+from functools import cached_property, lru_cache
 from types import ModuleType
-from jinja2 import meta, Template
+from jinja2 import meta, nodes, Template
 from fastapi.responses import JSONResponse
-from sovereign.config_loader import jinja_env, Serialization, Protocol, Loadable
-from sovereign.utils.version_info import compute_hash
+from sovereign.config_loader import (
+    jinja_env,
+    compile_template,
+    Serialization,
+    Protocol,
+    Loadable,
+)
+from sovereign.utils.compression import compressors
+from sovereign.utils.version_info import canonical_json, compute_hash, digest
 from croniter import croniter, CroniterBadCronError
 
 missing_arguments = {"missing", "positional", "arguments:"}
@@ -43,6 +66,12 @@ class CacheStrategy(str, Enum):
     content = "content"
 
 
+class RenderExecutor(str, Enum):
+    inline = "inline"
+    thread = "thread"
+    process = "process"
+
+
 class SourceData(BaseModel):
     scopes: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
 
@@ -122,24 +151,52 @@ class DiscoveryCacheConfig(BaseModel):
         return values
 
 
+def call_parameters(fn: Callable[..., Any]) -> Optional[Set[str]]:
+    """
+    Names of the parameters that can be passed to the function by keyword,
+    or None if it accepts arbitrary keyword arguments.
+    """
+    parameters = inspect.signature(fn).parameters.values()
+    if any(p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters):
+        return None
+    return {
+        p.name
+        for p in parameters
+        if p.kind
+        in (inspect.Parameter.POSITIONAL_OR_KEYWORD, inspect.Parameter.KEYWORD_ONLY)
+    }
+
+
 class XdsTemplate:
-    def __init__(self, path: Union[str, Loadable]) -> None:
+    def __init__(
+        self, path: Union[str, Loadable], mutable_context: bool = False
+    ) -> None:
+        # Templates share read-only context, unless they modify it
+        self.mutable_context = mutable_context
         if isinstance(path, str):
             self.loadable: Loadable = Loadable.from_legacy_fmt(path)
         elif isinstance(path, Loadable):
             self.loadable = path
         self.is_python_source = self.loadable.protocol == Protocol.python
         self.source = self.load_source()
-        template_ast = jinja_env.parse(self.source)
-        self.jinja_variables = meta.find_undeclared_variables(template_ast)
+        self.checksum = compute_hash(self.source)
+        self.code: Union[Template, ModuleType]
+        self.jinja_variables: Set[str] = set()
+        self.template_ast: Optional[nodes.Template] = None
+        if not self.is_python_source:
+            # Kept until the template is compiled, so that it's only parsed once
+            self.template_ast = jinja_env.parse(self.source)
+            self.jinja_variables = meta.find_undeclared_variables(self.template_ast)
 
     def __call__(
         self, *args: Any, **kwargs: Any
     ) -> Optional[Union[Dict[str, Any], str]]:
         if not hasattr(self, "code"):
-            self.code: Union[Template, ModuleType] = self.loadable.load()
+            self.code = self.compile()
         if isinstance(self.code, ModuleType):
             try:
+                # Python templates may return or yield resources as dicts, or
+                # as JSON they already encoded (bytes), which is used as-is
                 return {"resources": list(self.code.call(*args, **kwargs))}
             except TypeError as e:
                 if not set(str(e).split()).issuperset(missing_arguments):
@@ -155,6 +212,41 @@ class XdsTemplate:
         else:
             return self.code.render(*args, **kwargs)
 
+    def compile(self) -> Any:
+        if self.loadable.serialization not in (
+            Serialization.jinja,
+            Serialization.jinja2,
+        ):
+            return self.loadable.load()
+        code = compile_template(self.source, self.checksum, self.template_ast)
+        self.template_ast = None
+        return code
+
+    @cached_property
+    def variables(self) -> Optional[Set[str]]:
+        """
+        Names of the variables that the template uses, or None if it may use
+        any variable. For Python templates these are the parameters of
+        ``call``, unless it accepts arbitrary keyword arguments.
+        """
+        if not self.is_python_source:
+            return self.jinja_variables
+        if not hasattr(self, "code"):
+            self.code = self.compile()
+        if isinstance(self.code, ModuleType):
+            return call_parameters(self.code.call)
+        return None
+
+    def uses(self, variable: str) -> bool:
+        variables = self.variables
+        return variables is None or variable in variables
+
+    def uses_scope(self, scope: str) -> bool:
+        """
+        Whether the instances of a source scope are used by this template.
+        """
+        return self.uses("instances" if scope in ("default", None) else scope)
+
     def load_source(self) -> str:
         if self.loadable.serialization in (Serialization.jinja, Serialization.jinja2):
             # The Jinja2 template serializer does not properly set a name
@@ -186,35 +278,202 @@ class XdsTemplate:
         return f"XdsTemplate({self.loadable=}, {self.is_python_source=}, {self.source=}, {self.jinja_variables=})"
 
 
+def resource_name(resource: Dict[str, Any]) -> str:
+    name = resource.get("name") or resource.get("cluster_name")
+    if isinstance(name, str):
+        return name
+    raise KeyError(
+        f"Failed to determine the name or cluster_name of the following resource: {resource}"
+    )
+
+
+def serialize_json(content: Any) -> bytes:
+    return JsonResponseClass(content="").render(content)
+
+
+# A resource, or a resource that a Python template has already encoded as JSON
+Resource = Union[Dict[str, Any], bytes]
+
+
 class ProcessedTemplate:
     def __init__(
         self,
-        resources: List[Dict[str, Any]],
+        resources: Sequence[Resource],
         version_info: Optional[str],
+        fragments: Optional[List[Optional[bytes]]] = None,
+        hashes: Optional[List[Optional[str]]] = None,
+        rendered: Optional[bytes] = None,
     ) -> None:
-        self.resources = resources
+        self._resources = resources
+        self._encoded = any(isinstance(resource, bytes) for resource in resources)
         self.version_info = version_info
-        self._rendered: Optional[bytes] = None
+        self._rendered = rendered
+        # self.rendered compressed with each content-coding, see self.compressed
+        self._compressed: Dict[str, bytes] = dict()
+        self._index: Optional[Dict[str, List[int]]] = None
+        # Each resource serialized to JSON on its own, see self.fragment
+        if fragments is None:
+            fragments = [
+                resource if isinstance(resource, bytes) else None
+                for resource in resources
+            ]
+        self._fragments = fragments
+        if hashes is None:
+            hashes = [None] * len(resources)
+        self._hashes = hashes
+
+    @property
+    def resources(self) -> List[Dict[str, Any]]:
+        """
+        Resources that were already encoded by the template are only
+        decoded if needed, for example to look up their names.
+        """
+        if self._encoded:
+            self._resources = [
+                json.loads(resource) if isinstance(resource, bytes) else resource
+                for resource in self._resources
+            ]
+            self._encoded = False
+        return self._resources  # type: ignore[return-value]
+
+    @property
+    def count(self) -> int:
+        return len(self._resources)
 
     @property
     def version(self) -> str:
         return self.version_info or compute_hash(self.resources)
 
+    @property
+    def index(self) -> Dict[str, List[int]]:
+        """
+        Positions of the resources by name, built once and reused
+        every time these resources are filtered.
+        """
+        if self._index is None:
+            index: Dict[str, List[int]] = defaultdict(list)
+            for position, resource in enumerate(self.resources):
+                index[resource_name(resource)].append(position)
+            self._index = dict(index)
+        return self._index
+
+    def fragment(self, position: int) -> bytes:
+        """
+        The resource at the given position, serialized to (canonical) JSON
+        only the first time it is needed by any response or hash.
+        """
+        fragment = self._fragments[position]
+        if fragment is None:
+            fragment = canonical_json(self._resources[position])
+            self._fragments[position] = fragment
+        return fragment
+
+    @property
+    def fragments(self) -> List[bytes]:
+        return [self.fragment(position) for position in range(self.count)]
+
+    def resource_hash(self, position: int) -> str:
+        resource_hash = self._hashes[position]
+        if resource_hash is None:
+            resource_hash = digest(self.fragment(position))
+            self._hashes[position] = resource_hash
+        return resource_hash
+
+    @property
+    def resource_hashes(self) -> List[str]:
+        return [self.resource_hash(position) for position in range(self.count)]
+
+    def select(self, positions: Iterable[int]) -> "ProcessedTemplate":
+        """
+        Returns a template with a subset of these resources,
+        which shares their serialized fragments.
+        """
+        positions = list(positions)
+        return ProcessedTemplate(
+            resources=[self._resources[position] for position in positions],
+            version_info=self.version_info,
+            fragments=[self.fragment(position) for position in positions],
+            hashes=[self._hashes[position] for position in positions],
+        )
+
     @property
     def rendered(self) -> bytes:
         if self._rendered is None:
-            result = JsonResponseClass(content="").render(
-                content={
-                    "version_info": self.version,
-                    "resources": self.resources,
-                }
+            self._rendered = b"".join(
+                [
+                    b'{"version_info":',
+                    serialize_json(self.version),
+                    b',"resources":[',
+                    b",".join(self.fragments),
+                    b"]}",
+                ]
             )
-            self._rendered = result
         return self._rendered
 
+    def compressed(self, encoding: str) -> bytes:
+        """
+        The rendered response, compressed with the given content-coding
+        the first time that it's requested with it.
+        """
+        content = self._compressed.get(encoding)
+        if content is None:
+            content = compressors[encoding](self.rendered)
+            self._compressed[encoding] = content
+        return content
+
     def deserialize_resources(self) -> List[Dict[str, Any]]:
         return self.resources
 
+    def delta(self, versions: Dict[str, str]) -> Tuple[List[str], List[str]]:
+        """
+        Compares these resources with the versions of resources that a client
+        has, by name, and returns the names of the resources that were added or
+        changed, and the names of the resources that were removed.
+        The version of each resource is its hash.
+        """
+        changed = [
+            name
+            for name, positions in self.index.items()
+            if versions.get(name) != self.resource_hash(positions[-1])
+        ]
+        removed = [name for name in versions if name not in self.index]
+        return changed, removed
+
+    def rendered_delta(
+        self, changed: List[str], removed: List[str], system_version_info: str
+    ) -> bytes:
+        """
+        A delta discovery response for the given (changed) resource names,
+        built from the same serialized resources as :attr:`rendered`.
+        """
+        resources = []
+        for name in changed:
+            position = self.index[name][-1]
+            resources.append(
+                b"".join(
+                    [
+                        b'{"name":',
+                        serialize_json(name),
+                        b',"version":"',
+                        self.resource_hash(position).encode(),
+                        b'","resource":',
+                        self.fragment(position),
+                        b"}",
+                    ]
+                )
+            )
+        return b"".join(
+            [
+                b'{"system_version_info":',
+                serialize_json(system_version_info),
+                b',"resources":[',
+                b",".join(resources),
+                b'],"removed_resources":',
+                serialize_json(removed),
+                b"}",
+            ]
+        )
+
 
 class Locality(BaseModel):
     region: str = Field(None)
@@ -283,12 +542,19 @@ class Resources(List[str]):
     """
     Acts like a regular list except it returns True
     for all membership tests when empty.
+
+    Membership tests are answered by a set of the names, taken when the list
+    is created, so the list should not be modified afterwards.
     """
 
+    def __init__(self, *args: Any) -> None:
+        super().__init__(*args)
+        self.names: FrozenSet[str] = frozenset(self)
+
     def __contains__(self, item: object) -> bool:
         if len(self) == 0:
             return True
-        return item in list(self)
+        return item in self.names
 
 
 class Status(BaseModel):
@@ -297,6 +563,25 @@ class Status(BaseModel):
     details: List[Any]
 
 
+@lru_cache(maxsize=1024)
+def envoy_version(
+    major_number: int, minor_number: int, patch: int, build_version: Optional[str]
+) -> str:
+    """
+    The version of envoy, from its user agent build version if it has one,
+    otherwise from its build version string. Memoized, since every proxy
+    running the same build sends the same versions.
+    """
+    if (major_number, minor_number, patch) != (0, 0, 0):
+        return f"{major_number}.{minor_number}.{patch}"
+    try:
+        _, version, *_ = build_version.split("/")  # type: ignore[union-attr]
+    except (AttributeError, ValueError):
+        # TODO: log/metric this?
+        return "default"
+    return version
+
+
 class DiscoveryRequest(BaseModel):
     node: Node = Field(..., title="Node information about the envoy proxy")
     version_info: str = Field(
@@ -318,17 +603,13 @@ class DiscoveryRequest(BaseModel):
 
     @property
     def envoy_version(self) -> str:
-        try:
-            version = str(self.node.user_agent_build_version.version)
-            assert version != "0.0.0"
-        except AssertionError:
-            try:
-                build_version = self.node.build_version
-                _, version, *_ = build_version.split("/")
-            except (AttributeError, ValueError):
-                # TODO: log/metric this?
-                return "default"
-        return version
+        version = self.node.user_agent_build_version.version
+        return envoy_version(
+            version.major_number,
+            version.minor_number,
+            version.patch,
+            self.node.build_version,
+        )
 
     @property
     def resources(self) -> Resources:
@@ -343,6 +624,65 @@ class DiscoveryRequest(BaseModel):
         )
 
 
+class DeltaDiscoveryRequest(BaseModel):
+    node: Node = Field(..., title="Node information about the envoy proxy")
+    resource_names_subscribe: Resources = Field(
+        Resources(), title="List of requested resource names"
+    )
+    initial_resource_versions: Dict[str, str] = Field(
+        default_factory=dict,
+        title="Versions of the resources that the client already has, by name",
+    )
+    system_version_info: str = Field(
+        "",
+        title="The system_version_info of the last response that the client applied",
+        description="Allows answering with a 304 without comparing each resource",
+    )
+    hide_private_keys: bool = False
+    type_url: Optional[str] = Field(
+        None, title="The corresponding type_url for the requested resource"
+    )
+    desired_controlplane: str = Field(
+        None, title="The host header provided in the Discovery Request"
+    )
+    error_detail: Status = Field(
+        None, title="Error details from the previous xDS request"
+    )
+
+    @property
+    def discovery_request(self) -> DiscoveryRequest:
+        """
+        The equivalent State-of-the-World request, for all of the subscribed resources
+        """
+        return DiscoveryRequest(
+            node=self.node,
+            version_info=self.system_version_info,
+            resource_names=self.resource_names_subscribe,
+            hide_private_keys=self.hide_private_keys,
+            type_url=self.type_url,
+            desired_controlplane=self.desired_controlplane,
+            error_detail=self.error_detail,
+        )
+
+
+class DeltaResource(BaseModel):
+    name: str
+    version: str = Field(..., title="Hash of the resource")
+    resource: Dict[str, Any]
+
+
+class DeltaDiscoveryResponse(BaseModel):
+    system_version_info: str = Field(
+        ..., title="The version of all of the resources of this type"
+    )
+    resources: List[DeltaResource] = Field(
+        ..., title="Resources that were added or changed"
+    )
+    removed_resources: List[str] = Field(
+        ..., title="Names of the resources that were removed"
+    )
+
+
 class DiscoveryResponse(BaseModel):
     version_info: str = Field(
         ..., title="The version of the configuration in the response"
@@ -479,6 +819,7 @@ class SovereignConfig(BaseSettings):
 class TemplateSpecification(BaseModel):
     type: str
     spec: Loadable
+    mutable_context: bool = False
 
 
 class NodeMatching(BaseSettings):
@@ -535,31 +876,77 @@ class LoggingConfiguration(BaseSettings):
     access_logs: AccessLogConfiguration = AccessLogConfiguration()
 
 
+def single_refresh_method(
+    values: Dict[str, Any], names: str, where: str = ""
+) -> Dict[str, Any]:
+    """
+    Validates that a context (variable) is refreshed either at a rate
+    or on a cron schedule, but not both
+    """
+    refresh_rate = values.get("refresh_rate")
+    refresh_cron = values.get("refresh_cron")
+    if (refresh_rate is not None) and (refresh_cron is not None):
+        raise RuntimeError(
+            f"Only one of {names} can be defined{where}. Got {refresh_rate=} and {refresh_cron=}"
+        )
+    return values
+
+
+def valid_refresh_cron(v: Optional[str]) -> Optional[str]:
+    if v is None:
+        return v
+    if not croniter.is_valid(v):
+        raise CroniterBadCronError(f"'{v}' is not a valid cron expression")
+    return v
+
+
+class ContextLoadable(Loadable):
+    """
+    A template context variable, which can be refreshed on its own
+    schedule instead of the one of ``template_context``
+    """
+
+    refresh_rate: Optional[int] = None
+    refresh_cron: Optional[str] = None
+
+    @root_validator
+    def validate_single_use_refresh_method(
+        cls, values: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        return single_refresh_method(
+            values, "refresh_rate or refresh_cron", f" for {values.get('path')}"
+        )
+
+    validate_refresh_cron = validator("refresh_cron", allow_reuse=True)(
+        valid_refresh_cron
+    )
+
+
 class ContextConfiguration(BaseSettings):
-    context: Dict[str, Loadable] = {}
+    context: Dict[str, ContextLoadable] = {}
     refresh: bool = False
     refresh_rate: Optional[int] = None
     refresh_cron: Optional[str] = None
+    # Maximum number of contexts built for node match keys held in-process
+    cache_size: int = 1024
+    # Seconds to wait for each variable to load, before keeping its previous value
+    load_timeout: Optional[float] = 30
 
     @staticmethod
-    def context_from_legacy(context: Dict[str, str]) -> Dict[str, Loadable]:
+    def context_from_legacy(context: Dict[str, str]) -> Dict[str, ContextLoadable]:
         ret = dict()
         for key, value in context.items():
-            ret[key] = Loadable.from_legacy_fmt(value)
+            ret[key] = ContextLoadable(**Loadable.from_legacy_fmt(value).dict())
         return ret
 
     @root_validator(pre=False)
     def validate_single_use_refresh_method(
         cls, values: Dict[str, Any]
     ) -> Dict[str, Any]:
-        refresh_rate = values.get("refresh_rate")
-        refresh_cron = values.get("refresh_cron")
-
-        if (refresh_rate is not None) and (refresh_cron is not None):
-            raise RuntimeError(
-                f"Only one of SOVEREIGN_CONTEXT_REFRESH_RATE or SOVEREIGN_CONTEXT_REFRESH_CRON can be defined. Got {refresh_rate=} and {refresh_cron=}"
-            )
-        return values
+        return single_refresh_method(
+            values,
+            "SOVEREIGN_CONTEXT_REFRESH_RATE or SOVEREIGN_CONTEXT_REFRESH_CRON",
+        )
 
     @root_validator
     def set_default_refresh_rate(cls, values: Dict[str, Any]) -> Dict[str, Any]:
@@ -570,30 +957,117 @@ class ContextConfiguration(BaseSettings):
             values["refresh_rate"] = 3600
         return values
 
-    @validator("refresh_cron")
-    def validate_refresh_cron(cls, v: Optional[str]) -> Optional[str]:
-        if v is None:
-            return v
-        if not croniter.is_valid(v):
-            raise CroniterBadCronError(f"'{v}' is not a valid cron expression")
-        return v
+    validate_refresh_cron = validator("refresh_cron", allow_reuse=True)(
+        valid_refresh_cron
+    )
 
     class Config:
         fields = {
             "refresh": {"env": "SOVEREIGN_REFRESH_CONTEXT"},
             "refresh_rate": {"env": "SOVEREIGN_CONTEXT_REFRESH_RATE"},
             "refresh_cron": {"env": "SOVEREIGN_CONTEXT_REFRESH_CRON"},
+            "cache_size": {"env": "SOVEREIGN_CONTEXT_CACHE_SIZE"},
+            "load_timeout": {"env": "SOVEREIGN_CONTEXT_LOAD_TIMEOUT"},
         }
 
 
 class SourcesConfiguration(BaseSettings):
     refresh_rate: int = 30
     cache_strategy: CacheStrategy = CacheStrategy.context
+    # Maximum number of rendered templates held in-process by the content strategy
+    content_cache_size: int = 1024
+    # Maximum number of deserialized template outputs held in-process
+    parse_cache_size: int = 1024
+    # Render every match key ahead of time, whenever sources or context change
+    prerender: bool = False
+    prerender_api_versions: List[str] = ["v3"]
 
     class Config:
         fields = {
             "refresh_rate": {"env": "SOVEREIGN_SOURCES_REFRESH_RATE"},
             "cache_strategy": {"env": "SOVEREIGN_CACHE_STRATEGY"},
+            "content_cache_size": {"env": "SOVEREIGN_CONTENT_CACHE_SIZE"},
+            "parse_cache_size": {"env": "SOVEREIGN_PARSE_CACHE_SIZE"},
+            "prerender": {"env": "SOVEREIGN_PRERENDER"},
+        }
+
+
+class RenderingConfiguration(BaseSettings):
+    # Where templates are rendered. Rendering inline, on the event loop,
+    # holds up every other request to the worker until it's done
+    executor: RenderExecutor = RenderExecutor.thread
+    # Renders that can run at the same time, the number of threads or processes
+    concurrency: int = 4
+    # Renders that can wait for the above before requests are rejected
+    max_queued: Optional[int] = None
+    # Where sources and template context are shared with worker processes,
+    # defaults to /dev/shm if available
+    shared_state_directory: Optional[str] = None
+
+    class Config:
+        fields = {
+            "executor": {"env": "SOVEREIGN_RENDER_EXECUTOR"},
+            "concurrency": {"env": "SOVEREIGN_RENDER_CONCURRENCY"},
+            "max_queued": {"env": "SOVEREIGN_RENDER_MAX_QUEUED"},
+            "shared_state_directory": {
+                "env": "SOVEREIGN_RENDER_SHARED_STATE_DIRECTORY"
+            },
+        }
+
+
+class GrpcConfiguration(BaseSettings):
+    # Serve the Aggregated Discovery Service over gRPC, alongside the REST endpoints.
+    # Requires grpcio and xds-protos to be installed
+    enabled: bool = False
+    host: str = "0.0.0.0"
+    # Shared by every worker process (SO_REUSEPORT)
+    port: int = 8081
+
+    class Config:
+        fields = {
+            "enabled": {"env": "SOVEREIGN_GRPC_ENABLED"},
+            "host": {"env": "SOVEREIGN_GRPC_HOST"},
+            "port": {"env": "SOVEREIGN_GRPC_PORT"},
+        }
+
+
+class CompressionConfiguration(BaseSettings):
+    # Compress discovery responses according to the Accept-Encoding of the request.
+    # Each response is only compressed once per encoding, while it's cached
+    # (see cache_strategy and prerender). Responses that aren't cached are
+    # compressed for every request, on the event loop
+    enabled: bool = False
+    # Responses smaller than this are not worth compressing
+    minimum_size: int = 1024
+
+    class Config:
+        fields = {
+            "enabled": {"env": "SOVEREIGN_COMPRESSION_ENABLED"},
+            "minimum_size": {"env": "SOVEREIGN_COMPRESSION_MINIMUM_SIZE"},
+        }
+
+
+class WatchConfiguration(BaseSettings):
+    # The longest time that a discovery request with ?watch=true is held
+    # for, waiting for its resources to change
+    max_timeout: float = 60.0
+
+    class Config:
+        fields = {
+            "max_timeout": {"env": "SOVEREIGN_WATCH_MAX_TIMEOUT"},
+        }
+
+
+class TemplateCacheConfiguration(BaseSettings):
+    # Keep compiled Jinja2 templates on disk, shared by workers and across restarts
+    enabled: bool = True
+    # Defaults to a per-user directory in the system temp dir
+    directory: Optional[str] = None
+
+    class Config:
+        fields = {
+            "enabled": {"env": "SOVEREIGN_TEMPLATE_CACHE_ENABLED"},
+            "directory": {"env": "SOVEREIGN_TEMPLATE_CACHE_DIRECTORY"},
         }
 
 
@@ -668,6 +1142,11 @@ class LegacyConfig(BaseSettings):
 class SovereignConfigv2(BaseSettings):
     sources: List[ConfiguredSource]
     templates: Dict[str, List[TemplateSpecification]]
+    template_cache: TemplateCacheConfiguration = TemplateCacheConfiguration()
+    rendering: RenderingConfiguration = RenderingConfiguration()
+    grpc: GrpcConfiguration = GrpcConfiguration()
+    watch: WatchConfiguration = WatchConfiguration()
+    compression: CompressionConfiguration = CompressionConfiguration()
     source_config: SourcesConfiguration = SourcesConfiguration()
     modifiers: List[str] = []
     global_modifiers: List[str] = []
@@ -697,7 +1176,9 @@ class SovereignConfigv2(BaseSettings):
         }  # Special key to hold templates from all versions
         for version, template_specs in self.templates.items():
             loaded_templates = {
-                template.type: XdsTemplate(path=template.spec)
+                template.type: XdsTemplate(
+                    path=template.spec, mutable_context=template.mutable_context
+                )
                 for template in template_specs
             }
             ret[str(version)] = loaded_templates
@@ -0,0 +1,241 @@
+"""
+Snapshots
+---------
+
+Discovery responses rendered ahead of time, once for every combination of
+node match key, template version, xDS type and API version, whenever the
+sources or template context change.
+
+Requests are then answered by looking up the snapshot table and filtering
+the requested resource names, instead of rendering the template.
+
+Snapshots are rendered using a representative request which only carries
+the node match key and envoy version, so templates that use the discovery
+request, host header or resource names are left out and rendered for every
+request instead. Snapshots should only be enabled when the other templates
+do not depend on the node beyond its match key, such as its locality or
+metadata, through their context.
+"""
+import asyncio
+import traceback
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, NoReturn, Optional, Tuple
+
+from glom import assign
+
+from sovereign import XDS_TEMPLATES, config, logs, poller, stats, template_context
+from sovereign import discovery
+from sovereign.schemas import (
+    CacheStrategy,
+    DiscoveryRequest,
+    ProcessedTemplate,
+    XdsTemplate,
+)
+from sovereign.utils.compression import compressors
+from sovereign.utils.generations import Generations
+from sovereign.utils.mock import mock_discovery_request
+from sovereign.utils.version_info import combine_hashes
+from sovereign.utils.timer import poll_forever
+
+# (node match key, template version, xDS type, API version)
+SnapshotKey = Tuple[str, str, str, str]
+
+# Variables that templates are rendered with which come from the request
+REQUEST_VARIABLES = ("discovery_request", "host_header", "resource_names")
+
+
+class Snapshot:
+    """
+    An immutable table of fully rendered (unfiltered) templates, along with
+    the generation of sources and template context that it was rendered from,
+    and a fingerprint of the instances and context variables that each entry
+    was rendered with.
+    """
+
+    def __init__(
+        self,
+        generation: Any,
+        table: Dict[SnapshotKey, ProcessedTemplate],
+        fingerprints: Optional[Dict[SnapshotKey, Optional[str]]] = None,
+    ) -> None:
+        self.generation = generation
+        self.table: Mapping[SnapshotKey, ProcessedTemplate] = MappingProxyType(table)
+        self.fingerprints: Mapping[SnapshotKey, Optional[str]] = MappingProxyType(
+            fingerprints or dict()
+        )
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def get(self, key: SnapshotKey) -> Optional[ProcessedTemplate]:
+        return self.table.get(key)
+
+
+class Prerenderer:
+    def __init__(self, api_versions: List[str], refresh_rate: int = 1) -> None:
+        self.api_versions = api_versions
+        self.refresh_rate = refresh_rate
+        self.snapshot = Snapshot(generation=None, table={})
+
+    @property
+    def outdated(self) -> bool:
+        outdated: bool = self.snapshot.generation != discovery.content_generation()
+        return outdated
+
+    @staticmethod
+    def prerenderable(template: XdsTemplate) -> bool:
+        return not any(template.uses(variable) for variable in REQUEST_VARIABLES)
+
+    def node_key(self, request: DiscoveryRequest) -> str:
+        if not poller.matching_enabled:
+            return "*"
+        return str(poller.extract_node_key(request.node))
+
+    def get(
+        self, request: DiscoveryRequest, api_version: str, xds_type: str
+    ) -> Optional[ProcessedTemplate]:
+        """
+        Returns the snapshot for the request, filtered down to the requested
+        resource names, or None if the request has to be rendered.
+
+        The previous snapshot keeps being served while a newer one is rendered.
+        """
+        if request.hide_private_keys:
+            return None
+        version = discovery.select_version(request.envoy_version)
+        template = XDS_TEMPLATES[version].get(xds_type)
+        if template is None or not self.prerenderable(template):
+            return None
+        key = (self.node_key(request), version, xds_type, api_version)
+        rendered = self.snapshot.get(key)
+        if rendered is None:
+            stats.increment("snapshot.miss")
+            return None
+        stats.increment("snapshot.hit")
+        return discovery.filter_template(rendered, request.resources)
+
+    @staticmethod
+    def representative_request(match_key: str, version: str) -> DiscoveryRequest:
+        request = mock_discovery_request(service_cluster=match_key, version=version)
+        request.hide_private_keys = False
+        if poller.node_match_key != "cluster":
+            assign(request.node, poller.node_match_key, match_key, missing=dict)
+        return request
+
+    def build(self) -> Snapshot:
+        """
+        Renders every combination of match key, template version, xDS type and
+        API version, for templates that don't use the request.
+
+        Entries whose matched instances and context variables have the same
+        fingerprint as in the previous snapshot are carried over instead of
+        being rendered again.
+        """
+        generation = discovery.content_generation()
+        previous = self.snapshot
+        table: Dict[SnapshotKey, ProcessedTemplate] = dict()
+        fingerprints: Dict[SnapshotKey, Optional[str]] = dict()
+        rendered_count = 0
+        for match_key in poller.match_keys:
+            for version, templates in XDS_TEMPLATES.items():
+                if version == "__any__":
+                    continue
+                request = self.representative_request(str(match_key), version)
+                if discovery.select_version(request.envoy_version) != version:
+                    # Another template version takes precedence for this envoy version
+                    continue
+                for xds_type, template in templates.items():
+                    if not self.prerenderable(template):
+                        continue
+                    fingerprint = poller.match_fingerprint(
+                        match_key, include=template.uses_scope
+                    )
+                    if fingerprint is not None:
+                        fingerprint = combine_hashes(
+                            [
+                                fingerprint,
+                                template_context.template_fingerprint(template),
+                            ]
+                        )
+                    for api_version in self.api_versions:
+                        key = (str(match_key), version, xds_type, api_version)
+                        fingerprints[key] = fingerprint
+                        unchanged = (
+                            fingerprint is not None
+                            and previous.fingerprints.get(key) == fingerprint
+                            and key in previous.table
+                        )
+                        if unchanged:
+                            table[key] = previous.table[key]
+                            continue
+                        type_url = discovery.type_urls.get(api_version, {}).get(
+                            xds_type
+                        )
+                        version_info = None
+                        if discovery.cache_strategy == CacheStrategy.context:
+                            version_info = discovery.input_version(
+                                request, xds_type, template, type_url
+                            )
+                        try:
+                            rendered = discovery.render(
+                                request, template, type_url, version_info
+                            )
+                        # pylint: disable=broad-except
+                        except Exception as e:
+                            stats.increment("snapshot.render.error")
+                            logs.application_log(
+                                event="Failed to pre-render template",
+                                match_key=match_key,
+                                version=version,
+                                xds_type=xds_type,
+                                error=repr(e),
+                                traceback=traceback.format_exc().split("\n"),
+                            )
+                            continue
+                        # Serializes the resources ahead of time, rather than on request
+                        stats.histogram("snapshot.bytes", len(rendered.rendered))
+                        if (
+                            config.compression.enabled
+                            and len(rendered.rendered)
+                            >= config.compression.minimum_size
+                        ):
+                            for encoding in compressors:
+                                rendered.compressed(encoding)
+                        rendered_count += 1
+                        table[key] = rendered
+        stats.increment("snapshot.rendered", value=rendered_count)
+        stats.increment("snapshot.reused", value=len(table) - rendered_count)
+        return Snapshot(generation=generation, table=table, fingerprints=fingerprints)
+
+    async def refresh(self) -> None:
+        if not self.outdated:
+            return
+        loop = asyncio.get_running_loop()
+        with stats.timed("snapshot.build_ms"):
+            self.snapshot = await loop.run_in_executor(None, self.build)
+        stats.increment("snapshot.refreshed")
+        generations.check()
+
+    async def refresh_forever(self) -> NoReturn:
+        await poll_forever(self.refresh_rate, self.refresh)
+        raise RuntimeError("Snapshot refresh stopped, this should never happen")
+
+
+PRERENDER = config.source_config.prerender
+prerenderer = Prerenderer(api_versions=config.source_config.prerender_api_versions)
+
+
+def current_generation() -> Any:
+    """
+    Responses can only change with a new generation of the sources and
+    template context, or a new snapshot if they are pre-rendered.
+    """
+    if PRERENDER:
+        return prerenderer.snapshot.generation
+    return discovery.content_generation()
+
+
+# Lets requests wait for responses to change, see sovereign.views.discovery
+generations = Generations(current_generation)
+poller.on_change.append(generations.check)
+template_context.on_change.append(generations.check)
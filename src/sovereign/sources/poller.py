@@ -1,14 +1,17 @@
 import asyncio
+import threading
 import traceback
+from collections import Counter
 from copy import deepcopy
 from datetime import timedelta, datetime
 from pkg_resources import iter_entry_points, EntryPoint
-from typing import Iterable, Any, Dict, List, Union, Type, Optional
+from typing import Iterable, Any, Callable, Dict, List, Set, Union, Type, Optional
 
 from glom import glom, PathAccessError
 
 from sovereign.sources.lib import Source
 from sovereign.modifiers.lib import Modifier, GlobalModifier
+from sovereign.utils.version_info import compute_hash, fingerprint_of
 from sovereign.schemas import (
     ConfiguredSource,
     SourceData,
@@ -72,6 +75,28 @@ class SourcePoller:
         self.last_updated = datetime.now()
         self.instance_count = 0
 
+        # Incremented every time the (modified) source data changes, so that
+        # anything derived from it can tell when it has become outdated
+        self.generation = 0
+        # Fingerprints of the instances matched by each match key, per scope
+        self.match_fingerprints: Dict[str, Dict[str, str]] = dict()
+        # Fingerprint of all of the above, unlike the generation it is the
+        # same in every process that has the same source data
+        self.fingerprint = compute_hash(self.match_fingerprints)
+        self.changed_match_keys: Set[str] = set()
+        # Fingerprints of the instances of each scope, in order, and the match
+        # keys that each instance matched, by fingerprint. Kept between polls
+        # so that only instances and match keys that changed are compared
+        self.instance_fingerprints: Dict[str, List[str]] = dict()
+        self.instance_matches: Dict[str, Set[Any]] = dict()
+        self.fingerprinted_match_keys: Set[Any] = set()
+        self._lock = threading.Lock()
+        # Called from the event loop after the source data changed, whether
+        # it was polled by poll_forever or by a request, see notify
+        self.on_change: List[Callable[[], None]] = []
+        self.notified_generation = 0
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
     @property
     def data_is_stale(self) -> bool:
         return self.last_updated < datetime.now() - timedelta(minutes=2)
@@ -246,23 +271,25 @@ class SourcePoller:
                 continue
 
             for instance in instances:
-                source_value = self.extract_source_key(instance)
-
-                # If a single expression evaluates true, the remaining are not evaluated/executed.
-                # This saves (a small amount of) computation, which helps when the server starts
-                # to receive thousands of requests. The list has been ordered descending by what
-                # we think will more commonly be true.
-                match = (
-                    contains(source_value, node_value)
-                    or node_value == source_value
-                    or is_wildcard(node_value)
-                    or is_wildcard(source_value)
-                    or is_debug_request(node_value)
-                )
-                if match:
+                if self.is_match(node_value, instance):
                     ret.scopes[scope].append(instance)
         return ret
 
+    def is_match(self, node_value: Any, instance: Dict[Any, Any]) -> bool:
+        source_value = self.extract_source_key(instance)
+
+        # If a single expression evaluates true, the remaining are not evaluated/executed.
+        # This saves (a small amount of) computation, which helps when the server starts
+        # to receive thousands of requests. The list has been ordered descending by what
+        # we think will more commonly be true.
+        return (
+            contains(source_value, node_value)
+            or node_value == source_value
+            or is_wildcard(node_value)
+            or is_wildcard(source_value)
+            or is_debug_request(node_value)
+        )
+
     @property
     def match_keys(self) -> List[str]:
         """
@@ -278,7 +305,7 @@ class SourcePoller:
 
                 break
             for instance in instances:
-                source_value = glom(instance, self.source_match_key)
+                source_value = self.extract_source_key(instance)
                 if isinstance(source_value, str):
                     ret[source_value] = None
                 elif isinstance(source_value, Iterable):
@@ -288,11 +315,173 @@ class SourcePoller:
                 ret[source_value] = None
         return list(ret.keys())
 
+    def fingerprint_match_keys(self) -> Dict[str, Dict[str, str]]:
+        """
+        Computes a fingerprint of the instances that each match key receives,
+        per scope, out of fingerprints of the individual instances.
+
+        Only instances that weren't there on the previous poll are compared
+        against every match key, and only the match keys of instances that
+        were added or removed, or of scopes whose order changed, are
+        fingerprinted again. The others keep their previous fingerprint.
+        """
+        previous = self.match_fingerprints
+        scopes = self.source_data_modified.scopes
+        match_keys = self.match_keys
+        keys: Set[Any] = set(match_keys)
+        new_keys = keys - self.fingerprinted_match_keys
+        fingerprints = {
+            scope: [fingerprint_of(instance) for instance in instances]
+            for scope, instances in scopes.items()
+        }
+
+        matches: Dict[str, Set[Any]] = dict()
+        for scope, instances in scopes.items():
+            for instance, fingerprint in zip(instances, fingerprints[scope]):
+                if fingerprint in matches:
+                    continue
+                known = self.instance_matches.get(fingerprint)
+                if known is None:
+                    matches[fingerprint] = self.matching_keys(instance, match_keys)
+                elif new_keys:
+                    matches[fingerprint] = (known & keys) | self.matching_keys(
+                        instance, new_keys
+                    )
+                else:
+                    matches[fingerprint] = known & keys
+
+        ret: Dict[str, Dict[str, str]] = {str(key): dict() for key in match_keys}
+        for scope in fingerprints:
+            before = self.instance_fingerprints.get(scope)
+            after = fingerprints[scope]
+            if before is None or any(
+                str(key) not in previous for key in keys - new_keys
+            ):
+                # New scope, or previous fingerprints are incomplete
+                affected = keys
+            elif before == after:
+                affected = new_keys
+            else:
+                # Counted, as instances can appear more than once
+                counts_before, counts_after = Counter(before), Counter(after)
+                added_or_removed = set(
+                    (counts_before - counts_after) + (counts_after - counts_before)
+                )
+                if not added_or_removed:
+                    # Same instances in a different order
+                    affected = keys
+                else:
+                    affected = set(new_keys)
+                    for fingerprint in added_or_removed:
+                        if fingerprint in matches:
+                            affected |= matches[fingerprint]
+                        else:
+                            affected |= self.instance_matches.get(fingerprint, set())
+                    affected &= keys
+            matched: Dict[Any, List[str]] = {key: [] for key in affected}
+            for fingerprint in after:
+                for key in matches[fingerprint] & affected:
+                    matched[key].append(fingerprint)
+            for key in match_keys:
+                if key in matched:
+                    ret[str(key)][scope] = compute_hash(matched[key])
+                else:
+                    ret[str(key)][scope] = previous[str(key)][scope]
+
+        self.instance_fingerprints = fingerprints
+        self.instance_matches = matches
+        self.fingerprinted_match_keys = keys
+        return ret
+
+    def matching_keys(self, instance: Dict[Any, Any], keys: Iterable[Any]) -> Set[Any]:
+        """
+        The keys that match the instance, same as checking each with is_match
+        """
+        keys = set(keys)
+        if not self.matching_enabled:
+            return keys
+        source_value = self.extract_source_key(instance)
+        if is_wildcard(source_value):
+            return keys
+        if isinstance(source_value, (list, tuple, set)):
+            # Match keys are hashable, so they can be looked up instead of
+            # compared one by one
+            try:
+                values = set(source_value)
+            except TypeError:
+                pass
+            else:
+                return (keys & values) | {key for key in keys if is_wildcard(key)}
+        return {key for key in keys if self.is_match(key, instance)}
+
+    def match_fingerprint(
+        self, node_value: Any, include: Optional[Callable[[str], bool]] = None
+    ) -> Optional[str]:
+        """
+        Returns a fingerprint of the instances matched by the node value,
+        optionally limited to the scopes selected by ``include``, or None
+        if the node value is not a known match key.
+        """
+        if not hasattr(self, "source_data_modified"):
+            self.poll()
+        if not self.matching_enabled:
+            node_value = "*"
+        fingerprints = self.match_fingerprints.get(str(node_value))
+        if fingerprints is None:
+            return None
+        return compute_hash(
+            sorted(
+                (scope, fingerprint)
+                for scope, fingerprint in fingerprints.items()
+                if include is None or include(scope)
+            )
+        )
+
     def poll(self) -> None:
-        self.source_data = self.refresh()
+        # Polls from discovery requests (for stale data) and from poll_forever
+        # can run in different threads
+        with self._lock:
+            self._poll()
+
+    def _poll(self) -> None:
+        updated = self.refresh()
+        changed = updated is not self.source_data or not hasattr(
+            self, "source_data_modified"
+        )
+        self.source_data = updated
         self.source_data_modified = self.apply_modifications(self.source_data)
+        if changed:
+            previous = self.match_fingerprints
+            match_fingerprints = self.fingerprint_match_keys()
+            self.changed_match_keys = {
+                key
+                for key in set(previous) | set(match_fingerprints)
+                if previous.get(key) != match_fingerprints.get(key)
+            }
+            self.match_fingerprints = match_fingerprints
+            self.fingerprint = compute_hash(match_fingerprints)
+            self.generation += 1
+            self.stats.increment(
+                "sources.match_keys.changed", value=len(self.changed_match_keys)
+            )
+            if self.loop is not None and not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(self.notify)
+
+    def notify(self) -> None:
+        """
+        Calls the on_change callbacks, from the event loop, unless they
+        were already called for the current generation.
+        """
+        if self.generation == self.notified_generation:
+            return
+        self.notified_generation = self.generation
+        for callback in self.on_change:
+            callback()
 
     async def poll_forever(self) -> None:
+        self.loop = asyncio.get_running_loop()
         while True:
-            self.poll()
+            # Sources are fetched, modified and fingerprinted off the event loop
+            await self.loop.run_in_executor(None, self.poll)
+            self.notify()
             await asyncio.sleep(self.source_refresh_rate)
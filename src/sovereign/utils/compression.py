@@ -0,0 +1,54 @@
+import gzip
+from functools import partial
+from typing import Callable, Dict, Iterable, Optional
+
+# Compressors by content-coding, in order of preference
+compressors: Dict[str, Callable[[bytes], bytes]] = dict()
+
+try:
+    import brotli
+
+    compressors["br"] = partial(brotli.compress, quality=5)
+except ImportError:
+    pass
+
+try:
+    import zstandard
+
+    compressors["zstd"] = zstandard.ZstdCompressor(level=3).compress
+except ImportError:
+    pass
+
+# No timestamp, so that the same content is always compressed to the same bytes
+compressors["gzip"] = partial(gzip.compress, compresslevel=6, mtime=0)
+
+
+def negotiate(
+    accept_encoding: Optional[str], available: Iterable[str] = compressors
+) -> Optional[str]:
+    """
+    Picks the preferred content-coding of the Accept-Encoding header which
+    can be compressed to, or None if the content should be sent as-is.
+    Codings with the same quality are picked in the order they are available.
+    """
+    if not accept_encoding:
+        return None
+    qualities: Dict[str, float] = dict()
+    for item in accept_encoding.split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    best: Optional[str] = None
+    best_quality = 0.0
+    for coding in available:
+        quality = qualities.get(coding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
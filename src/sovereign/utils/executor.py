@@ -0,0 +1,117 @@
+import asyncio
+import contextvars
+import threading
+from functools import partial
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+from starlette.exceptions import HTTPException
+
+T = TypeVar("T")
+
+
+def capture_log_fields(fn: Callable[..., T], *args: Any) -> Tuple[T, Dict[str, Any]]:
+    """
+    Calls the function and returns its result along with the log fields it
+    queued, which would otherwise stay in the thread (or process) that ran it.
+    Exceptions carry the log fields in a ``log_fields`` attribute.
+    """
+    from sovereign import logs
+
+    logs.clear_log_fields()
+    try:
+        return fn(*args), logs.get_log_fields()
+    except Exception as e:
+        setattr(e, "log_fields", logs.get_log_fields())
+        raise
+
+
+class BoundedExecutor:
+    """
+    Runs blocking functions from coroutines in a pool of threads or
+    processes, so that they don't hold up the event loop.
+
+    At most ``concurrency`` functions run at a time, the rest wait in a
+    queue whose depth is emitted as a gauge. If ``max_queued`` functions are
+    already waiting, further calls are rejected with a 503.
+
+    Log fields queued while running the function are merged into the log
+    fields of the caller, since they are kept per thread.
+    """
+
+    def __init__(
+        self,
+        pool: Optional[Executor],
+        logs: Any,
+        stats: Any,
+        concurrency: int = 1,
+        max_queued: Optional[int] = None,
+        name: str = "render",
+    ) -> None:
+        self.pool = pool
+        self.logs = logs
+        self.stats = stats
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self.name = name
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def threads(
+        cls, concurrency: int, logs: Any, stats: Any, **kwargs: Any
+    ) -> "BoundedExecutor":
+        pool = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="sovereign-render"
+        )
+        return cls(pool, logs, stats, concurrency=concurrency, **kwargs)
+
+    @property
+    def queued(self) -> int:
+        return max(0, self.in_flight - self.concurrency)
+
+    @property
+    def active(self) -> int:
+        return min(self.in_flight, self.concurrency)
+
+    def _emit(self) -> None:
+        self.stats.gauge(f"{self.name}.queued", self.queued)
+        self.stats.gauge(f"{self.name}.active", self.active)
+
+    def _enqueue(self) -> None:
+        with self._lock:
+            if self.max_queued is not None and (
+                self.in_flight >= self.concurrency + self.max_queued
+            ):
+                self.stats.increment(f"{self.name}.rejected")
+                raise HTTPException(
+                    status_code=503, detail="Too many requests waiting to be rendered"
+                )
+            self.in_flight += 1
+            self._emit()
+
+    def _done(self, _: "Future[Any]") -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self._emit()
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        if self.pool is None:
+            return fn(*args)
+
+        self._enqueue()
+        call: Callable[[], Tuple[T, Dict[str, Any]]]
+        call = partial(capture_log_fields, fn, *args)
+        if isinstance(self.pool, ThreadPoolExecutor):
+            # Carries over context variables, such as the request id
+            call = partial(contextvars.copy_context().run, call)  # type: ignore[assignment]
+        future = self.pool.submit(call)
+        # Also called if the future is cancelled before it runs
+        future.add_done_callback(self._done)
+        try:
+            result, log_fields = await asyncio.wrap_future(future)
+        except Exception as e:
+            self.logs.queue_log_fields(**getattr(e, "log_fields", {}))
+            raise
+        self.logs.queue_log_fields(**log_fields)
+        return result
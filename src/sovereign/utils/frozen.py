@@ -0,0 +1,65 @@
+"""
+Read-only versions of the containers that template context is loaded as,
+so that every request can share the same context instead of copying it.
+
+They subclass dict and list, so that templates can read them (and
+serialize them) the same way, but raise a TypeError when modified.
+Copying one gives back regular, mutable containers.
+"""
+from copy import deepcopy
+from typing import Any, Dict, List, NoReturn, Tuple
+
+
+def _read_only(self: Any, *args: Any, **kwargs: Any) -> NoReturn:
+    raise TypeError(
+        f"{type(self).__name__} is read-only. Templates that modify "
+        "their context have to set mutable_context"
+    )
+
+
+class FrozenDict(Dict[Any, Any]):
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+    __ior__ = _read_only
+
+    def __copy__(self) -> Dict[Any, Any]:
+        return dict(self)
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> Dict[Any, Any]:
+        return {deepcopy(k, memo): deepcopy(v, memo) for k, v in self.items()}
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return FrozenDict, (dict(self),)
+
+
+class FrozenList(List[Any]):
+    __setitem__ = __delitem__ = _read_only
+    append = clear = extend = insert = pop = remove = reverse = sort = _read_only
+    __iadd__ = __imul__ = _read_only
+
+    def __copy__(self) -> List[Any]:
+        return list(self)
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> List[Any]:
+        return [deepcopy(v, memo) for v in self]
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return FrozenList, (list(self),)
+
+
+def freeze(value: Any) -> Any:
+    """
+    Returns a read-only copy of dicts, lists and sets, and of what they
+    contain. Other objects are returned as-is.
+    """
+    if isinstance(value, (FrozenDict, FrozenList, frozenset)):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze(v) for v in value)
+    if isinstance(value, tuple) and not hasattr(value, "_fields"):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, set):
+        return frozenset(freeze(v) for v in value)
+    return value
@@ -0,0 +1,49 @@
+import asyncio
+from typing import Any, Callable, Optional, Set
+
+
+class Generations:
+    """
+    Lets coroutines wait for the generation of sources and template context
+    (or of anything else returned by ``current``) to advance.
+
+    :meth:`check` has to be called whenever the generation may have changed,
+    from the event loop. Every waiter of a generation is woken up at once
+    when it is superseded.
+    """
+
+    def __init__(self, current: Callable[[], Any]) -> None:
+        self.current = current
+        self.generation: Any = None
+        self.waiters: Set["asyncio.Future[None]"] = set()
+
+    def check(self) -> None:
+        generation = self.current()
+        if generation == self.generation:
+            return
+        self.generation = generation
+        waiters, self.waiters = self.waiters, set()
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def latest(self) -> Any:
+        self.check()
+        return self.generation
+
+    async def wait(self, generation: Any, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until there is a newer generation than the given one,
+        and returns False if the timeout expired first.
+        """
+        if self.latest() != generation:
+            return True
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiters.discard(waiter)
+        return True
@@ -0,0 +1,54 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class LRUCache:
+    """
+    Bounded, thread-safe least-recently-used mapping.
+
+    Entries belong to a *generation* (for example the poller and template
+    context generations). Reading or writing with a generation that differs
+    from the current one drops every entry, so nothing needs a TTL.
+    """
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        self.maxsize = maxsize
+        self.generation: Any = None
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _roll(self, generation: Any) -> None:
+        if generation != self.generation:
+            self._data.clear()
+            self.generation = generation
+
+    def get(self, key: Hashable, generation: Any = None) -> Optional[Any]:
+        with self._lock:
+            self._roll(generation)
+            try:
+                value = self._data[key]
+            except KeyError:
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, generation: Any = None) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._roll(generation)
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._data
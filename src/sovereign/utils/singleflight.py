@@ -0,0 +1,37 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one, so that
+    they all wait for and share the result of the first call.
+
+    The shared call runs as its own task, so that it isn't cancelled along
+    with the caller that started it while others are still waiting.
+    """
+
+    def __init__(self, stats: Any, name: str = "render") -> None:
+        self.stats = stats
+        self.name = name
+        self.calls: Dict[Hashable, "asyncio.Future[Any]"] = dict()
+
+    def _done(self, key: Hashable, task: "asyncio.Future[Any]") -> None:
+        self.calls.pop(key, None)
+        # Marks the exception as retrieved, in case every caller went away
+        if not task.cancelled():
+            task.exception()
+
+    async def run(
+        self, key: Hashable, fn: Callable[..., Awaitable[T]], *args: Any
+    ) -> T:
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self.calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.stats.increment(f"{self.name}.coalesced")
+        return await asyncio.shield(task)
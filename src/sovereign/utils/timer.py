@@ -1,7 +1,9 @@
 import asyncio
 import datetime as dt
+import time
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Any, Callable, Coroutine, NoReturn
+from typing import Any, Callable, Coroutine, Iterator, NoReturn
 
 from croniter import croniter
 
@@ -29,3 +31,21 @@ async def poll_forever_cron(
         next_datetime = croniter_iter.get_next(dt.datetime)
         delay = wait_until(next_datetime)
         await asyncio.sleep(delay)
+
+
+@contextmanager
+def timed_stage(name: str) -> Iterator[None]:
+    """
+    Times a stage of a discovery request. The duration is emitted as
+    ``discovery.<name>_ms`` and queued as the ``<NAME>_MS`` log field,
+    so that it can be added to the access log format.
+    """
+    from sovereign import logs, stats
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        stats.timing(f"discovery.{name}_ms", elapsed)
+        logs.queue_log_fields(**{f"{name.upper()}_MS": round(elapsed, 3)})
@@ -1,13 +1,94 @@
-import zlib
-from typing import Any
+import json
+import hashlib
+import pickle
+from datetime import date, time
+from enum import Enum
+from types import ModuleType
+from typing import Any, Iterable
+
+from pydantic import BaseModel
+
+try:
+    import orjson
+
+    ORJSON_INSTALLED = True
+except ImportError:
+    ORJSON_INSTALLED = False
+
+
+def _default(obj: Any) -> Any:
+    """
+    Serializes the types that JSON has no equivalent for. Anything else
+    raises a TypeError, rather than falling back to its repr, which can
+    contain a memory address and give equal objects different hashes.
+    """
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=repr)
+    # Parsed from YAML timestamps, only orjson serializes them by itself
+    if isinstance(obj, (date, time)):
+        return obj.isoformat()
+    if isinstance(obj, ModuleType):
+        return obj.__name__
+    if callable(obj) and hasattr(obj, "__qualname__"):
+        return f"{getattr(obj, '__module__', None)}.{obj.__qualname__}"
+    raise TypeError(f"Object of type {type(obj).__name__} can't be hashed")
+
+
+def canonical_json(obj: Any) -> bytes:
+    """
+    Serializes an object to JSON with sorted keys, so that equal
+    structures always produce the same bytes.
+    """
+    if ORJSON_INSTALLED:
+        return orjson.dumps(
+            obj,
+            default=_default,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS,
+        )
+    return json.dumps(
+        obj,
+        default=_default,
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode()
+
+
+def digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
 
 
 def compute_hash(*args: Any) -> str:
     """
     Creates a 'version hash' to be used in envoy Discovery Responses.
     """
-    data: bytes = repr(args).encode()
-    version_info = (
-        zlib.crc32(data) & 0xFFFFFFFF
-    )  # same numeric value across all py versions & platforms
-    return str(version_info)
+    return digest(canonical_json(args))
+
+
+def fingerprint_of(obj: Any) -> str:
+    """
+    Same as compute_hash, except for values with no JSON form, such as
+    loaded templates, bytes or decimals. These are hashed by their pickle,
+    or else by their identity, which only stays the same while the object
+    is kept, instead of raising a TypeError.
+    """
+    try:
+        return compute_hash(obj)
+    except TypeError:
+        pass
+    try:
+        return digest(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return f"{type(obj).__qualname__}-{id(obj):x}"
+
+
+def combine_hashes(hashes: Iterable[str]) -> str:
+    """
+    Creates a single hash out of many, for example to version a set of
+    resources out of the hashes of the individual resources.
+    """
+    return digest(",".join(hashes).encode())
@@ -1,14 +1,19 @@
 import yaml
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from collections import defaultdict
-from fastapi import APIRouter, Query
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Header, Query
+from fastapi.responses import JSONResponse, Response
 from fastapi.encoders import jsonable_encoder
 from sovereign import config, stats, poller, template_context
 from sovereign.discovery import select_template
 from sovereign.schemas import Resources
 from sovereign.utils.mock import mock_discovery_request
-from sovereign.views.discovery import perform_discovery
+from sovereign.views.discovery import (
+    etag_matches,
+    input_etag,
+    not_modified,
+    perform_discovery,
+)
 
 router = APIRouter()
 
@@ -28,7 +33,8 @@ async def display_config(
     version: str = Query(
         "1.11.1", title="The clients envoy version to emulate in this XDS request"
     ),
-) -> JSONResponse:
+    if_none_match: Optional[str] = Header(None),
+) -> Response:
     ret: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
     mock_request = mock_discovery_request(
         service_cluster=service_cluster,
@@ -36,10 +42,13 @@ async def display_config(
         version=version,
         region=region,
     )
+    headers = {"ETag": input_etag(mock_request, "v3", xds_type)}
+    if etag_matches(if_none_match, headers["ETag"]):
+        return not_modified(headers)
     response = await perform_discovery(mock_request, "v3", xds_type, skip_auth=True)
     ret["resources"] += response.resources
     safe_response = jsonable_encoder(ret)
-    return JSONResponse(content=safe_response)
+    return JSONResponse(content=safe_response, headers=headers)
 
 
 @router.get(
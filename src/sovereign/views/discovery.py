@@ -1,19 +1,27 @@
-from typing import Dict
+import asyncio
+from typing import Any, Dict, List, Optional
 
-from fastapi import Body, Header
+from fastapi import Body, Header, Query
 from fastapi.routing import APIRouter
 from fastapi.responses import Response
 
-from sovereign import discovery, logs, config
+from sovereign import discovery, logs, config, stats
+from sovereign.snapshot import PRERENDER, generations, prerenderer
 from sovereign.utils.auth import authenticate
+from sovereign.utils.compression import negotiate
+from sovereign.utils.timer import timed_stage
+from sovereign.rendering import renderer
 from sovereign.utils.version_info import compute_hash
 from sovereign.schemas import (
+    DeltaDiscoveryRequest,
+    DeltaDiscoveryResponse,
     DiscoveryRequest,
     DiscoveryResponse,
     ProcessedTemplate,
 )
 
 discovery_cache = config.discovery_cache
+compression = config.compression
 
 if discovery_cache.enabled:
     from cashews import cache
@@ -34,26 +42,6 @@ if discovery_cache.enabled:
 
 router = APIRouter()
 
-type_urls = {
-    "v2": {
-        "listeners": "type.googleapis.com/envoy.api.v2.Listener",
-        "clusters": "type.googleapis.com/envoy.api.v2.Cluster",
-        "endpoints": "type.googleapis.com/envoy.api.v2.ClusterLoadAssignment",
-        "secrets": "type.googleapis.com/envoy.api.v2.auth.Secret",
-        "routes": "type.googleapis.com/envoy.api.v2.RouteConfiguration",
-        "scoped-routes": "type.googleapis.com/envoy.api.v2.ScopedRouteConfiguration",
-    },
-    "v3": {
-        "listeners": "type.googleapis.com/envoy.config.listener.v3.Listener",
-        "clusters": "type.googleapis.com/envoy.config.cluster.v3.Cluster",
-        "endpoints": "type.googleapis.com/envoy.config.endpoint.v3.ClusterLoadAssignment",
-        "secrets": "type.googleapis.com/envoy.extensions.transport_sockets.tls.v3.Secret",
-        "routes": "type.googleapis.com/envoy.config.route.v3.RouteConfiguration",
-        "scoped-routes": "type.googleapis.com/envoy.config.route.v3.ScopedRouteConfiguration",
-        "runtime": "type.googleapis.com/envoy.service.runtime.v3.Runtime",
-    },
-}
-
 
 def response_headers(
     discovery_request: DiscoveryRequest, response: ProcessedTemplate, xds: str
@@ -65,6 +53,7 @@ def response_headers(
         or "all",
         "X-Sovereign-Requested-Type": xds,
         "X-Sovereign-Response-Version": response.version,
+        "ETag": etag(response.version),
     }
 
 
@@ -83,11 +72,29 @@ async def discovery_response(
     xds_type: str,
     discovery_request: DiscoveryRequest = Body(...),
     host: str = Header("no_host_provided"),
+    watch: bool = Query(
+        False,
+        description="If the client is up-to-date, wait for the resources to change "
+        "instead of responding with a 304 right away",
+    ),
+    timeout: float = Query(
+        30.0, description="Seconds to wait for when watching, before the 304"
+    ),
+    accept_encoding: str = Header(""),
+    if_none_match: Optional[str] = Header(None),
 ) -> Response:
     discovery_request.desired_controlplane = host
+    if version_info := etag_version(if_none_match):
+        # Same as the client sending the version in the request
+        discovery_request.version_info = version_info
+    generation = generations.latest()
     response = await perform_discovery(
         discovery_request, version, xds_type, skip_auth=False
     )
+    if watch and response.version == discovery_request.version_info:
+        response = await watch_for_changes(
+            discovery_request, version, xds_type, generation, timeout
+        )
     logs.queue_log_fields(
         XDS_RESOURCES=discovery_request.resource_names,
         XDS_ENVOY_VERSION=discovery_request.envoy_version,
@@ -100,15 +107,135 @@ async def discovery_response(
 
     if response.version == discovery_request.version_info:
         return not_modified(headers)
-    elif getattr(response, "resources", None) == []:
+    elif response.count == 0:
         return Response(status_code=404, headers=headers)
     elif response.version != discovery_request.version_info:
-        return Response(
-            response.rendered, headers=headers, media_type="application/json"
-        )
+        with timed_stage("compress"):
+            content = encode(response, accept_encoding, headers)
+        return Response(content, headers=headers, media_type="application/json")
     return Response(content="Resources could not be determined", status_code=500)
 
 
+def encode(
+    response: ProcessedTemplate, accept_encoding: str, headers: Dict[str, str]
+) -> bytes:
+    """
+    Returns the rendered response, or a compressed copy of it that is kept
+    along with the response, setting the Content-Encoding header accordingly.
+    Compressed responses get a weak ETag, since they aren't byte-for-byte
+    the same as the identity response with the same version.
+    """
+    if not compression.enabled:
+        return response.rendered
+    headers["Vary"] = "Accept-Encoding"
+    encoding = negotiate(accept_encoding)
+    if encoding is None or len(response.rendered) < compression.minimum_size:
+        return response.rendered
+    headers["Content-Encoding"] = encoding
+    headers["ETag"] = f"W/{etag(response.version)}"
+    stats.increment(f"discovery.compressed.{encoding}")
+    return response.compressed(encoding)
+
+
+@router.post(
+    "/{version}/delta_discovery:{xds_type}",
+    summary="Envoy Incremental (Delta) Discovery Service Endpoint",
+    response_model=DeltaDiscoveryResponse,
+    responses={
+        200: {"description": "Added, changed or removed resources provided"},
+        304: {"description": "Resources are up-to-date"},
+        404: {"description": "No resources found"},
+    },
+)
+async def delta_discovery_response(
+    version: str,
+    xds_type: str,
+    delta_request: DeltaDiscoveryRequest = Body(...),
+    host: str = Header("no_host_provided"),
+) -> Response:
+    """
+    Returns only the resources that were added or changed compared to the
+    versions that the client has, along with the names of removed resources.
+    Each resource is versioned by its hash.
+    """
+    delta_request.desired_controlplane = host
+    discovery_request = delta_request.discovery_request
+    discovery_request.version_info = delta_client_version(
+        delta_request.system_version_info, discovery_request.resource_names
+    )
+    response = await perform_discovery(
+        discovery_request, version, xds_type, skip_auth=False
+    )
+    headers = response_headers(discovery_request, response, xds_type)
+    if response.version == discovery_request.version_info:
+        return not_modified(headers)
+    changed, removed = response.delta(delta_request.initial_resource_versions)
+    logs.queue_log_fields(
+        XDS_RESOURCES=discovery_request.resource_names,
+        XDS_ENVOY_VERSION=discovery_request.envoy_version,
+        XDS_CLIENT_VERSION=discovery_request.version_info,
+        XDS_SERVER_VERSION=response.version,
+        XDS_CHANGED_RESOURCES=len(changed),
+        XDS_REMOVED_RESOURCES=len(removed),
+    )
+    if response.count == 0 and not removed:
+        return Response(status_code=404, headers=headers)
+    if not changed and not removed:
+        return not_modified(headers)
+    content = response.rendered_delta(
+        changed,
+        removed,
+        delta_version(response.version, discovery_request.resource_names),
+    )
+    return Response(content, headers=headers, media_type="application/json")
+
+
+def delta_version(version: str, resource_names: List[str]) -> str:
+    """
+    The system_version_info of delta responses. Versions don't depend on the
+    subscribed resource names, so they are added to it.
+    """
+    return f"{version}.{compute_hash(sorted(resource_names))}"
+
+
+def delta_client_version(system_version_info: str, resource_names: List[str]) -> str:
+    """
+    The version of the resources that a delta client has, unless it has since
+    changed the resources it subscribes to, and has to be sent the new ones.
+    """
+    version, _, _ = system_version_info.rpartition(".")
+    if version and system_version_info == delta_version(version, resource_names):
+        return version
+    return ""
+
+
+async def watch_for_changes(
+    req: DiscoveryRequest,
+    api_version: str,
+    resource_type: str,
+    generation: Any,
+    timeout: float,
+) -> ProcessedTemplate:
+    """
+    Holds a request from an up-to-date client until the sources, template
+    context or snapshot change in a way that changes its response, or
+    the timeout expires.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + min(timeout, config.watch.max_timeout)
+    stats.increment("discovery.watch.started")
+    while (remaining := deadline - loop.time()) > 0:
+        if not await generations.wait(generation, remaining):
+            break
+        generation = generations.latest()
+        response = await perform_discovery(req, api_version, resource_type, True)
+        if response.version != req.version_info:
+            stats.increment("discovery.watch.changed")
+            return response
+    stats.increment("discovery.watch.timeout")
+    return ProcessedTemplate(resources=[], version_info=req.version_info)
+
+
 async def perform_discovery(
     req: DiscoveryRequest,
     api_version: str,
@@ -116,7 +243,11 @@ async def perform_discovery(
     skip_auth: bool = False,
 ) -> ProcessedTemplate:
     if not skip_auth:
-        authenticate(req)
+        with timed_stage("auth"):
+            authenticate(req)
+    if PRERENDER:
+        if snapshot := prerenderer.get(req, api_version, resource_type):
+            return snapshot
     if discovery_cache.enabled:
         logs.queue_log_fields(CACHE_XDS_HIT=False)
         cache_key = compute_hash(
@@ -137,12 +268,10 @@ async def perform_discovery(
         if template := await cache.get(key=cache_key, default=None):
             logs.queue_log_fields(CACHE_XDS_HIT=True)
             return template  # type: ignore[no-any-return]
-    template = discovery.response(req, resource_type)
-    type_url = type_urls.get(api_version, {}).get(resource_type)
-    if type_url is not None:
-        for resource in template.resources:
-            if not resource.get("@type"):
-                resource["@type"] = type_url
+    type_url = discovery.type_urls.get(api_version, {}).get(resource_type)
+    template = discovery.cached_response(req, resource_type, type_url)
+    if template is None:
+        template = await renderer.rendered_response(req, resource_type, type_url)
     if discovery_cache.enabled:
         await cache.set(
             key=cache_key,
@@ -154,3 +283,48 @@ async def perform_discovery(
 
 def not_modified(headers: Dict[str, str]) -> Response:
     return Response(status_code=304, headers=headers)
+
+
+def etag(version: str) -> str:
+    return f'"{version}"'
+
+
+def etag_version(if_none_match: Optional[str]) -> Optional[str]:
+    """
+    The version in an If-None-Match header that holds a single ETag
+    """
+    if not if_none_match or "," in if_none_match:
+        return None
+    tag = if_none_match.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    if len(tag) < 2 or not tag.startswith('"') or not tag.endswith('"'):
+        return None
+    return tag[1:-1]
+
+
+def etag_matches(if_none_match: Optional[str], tag: str) -> bool:
+    """
+    Whether the If-None-Match header matches the ETag (weak comparison)
+    """
+    if not if_none_match:
+        return False
+    tags = {t.strip() for t in if_none_match.split(",")}
+    return "*" in tags or tag in tags or f"W/{tag}" in tags
+
+
+def input_etag(
+    req: DiscoveryRequest, api_version: str, resource_type: str, *extra: Any
+) -> str:
+    """
+    ETag of the response to a request, determined from the inputs that the
+    response is rendered from (see :func:`sovereign.discovery.input_version`)
+    so that unchanged responses don't have to be rendered at all.
+    Anything else that the representation depends on can be added as ``extra``.
+    """
+    template = discovery.select_template(req, resource_type)
+    type_url = discovery.type_urls.get(api_version, {}).get(resource_type)
+    version = discovery.input_version(req, resource_type, template, type_url)
+    if extra:
+        version = compute_hash(version, *extra)
+    return etag(version)
@@ -1,6 +1,6 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from collections import defaultdict
-from fastapi import APIRouter, Query, Path, Cookie
+from fastapi import APIRouter, Query, Path, Cookie, Header
 from fastapi.encoders import jsonable_encoder
 from fastapi.requests import Request
 from fastapi.responses import RedirectResponse, JSONResponse, Response
@@ -8,7 +8,12 @@ from sovereign import html_templates, XDS_TEMPLATES
 from sovereign.discovery import DiscoveryTypes
 from sovereign import poller, json_response_class
 from sovereign.utils.mock import mock_discovery_request
-from sovereign.views.discovery import perform_discovery
+from sovereign.views.discovery import (
+    etag_matches,
+    input_etag,
+    not_modified,
+    perform_discovery,
+)
 
 router = APIRouter()
 
@@ -90,16 +95,25 @@ async def resources(
     envoy_version: str = Cookie(
         "__any__", title="The clients envoy version to emulate in this XDS request"
     ),
+    if_none_match: Optional[str] = Header(None),
 ) -> Response:
     ret: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    mock_request = mock_discovery_request(
+        service_cluster=service_cluster,
+        resource_names=[],
+        version=envoy_version,
+        region=region,
+    )
+    headers = dict()
     try:
+        # The page also lists the available service clusters
+        headers["ETag"] = input_etag(
+            mock_request, api_version, xds_type, "resources.html", poller.fingerprint
+        )
+        if etag_matches(if_none_match, headers["ETag"]):
+            return not_modified(headers)
         response = await perform_discovery(
-            req=mock_discovery_request(
-                service_cluster=service_cluster,
-                resource_names=[],
-                version=envoy_version,
-                region=region,
-            ),
+            req=mock_request,
             api_version=api_version,
             resource_type=xds_type,
             skip_auth=True,
@@ -109,6 +123,7 @@ async def resources(
     else:
         ret["resources"] += response.deserialize_resources()
     return html_templates.TemplateResponse(
+        headers=headers,
         name="resources.html",
         media_type="text/html",
         context={
@@ -144,19 +159,24 @@ async def resource(
     envoy_version: str = Cookie(
         "__any__", title="The clients envoy version to emulate in this XDS request"
     ),
+    if_none_match: Optional[str] = Header(None),
 ) -> Response:
+    mock_request = mock_discovery_request(
+        service_cluster=service_cluster,
+        resource_names=[resource_name],
+        version=envoy_version,
+        region=region,
+    )
+    headers = {"ETag": input_etag(mock_request, api_version, xds_type)}
+    if etag_matches(if_none_match, headers["ETag"]):
+        return not_modified(headers)
     response = await perform_discovery(
-        req=mock_discovery_request(
-            service_cluster=service_cluster,
-            resource_names=[resource_name],
-            version=envoy_version,
-            region=region,
-        ),
+        req=mock_request,
         api_version=api_version,
         resource_type=xds_type,
         skip_auth=True,
     )
-    return Response(response.rendered, media_type="application/json")
+    return Response(response.rendered, media_type="application/json", headers=headers)
 
 
 @router.get(
@@ -176,14 +196,19 @@ async def virtual_hosts(
     envoy_version: str = Cookie(
         "__any__", title="The clients envoy version to emulate in this XDS request"
     ),
+    if_none_match: Optional[str] = Header(None),
 ) -> Response:
+    mock_request = mock_discovery_request(
+        service_cluster=service_cluster,
+        resource_names=[route_configuration],
+        version=envoy_version,
+        region=region,
+    )
+    headers = {"ETag": input_etag(mock_request, api_version, "routes", virtual_host)}
+    if etag_matches(if_none_match, headers["ETag"]):
+        return not_modified(headers)
     response = await perform_discovery(
-        req=mock_discovery_request(
-            service_cluster=service_cluster,
-            resource_names=[route_configuration],
-            version=envoy_version,
-            region=region,
-        ),
+        req=mock_request,
         api_version=api_version,
         resource_type="routes",
         skip_auth=True,
@@ -198,8 +223,8 @@ async def virtual_hosts(
             if vhost["name"] == virtual_host:
                 safe_response = jsonable_encoder(vhost)
                 try:
-                    return json_response_class(content=safe_response)
+                    return json_response_class(content=safe_response, headers=headers)
                 except TypeError:
-                    return JSONResponse(content=safe_response)
+                    return JSONResponse(content=safe_response, headers=headers)
         break
-    return JSONResponse(content={})
+    return JSONResponse(content={}, headers=headers)
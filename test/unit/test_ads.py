@@ -0,0 +1,141 @@
+import pytest
+from starlette.exceptions import HTTPException
+
+from sovereign import ads, discovery
+from sovereign.ads import AdsStream
+from sovereign.schemas import CacheStrategy, DiscoveryRequest, GrpcConfiguration
+
+CLUSTERS = discovery.type_urls["v3"]["clusters"]
+LISTENERS = discovery.type_urls["v3"]["listeners"]
+
+
+@pytest.fixture
+def stream():
+    return AdsStream(host="controlplane")
+
+
+@pytest.fixture
+def node(discovery_request_with_auth: DiscoveryRequest):
+    return discovery_request_with_auth.node.dict()
+
+
+@pytest.mark.asyncio
+async def test_subscribing_responds_with_the_resources(stream: AdsStream, node):
+    processed, type_url, nonce = await stream.receive(
+        {"node": node, "type_url": CLUSTERS}
+    )
+    assert type_url == CLUSTERS
+    assert nonce == "1"
+    assert [r["name"] for r in processed.resources] == ["httpbin-proxy"]
+
+
+@pytest.mark.asyncio
+async def test_acknowledged_and_rejected_responses_are_not_sent_again(
+    stream: AdsStream, node
+):
+    processed, _, nonce = await stream.receive({"node": node, "type_url": CLUSTERS})
+    # Envoy only sends its node with the first request
+    ack = {"type_url": CLUSTERS, "version_info": processed.version, "nonce": nonce}
+    assert await stream.receive(ack) is None
+    nack = {
+        "type_url": CLUSTERS,
+        "version_info": "previous",
+        "response_nonce": nonce,
+        "error_detail": {"code": 3, "message": "rejected"},
+    }
+    assert await stream.receive(nack) is None
+    assert await stream.changed() == []
+
+
+@pytest.mark.asyncio
+async def test_changing_requested_resources_responds_again(stream: AdsStream, node):
+    processed, _, _ = await stream.receive({"node": node, "type_url": LISTENERS})
+    pushed = await stream.receive(
+        {
+            "type_url": LISTENERS,
+            "version_info": processed.version,
+            "resource_names": ["redirect_to_https"],
+        }
+    )
+    assert pushed is not None
+    assert [r["name"] for r in pushed[0].resources] == ["redirect_to_https"]
+
+
+@pytest.mark.asyncio
+async def test_changing_requested_resources_responds_with_content_versions(
+    stream: AdsStream, node, monkeypatch
+):
+    # Content versions don't depend on the requested resources
+    monkeypatch.setattr(discovery, "cache_strategy", CacheStrategy.content)
+    discovery.content_cache.clear()
+    processed, _, _ = await stream.receive({"node": node, "type_url": LISTENERS})
+    pushed = await stream.receive(
+        {
+            "type_url": LISTENERS,
+            "version_info": processed.version,
+            "resource_names": ["redirect_to_https"],
+        }
+    )
+    discovery.content_cache.clear()
+    assert pushed is not None
+    assert [r["name"] for r in pushed[0].resources] == ["redirect_to_https"]
+
+
+@pytest.mark.asyncio
+async def test_invalid_requests_are_rejected(stream: AdsStream, node):
+    with pytest.raises(HTTPException) as e:
+        await stream.receive({"type_url": CLUSTERS})
+    assert e.value.status_code == 400
+    with pytest.raises(HTTPException) as e:
+        await stream.receive({"node": node, "type_url": "type.googleapis.com/nope"})
+    assert e.value.status_code == 400
+
+
+class FakeContext:
+    def invocation_metadata(self):
+        return [(":authority", "controlplane")]
+
+    async def abort(self, code, details):
+        raise AssertionError(f"Stream aborted with {code}: {details}")
+
+
+@pytest.mark.asyncio
+async def test_servicer_streams_protobuf_responses(node):
+    pytest.importorskip("grpc")
+    discovery_pb2 = pytest.importorskip("envoy.service.discovery.v3.discovery_pb2")
+    from google.protobuf import json_format
+
+    ads.load_envoy_types()
+    # Envoy's Node only has one of the user agent version fields
+    node = {key: node[key] for key in ("id", "cluster", "metadata", "locality")}
+    request = json_format.ParseDict(
+        {"node": node, "type_url": CLUSTERS},
+        discovery_pb2.DiscoveryRequest(),
+        ignore_unknown_fields=True,
+    )
+
+    async def requests():
+        yield request
+
+    service = ads.AggregatedDiscoveryService()
+    responses = [
+        response
+        async for response in service.StreamAggregatedResources(
+            requests(), FakeContext()
+        )
+    ]
+    assert len(responses) == 1
+    response = responses[0]
+    assert isinstance(response, discovery_pb2.DiscoveryResponse)
+    assert response.type_url == CLUSTERS
+    assert response.nonce == "1"
+    resources = json_format.MessageToDict(response)["resources"]
+    assert [r["name"] for r in resources] == ["httpbin-proxy"]
+
+
+@pytest.mark.asyncio
+async def test_serve_starts_a_grpc_server():
+    pytest.importorskip("grpc")
+    pytest.importorskip("envoy.service.discovery.v3.ads_pb2_grpc")
+    server = await ads.serve(GrpcConfiguration(host="127.0.0.1", port=0))
+    await server.stop(None)
@@ -4,7 +4,15 @@ import boto3
 import pytest
 import yaml
 from moto import mock_s3
-from sovereign.config_loader import Loadable, Serialization, load_s3
+import jinja2
+from sovereign import config_loader
+from sovereign.config_loader import (
+    Loadable,
+    NotModified,
+    Protocol,
+    Serialization,
+    load_s3,
+)
 from sovereign.discovery import deserialize_config
 from starlette.exceptions import HTTPException
 
@@ -138,3 +146,80 @@ def test_loading_python_packaged_resources():
         "pkgdata+string://sovereign:static/style.css"
     ).load()
     assert "font-family:" in data
+
+
+def test_compiled_templates_are_loaded_from_the_bytecode_cache(
+    tmp_path, monkeypatch, mocker
+):
+    monkeypatch.setattr(config_loader.jinja_env, "bytecode_cache", None)
+    config_loader.configure_bytecode_cache(str(tmp_path / "templates"))
+    source = "resources: [{{ name }}]"
+    template = config_loader.compile_template(source, checksum="abc")
+    assert template.render(name="a") == "resources: [a]"
+    assert len(os.listdir(tmp_path / "templates")) == 1
+
+    # A new cache, as used by another worker
+    config_loader.configure_bytecode_cache(str(tmp_path / "templates"))
+    compile = mocker.spy(config_loader.jinja_env, "compile")
+    template = config_loader.compile_template(source, checksum="abc")
+    assert template.render(name="b") == "resources: [b]"
+    compile.assert_not_called()
+
+
+def test_compiling_templates_without_a_bytecode_cache(monkeypatch):
+    monkeypatch.setattr(config_loader.jinja_env, "bytecode_cache", None)
+    template = config_loader.compile_template("{{ 1 + 1 }}", checksum="abc")
+    assert isinstance(template, jinja2.Template)
+    assert template.render() == "2"
+
+
+def test_files_are_only_loaded_again_when_modified(tmp_path):
+    path = tmp_path / "context.yaml"
+    path.write_text("hello: world")
+    loadable = Loadable.from_legacy_fmt(f"file://{path}")
+    data, validator = loadable.load_if_changed()
+    assert data == {"hello": "world"}
+    with pytest.raises(NotModified):
+        loadable.load_if_changed(validator)
+    path.write_text("hello: there")
+    data, _ = loadable.load_if_changed(validator)
+    assert data == {"hello": "there"}
+
+
+def test_http_is_only_loaded_again_when_modified(mocker):
+    response = mocker.Mock(
+        status_code=200,
+        text='{"hello": "world"}',
+        headers={"ETag": '"1"', "Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"},
+    )
+    get = mocker.patch("requests.get", return_value=response)
+    loadable = Loadable.from_legacy_fmt("https+json://example.com/context.json")
+    data, validator = loadable.load_if_changed()
+    assert data == {"hello": "world"}
+    get.return_value = mocker.Mock(status_code=304)
+    with pytest.raises(NotModified):
+        loadable.load_if_changed(validator)
+    get.assert_called_with(
+        "https://example.com/context.json",
+        headers={
+            "If-None-Match": '"1"',
+            "If-Modified-Since": "Wed, 21 Oct 2015 07:28:00 GMT",
+        },
+    )
+
+
+@mock_s3
+def test_s3_is_only_loaded_again_when_modified():
+    s3_client = boto3.client("s3")
+    s3_client.create_bucket(Bucket="test_bucket")
+    s3_client.put_object(Body=b"hello: world", Bucket="test_bucket", Key="key")
+    loadable = Loadable(
+        protocol=Protocol.s3, serialization=Serialization.yaml, path="test_bucket/key"
+    )
+    data, validator = loadable.load_if_changed()
+    assert data == {"hello": "world"}
+    with pytest.raises(NotModified):
+        loadable.load_if_changed(validator)
+    s3_client.put_object(Body=b"hello: there", Bucket="test_bucket", Key="key")
+    data, _ = loadable.load_if_changed(validator)
+    assert data == {"hello": "there"}
@@ -0,0 +1,231 @@
+import threading
+from typing import Dict
+
+import pytest
+
+from sovereign import (
+    XDS_TEMPLATES,
+    config_loader,
+    logs,
+    poller,
+    stats,
+    template_context,
+)
+from sovereign.config_loader import Loadable
+from sovereign.context import TemplateContext, loadable_key
+from sovereign.schemas import ContextConfiguration, XdsTemplate
+from sovereign.utils.version_info import compute_hash
+from sovereign.utils.mock import mock_discovery_request
+
+
+def test_nodes_with_the_same_key_share_the_built_context():
+    template = XDS_TEMPLATES["default"]["clusters"]
+    first = template_context.get_context(
+        mock_discovery_request(service_cluster="T1", region="us-east-1"), template
+    )
+    second = template_context.get_context(
+        mock_discovery_request(service_cluster="T1", region="ap-southeast-2"),
+        template,
+    )
+    assert first is second
+    other = template_context.get_context(
+        mock_discovery_request(service_cluster="X1"), template
+    )
+    assert other is not first
+
+
+def test_nodes_can_be_matched_by_a_list(monkeypatch):
+    monkeypatch.setattr(poller, "node_match_key", "metadata.clusters")
+    template = XDS_TEMPLATES["default"]["clusters"]
+    request = mock_discovery_request(service_cluster="T1")
+    request.node.metadata["clusters"] = ["*"]
+    first = template_context.get_context(request, template)
+    assert [i["name"] for i in first["instances"]] == ["google-proxy", "httpbin-proxy"]
+    assert template_context.get_context(request, template) is first
+
+
+def test_context_is_built_per_template_variables_and_private_keys():
+    request = mock_discovery_request(service_cluster="T1")
+    clusters = template_context.get_context(
+        request, XDS_TEMPLATES["default"]["clusters"]
+    )
+    secrets = template_context.get_context(request, XDS_TEMPLATES["default"]["secrets"])
+    assert clusters is not secrets
+    assert "certificates" in secrets
+
+    assert secrets["crypto"] is template_context.disabled_suite
+
+    request.hide_private_keys = False
+    shown = template_context.get_context(request, XDS_TEMPLATES["default"]["secrets"])
+    assert shown is not secrets
+    assert shown["crypto"] is template_context.crypto
+
+
+def test_context_is_rebuilt_for_a_new_generation(monkeypatch):
+    request = mock_discovery_request(service_cluster="T1")
+    template = XDS_TEMPLATES["default"]["clusters"]
+    first = template_context.get_context(request, template)
+    monkeypatch.setattr(poller, "generation", poller.generation + 1)
+    assert template_context.get_context(request, template) is not first
+    second = template_context.get_context(request, template)
+    monkeypatch.setattr(template_context, "generation", template_context.generation + 1)
+    assert template_context.get_context(request, template) is not second
+
+
+def test_templates_that_modify_their_context_get_their_own():
+    request = mock_discovery_request(service_cluster="T1")
+    template = XdsTemplate(
+        path=XDS_TEMPLATES["default"]["secrets"].loadable, mutable_context=True
+    )
+    first = template_context.get_context(request, template)
+    first["certificates"].append({})
+    second = template_context.get_context(request, template)
+    assert second is not first
+    assert {} not in second["certificates"]
+
+
+def test_matched_instances_can_only_be_modified_by_templates_that_modify_context():
+    request = mock_discovery_request(service_cluster="T1")
+    shared = template_context.get_context(
+        request, XDS_TEMPLATES["default"]["clusters"]
+    )
+    with pytest.raises(TypeError):
+        shared["instances"].append({})
+    with pytest.raises(TypeError):
+        shared["instances"][0]["name"] = "changed"
+
+    template = XdsTemplate(
+        path=XDS_TEMPLATES["default"]["clusters"].loadable, mutable_context=True
+    )
+    mutable = template_context.get_context(request, template)
+    mutable["instances"].append({})
+    mutable["instances"][0]["name"] = "changed"
+    assert template_context.get_context(request, template)["instances"] == [
+        shared["instances"][0]
+    ]
+
+
+def new_template_context(
+    configured_context: Dict[str, Loadable], load_timeout: float = 5
+) -> TemplateContext:
+    return TemplateContext(
+        refresh_rate=None,
+        refresh_cron=None,
+        configured_context=configured_context,
+        poller=poller,
+        encryption_suite=template_context.crypto,
+        disabled_suite=template_context.disabled_suite,
+        logger=logs.application_log,
+        stats=stats,
+        load_timeout=load_timeout,
+    )
+
+
+CERTIFICATES = Loadable.from_legacy_fmt("file://test/config/certificates.yaml")
+
+
+def test_identical_loadables_are_loaded_once(mocker):
+    load = mocker.spy(Loadable, "load_if_changed")
+    context = new_template_context(
+        {"certificates": CERTIFICATES, "certs": CERTIFICATES.copy()}
+    )
+    assert load.call_count == 1
+    assert context.context["certificates"] is context.context["certs"]
+
+
+@pytest.mark.asyncio
+async def test_variables_that_fail_to_load_keep_their_previous_value(mocker):
+    context = new_template_context({"certificates": CERTIFICATES})
+    certificates = context.context["certificates"]
+    mocker.patch.object(Loadable, "load_if_changed", side_effect=OSError("unavailable"))
+    await context.refresh_context()
+    assert context.context["certificates"] is certificates
+    assert context.generation == 0
+
+
+@pytest.mark.asyncio
+async def test_variables_that_load_too_slowly_keep_their_previous_value(mocker):
+    context = new_template_context({"certificates": CERTIFICATES}, load_timeout=0.1)
+    certificates = context.context["certificates"]
+    released = threading.Event()
+    mocker.patch.object(
+        Loadable,
+        "load_if_changed",
+        side_effect=lambda validator: (released.wait(5), None),
+    )
+    await context.refresh_context()
+    assert context.context["certificates"] is certificates
+    # The next refresh waits for the same load, instead of starting another
+    running = context.loading[loadable_key(CERTIFICATES)]
+    assert context.start_loading(CERTIFICATES) is running
+    released.set()
+    await context.refresh_context()
+    assert context.context["certificates"] is True
+    assert context.generation == 1
+
+
+def test_variables_without_a_json_form_can_be_loaded():
+    template = Loadable.from_legacy_fmt("file+jinja://templates/default/routes.yaml")
+    context = new_template_context({"template": template})
+    assert context.fingerprints["template"]
+
+
+def test_variables_without_a_previous_value_raise_when_they_fail_to_load():
+    with pytest.raises(FileNotFoundError):
+        new_template_context({"missing": Loadable.from_legacy_fmt("file:///nope")})
+
+
+@pytest.mark.asyncio
+async def test_unmodified_variables_are_not_loaded_again(tmp_path, mocker):
+    path = tmp_path / "flags.yaml"
+    path.write_text("enabled: yes")
+    context = new_template_context(
+        {"flags": Loadable.from_legacy_fmt(f"file://{path}")}
+    )
+    flags = context.context["flags"]
+    load_file = mocker.spy(config_loader, "load_file")
+    await context.refresh_context()
+    assert context.context["flags"] is flags
+    assert context.generation == 0
+    load_file.assert_not_called()
+
+    path.write_text("enabled: no")
+    await context.refresh_context()
+    assert context.context["flags"] == {"enabled": False}
+    assert context.generation == 1
+
+
+def test_variables_can_be_refreshed_on_their_own_schedule():
+    configured = ContextConfiguration(
+        context={
+            "flags": {"protocol": "inline", "path": "on", "refresh_rate": 10},
+            "tables": {"protocol": "inline", "path": "t", "refresh_cron": "0 0 * * 0"},
+            "certificates": {"protocol": "inline", "path": "c"},
+        },
+        refresh_rate=60,
+    )
+    context = new_template_context(configured.context)
+    context.refresh_rate = configured.refresh_rate
+    assert context.schedules() == {
+        (60, None): ["certificates"],
+        (10, None): ["flags"],
+        (None, "0 0 * * 0"): ["tables"],
+    }
+
+
+@pytest.mark.asyncio
+async def test_refreshing_some_variables_keeps_the_others(mocker):
+    context = new_template_context(
+        {
+            "flags": Loadable.from_legacy_fmt("env://CONFIG_LOADER_TEST"),
+            "certificates": CERTIFICATES,
+        }
+    )
+    certificates = context.context["certificates"]
+    mocker.patch.dict("os.environ", {"CONFIG_LOADER_TEST": "changed"})
+    load = mocker.spy(Loadable, "load_if_changed")
+    await context.refresh_context(["flags"])
+    assert load.call_count == 1
+    assert context.context["flags"] == "changed"
+    assert context.context["certificates"] is certificates
+    assert context.fingerprints["certificates"] == compute_hash(certificates)
@@ -76,3 +76,27 @@ def test_config_dump_shows_everything_except_sensitive_fields(testclient: TestCl
     assert cfg["authentication"]["auth_passwords"] == redacted
     assert cfg["authentication"]["encryption_key"] == redacted
     assert cfg["sentry_dsn"] == redacted
+
+
+@pytest.mark.parametrize(
+    "path",
+    (
+        "/admin/xds_dump?xds_type=clusters",
+        "/ui/resources/clusters/httpbin-proxy",
+        "/ui/resources/routes/rds/httpbin-proxy_virtualhost",
+    ),
+)
+def test_unchanged_resources_are_not_downloaded_again(
+    testclient: TestClient, mocker, path
+):
+    response = testclient.get(path)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    perform_discovery = mocker.patch("sovereign.views.discovery.perform_discovery")
+    for module in ("admin", "interface"):
+        mocker.patch(f"sovereign.views.{module}.perform_discovery", perform_discovery)
+    response = testclient.get(path, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    perform_discovery.assert_not_called()
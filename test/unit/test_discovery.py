@@ -1,7 +1,23 @@
+import asyncio
+import gzip
+from types import ModuleType
+
 import pytest
-from sovereign.schemas import DiscoveryRequest
+from sovereign.schemas import (
+    CacheStrategy,
+    DiscoveryRequest,
+    ProcessedTemplate,
+    Resources,
+    envoy_version,
+)
 from starlette.testclient import TestClient
-from sovereign import stats
+from sovereign import config, discovery, logs, poller, stats, template_context
+from sovereign.utils import templates
+from sovereign.snapshot import generations
+from sovereign.utils.compression import compressors
+from sovereign.utils.mock import mock_discovery_request
+from sovereign.views import discovery as discovery_views
+from sovereign.utils.version_info import compute_hash
 
 
 def test_a_discovery_request_with_bad_auth_fails_with_a_description(
@@ -296,3 +312,521 @@ class TestSecretDiscovery:
         req.resource_names = ["doesNotExist"]
         response = testclient.post("/v3/discovery:secrets", json=req.dict())
         assert response.status_code == 404, response.content
+
+
+def change_context_variable(monkeypatch, key: str) -> None:
+    fingerprints = {**template_context.fingerprints, key: "changed"}
+    monkeypatch.setattr(template_context, "fingerprints", fingerprints)
+    monkeypatch.setattr(template_context, "fingerprint", compute_hash(fingerprints))
+
+
+class TestDeltaDiscovery:
+    @staticmethod
+    def delta_request(req: DiscoveryRequest, **kwargs):
+        return {
+            "node": req.node.dict(),
+            "hide_private_keys": req.hide_private_keys,
+            **kwargs,
+        }
+
+    def test_new_client_receives_every_resource(
+        self, testclient: TestClient, discovery_request_with_auth: DiscoveryRequest
+    ):
+        req = discovery_request_with_auth
+        sotw = testclient.post("/v3/discovery:listeners", json=req.dict()).json()
+        response = testclient.post(
+            "/v3/delta_discovery:listeners", json=self.delta_request(req)
+        )
+        assert response.status_code == 200, response.content
+        data = response.json()
+        assert data["system_version_info"] == discovery_views.delta_version(
+            sotw["version_info"], []
+        )
+        assert [r["resource"] for r in data["resources"]] == sotw["resources"]
+        assert [r["name"] for r in data["resources"]] == [
+            r["name"] for r in sotw["resources"]
+        ]
+        assert data["removed_resources"] == []
+
+    def test_only_changed_and_removed_resources_are_returned(
+        self, testclient: TestClient, discovery_request_with_auth: DiscoveryRequest
+    ):
+        req = discovery_request_with_auth
+        first = testclient.post(
+            "/v3/delta_discovery:listeners", json=self.delta_request(req)
+        ).json()
+        versions = {r["name"]: r["version"] for r in first["resources"]}
+        changed, *unchanged = list(versions)
+        versions[changed] = "outdated"
+        versions["gone"] = "abc"
+        response = testclient.post(
+            "/v3/delta_discovery:listeners",
+            json=self.delta_request(req, initial_resource_versions=versions),
+        )
+        assert response.status_code == 200, response.content
+        data = response.json()
+        assert [r["name"] for r in data["resources"]] == [changed]
+        assert data["removed_resources"] == ["gone"]
+
+    def test_up_to_date_client_receives_304(
+        self, testclient: TestClient, discovery_request_with_auth: DiscoveryRequest
+    ):
+        req = discovery_request_with_auth
+        first = testclient.post(
+            "/v3/delta_discovery:listeners", json=self.delta_request(req)
+        ).json()
+        versions = {r["name"]: r["version"] for r in first["resources"]}
+        response = testclient.post(
+            "/v3/delta_discovery:listeners",
+            json=self.delta_request(req, initial_resource_versions=versions),
+        )
+        assert response.status_code == 304, response.content
+        response = testclient.post(
+            "/v3/delta_discovery:listeners",
+            json=self.delta_request(
+                req, system_version_info=first["system_version_info"]
+            ),
+        )
+        assert response.status_code == 304, response.content
+
+    @pytest.mark.parametrize("strategy", list(CacheStrategy))
+    def test_client_that_subscribes_to_more_resources_receives_them(
+        self,
+        testclient: TestClient,
+        discovery_request_with_auth: DiscoveryRequest,
+        monkeypatch,
+        strategy,
+    ):
+        monkeypatch.setattr(discovery, "cache_strategy", strategy)
+        discovery.content_cache.clear()
+        req = discovery_request_with_auth
+        first = testclient.post(
+            "/v3/delta_discovery:listeners",
+            json=self.delta_request(
+                req, resource_names_subscribe=["redirect_to_https"]
+            ),
+        ).json()
+        versions = {r["name"]: r["version"] for r in first["resources"]}
+        assert list(versions) == ["redirect_to_https"]
+        response = testclient.post(
+            "/v3/delta_discovery:listeners",
+            json=self.delta_request(
+                req,
+                resource_names_subscribe=["redirect_to_https", "https_listener"],
+                initial_resource_versions=versions,
+                system_version_info=first["system_version_info"],
+            ),
+        )
+        discovery.content_cache.clear()
+        assert response.status_code == 200, response.content
+        assert [r["name"] for r in response.json()["resources"]] == ["https_listener"]
+
+
+class TestETag:
+    def test_if_none_match_is_the_same_as_the_version_info(
+        self, testclient: TestClient, discovery_request_with_auth: DiscoveryRequest
+    ):
+        req = discovery_request_with_auth
+        response = testclient.post("/v3/discovery:clusters", json=req.dict())
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+        assert etag == f'"{response.json()["version_info"]}"'
+        response = testclient.post(
+            "/v3/discovery:clusters", json=req.dict(), headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+
+    @pytest.mark.parametrize(
+        "if_none_match,expected",
+        [
+            ('"abc"', "abc"),
+            ('W/"abc"', "abc"),
+            ('"abc", "def"', None),
+            ("abc", None),
+            ("*", None),
+            (None, None),
+        ],
+    )
+    def test_etag_version(self, if_none_match, expected):
+        assert discovery_views.etag_version(if_none_match) == expected
+
+    def test_etag_matches(self):
+        assert discovery_views.etag_matches('"a", W/"b"', '"b"')
+        assert discovery_views.etag_matches("*", '"b"')
+        assert not discovery_views.etag_matches('"a"', '"b"')
+        assert not discovery_views.etag_matches(None, '"b"')
+
+
+class TestCompression:
+    @pytest.fixture(autouse=True)
+    def compression(self, monkeypatch):
+        monkeypatch.setattr(discovery_views.compression, "enabled", True)
+
+    def test_responses_are_compressed_according_to_accept_encoding(
+        self, testclient: TestClient, discovery_request_with_auth: DiscoveryRequest
+    ):
+        req = discovery_request_with_auth
+        identity = testclient.post(
+            "/v3/discovery:listeners",
+            json=req.dict(),
+            headers={"Accept-Encoding": "identity"},
+        )
+        assert "Content-Encoding" not in identity.headers
+        # The test client decompresses the response
+        compressed = testclient.post(
+            "/v3/discovery:listeners",
+            json=req.dict(),
+            headers={"Accept-Encoding": "gzip"},
+        )
+        assert compressed.headers["Content-Encoding"] == "gzip"
+        assert compressed.headers["Vary"] == "Accept-Encoding"
+        assert compressed.content == identity.content
+
+    def test_compressed_responses_have_a_weak_etag(
+        self, testclient: TestClient, discovery_request_with_auth: DiscoveryRequest
+    ):
+        req = discovery_request_with_auth
+        identity = testclient.post(
+            "/v3/discovery:listeners",
+            json=req.dict(),
+            headers={"Accept-Encoding": "identity"},
+        )
+        version = identity.json()["version_info"]
+        assert identity.headers["ETag"] == f'"{version}"'
+        compressed = testclient.post(
+            "/v3/discovery:listeners",
+            json=req.dict(),
+            headers={"Accept-Encoding": "gzip"},
+        )
+        assert compressed.headers["ETag"] == f'W/"{version}"'
+        not_modified = testclient.post(
+            "/v3/discovery:listeners",
+            json=req.dict(),
+            headers={
+                "Accept-Encoding": "gzip",
+                "If-None-Match": compressed.headers["ETag"],
+            },
+        )
+        assert not_modified.status_code == 304
+
+    def test_compressed_responses_are_kept_along_with_the_response(self):
+        processed = ProcessedTemplate(resources=[{"name": "a"}], version_info="1")
+        assert gzip.decompress(processed.compressed("gzip")) == processed.rendered
+        assert processed.compressed("gzip") is processed.compressed("gzip")
+
+    def test_identical_requests_reuse_the_compressed_response(
+        self,
+        testclient: TestClient,
+        discovery_request_with_auth: DiscoveryRequest,
+        monkeypatch,
+        mocker,
+    ):
+        monkeypatch.setattr(discovery, "cache_strategy", CacheStrategy.content)
+        discovery.content_cache.clear()
+        compress = mocker.Mock(side_effect=compressors["gzip"])
+        monkeypatch.setitem(compressors, "gzip", compress)
+        req = discovery_request_with_auth
+        for _ in range(2):
+            response = testclient.post(
+                "/v3/discovery:listeners",
+                json=req.dict(),
+                headers={"Accept-Encoding": "gzip"},
+            )
+            assert response.headers["Content-Encoding"] == "gzip"
+        assert compress.call_count == 1
+        discovery.content_cache.clear()
+
+
+class TestWatch:
+    def test_up_to_date_client_receives_304_once_the_timeout_expires(
+        self, testclient: TestClient, discovery_request_with_auth: DiscoveryRequest
+    ):
+        stats.emitted.clear()
+        req = discovery_request_with_auth
+        response = testclient.post("/v3/discovery:clusters", json=req.dict())
+        req.version_info = response.json()["version_info"]
+        response = testclient.post(
+            "/v3/discovery:clusters?watch=true&timeout=0.05", json=req.dict()
+        )
+        assert response.status_code == 304, response.content
+        assert stats.emitted.get("discovery.watch.timeout") == 1, stats.emitted
+
+    @pytest.mark.asyncio
+    async def test_watching_client_receives_changed_resources(
+        self, discovery_request_with_auth: DiscoveryRequest, monkeypatch
+    ):
+        req = discovery_request_with_auth
+        template = discovery.select_template(req, "clusters")
+        req.version_info = discovery.input_version(req, "clusters", template)
+        generation = generations.latest()
+        watching = asyncio.ensure_future(
+            discovery_views.watch_for_changes(req, "v3", "clusters", generation, 5)
+        )
+        await asyncio.sleep(0)
+        assert not watching.done()
+
+        change_context_variable(monkeypatch, "certificates")
+        monkeypatch.setattr(template_context, "generation", generation[1] + 1)
+        generations.check()
+        response = await asyncio.wait_for(watching, 5)
+        assert response.version != req.version_info
+        assert [r["name"] for r in response.resources] == ["httpbin-proxy"]
+
+
+class TestInputVersion:
+    def test_up_to_date_client_receives_304_without_rendering(
+        self,
+        testclient: TestClient,
+        discovery_request_with_auth: DiscoveryRequest,
+        mocker,
+    ):
+        req = discovery_request_with_auth
+        response = testclient.post("/v3/discovery:clusters", json=req.dict())
+        req.version_info = response.json()["version_info"]
+        render = mocker.spy(discovery, "render")
+        response = testclient.post("/v3/discovery:clusters", json=req.dict())
+        assert response.status_code == 304, response.content
+        render.assert_not_called()
+
+    def test_version_does_not_depend_on_generations(
+        self, discovery_request_with_auth: DiscoveryRequest, monkeypatch
+    ):
+        req = discovery_request_with_auth
+        template = discovery.select_template(req, "clusters")
+        version = discovery.input_version(req, "clusters", template)
+        monkeypatch.setattr(template_context, "generation", 100)
+        monkeypatch.setattr(poller, "generation", 100)
+        assert discovery.input_version(req, "clusters", template) == version
+
+    def test_version_changes_with_the_template_context(
+        self, discovery_request_with_auth: DiscoveryRequest, monkeypatch
+    ):
+        req = discovery_request_with_auth
+        template = discovery.select_template(req, "clusters")
+        version = discovery.input_version(req, "clusters", template)
+        change_context_variable(monkeypatch, "certificates")
+        assert discovery.input_version(req, "clusters", template) != version
+
+    def test_version_only_changes_with_context_variables_the_template_uses(
+        self, discovery_request_with_auth: DiscoveryRequest, monkeypatch
+    ):
+        req = discovery_request_with_auth
+        routes = discovery.select_template(req, "routes")
+        secrets = discovery.select_template(req, "secrets")
+        assert not routes.uses("certificates")
+        routes_version = discovery.input_version(req, "routes", routes)
+        secrets_version = discovery.input_version(req, "secrets", secrets)
+        change_context_variable(monkeypatch, "certificates")
+        assert discovery.input_version(req, "routes", routes) == routes_version
+        assert discovery.input_version(req, "secrets", secrets) != secrets_version
+
+    def test_version_changes_with_the_requested_resources(
+        self, discovery_request_with_auth: DiscoveryRequest
+    ):
+        req = discovery_request_with_auth
+        template = discovery.select_template(req, "clusters")
+        version = discovery.input_version(req, "clusters", template)
+        req.resource_names = ["httpbin-proxy"]
+        assert discovery.input_version(req, "clusters", template) != version
+
+    def test_version_changes_with_the_configuration_and_context_modules(
+        self, discovery_request_with_auth: DiscoveryRequest, monkeypatch
+    ):
+        req = discovery_request_with_auth
+        template = discovery.select_template(req, "clusters")
+        version = discovery.input_version(req, "clusters", template)
+        monkeypatch.setattr(config.legacy_fields, "dns_hard_fail", True)
+        monkeypatch.setattr(discovery, "salt", discovery.version_salt())
+        assert discovery.input_version(req, "clusters", template) != version
+
+        monkeypatch.undo()
+        eds = template_context.context["eds"]
+        monkeypatch.setattr(eds, "__file__", templates.__file__)
+        monkeypatch.setattr(discovery, "salt", discovery.version_salt())
+        assert discovery.input_version(req, "clusters", template) != version
+
+
+class TestContentCacheStrategy:
+    @pytest.fixture(autouse=True)
+    def content_strategy(self, monkeypatch):
+        monkeypatch.setattr(discovery, "cache_strategy", CacheStrategy.content)
+        discovery.content_cache.clear()
+        yield
+        discovery.content_cache.clear()
+
+    def test_identical_requests_are_rendered_once(
+        self, testclient: TestClient, discovery_request_with_auth: DiscoveryRequest
+    ):
+        stats.emitted.clear()
+        req = discovery_request_with_auth
+        first = testclient.post("/v3/discovery:clusters", json=req.dict())
+        assert first.status_code == 200, first.content
+        assert stats.emitted.get("discovery.clusters.cache_miss") == 1, stats.emitted
+
+        req.node.id = "another-proxy-in-the-same-cluster"
+        second = testclient.post("/v3/discovery:clusters", json=req.dict())
+        assert second.status_code == 200, second.content
+        assert second.json() == first.json()
+        assert stats.emitted.get("discovery.clusters.cache_hit") == 1, stats.emitted
+
+    def test_cached_content_is_invalidated_by_a_context_refresh(
+        self,
+        testclient: TestClient,
+        discovery_request_with_auth: DiscoveryRequest,
+        monkeypatch,
+    ):
+        stats.emitted.clear()
+        req = discovery_request_with_auth
+        testclient.post("/v3/discovery:clusters", json=req.dict())
+        change_context_variable(monkeypatch, "certificates")
+        testclient.post("/v3/discovery:clusters", json=req.dict())
+        assert stats.emitted.get("discovery.clusters.cache_miss") == 2, stats.emitted
+        assert not stats.emitted.get("discovery.clusters.cache_hit"), stats.emitted
+
+    def test_up_to_date_client_still_receives_304(
+        self, testclient: TestClient, discovery_request_with_auth: DiscoveryRequest
+    ):
+        req = discovery_request_with_auth
+        response = testclient.post("/v3/discovery:clusters", json=req.dict())
+        req.version_info = response.json()["version_info"]
+        response = testclient.post("/v3/discovery:clusters", json=req.dict())
+        assert response.status_code == 304, response.content
+
+
+class TestStageTimings:
+    def test_stages_are_emitted_as_timings(
+        self,
+        testclient: TestClient,
+        discovery_request_with_auth: DiscoveryRequest,
+    ):
+        stats.emitted.clear()
+        req = discovery_request_with_auth
+        response = testclient.post("/v3/discovery:listeners", json=req.dict())
+        assert response.status_code == 200, response.content
+        for stage in (
+            "auth",
+            "match_node",
+            "context",
+            "render",
+            "deserialize",
+            "inject_type",
+            "hash",
+            "filter",
+            "serialize",
+            "compress",
+        ):
+            assert f"discovery.{stage}_ms" in stats.emitted, stats.emitted
+
+    def test_stages_are_queued_as_log_fields(
+        self, discovery_request_with_auth: DiscoveryRequest
+    ):
+        logs.clear_log_fields()
+        req = discovery_request_with_auth
+        template = discovery.select_template(req, "listeners")
+        discovery.render(req, template, discovery.type_urls["v3"]["listeners"])
+        fields = logs.get_log_fields()
+        for field in ("RENDER_MS", "DESERIALIZE_MS", "INJECT_TYPE_MS", "FILTER_MS"):
+            assert isinstance(fields[field], float)
+
+
+class TestDeserializeConfig:
+    def test_identical_text_is_only_parsed_once(self, mocker):
+        discovery.parse_cache.clear()
+        load = mocker.spy(discovery.yaml, "load")
+        text = "resources: [{name: a}]"
+        first = discovery.deserialize_config(text)
+        second = discovery.deserialize_config(text)
+        assert first == {"resources": [{"name": "a"}]}
+        assert second is first
+        assert load.call_count == 1
+
+    def test_shared_resources_are_not_modified_when_adding_type_urls(
+        self, discovery_request_with_auth: DiscoveryRequest
+    ):
+        discovery.parse_cache.clear()
+        req = discovery_request_with_auth
+        template = discovery.select_template(req, "listeners")
+        v2 = discovery.render(req, template, discovery.type_urls["v2"]["listeners"])
+        v3 = discovery.render(req, template, discovery.type_urls["v3"]["listeners"])
+        assert {r["@type"] for r in v2.resources} == {
+            discovery.type_urls["v2"]["listeners"]
+        }
+        assert {r["@type"] for r in v3.resources} == {
+            discovery.type_urls["v3"]["listeners"]
+        }
+
+
+class TestPreEncodedResources:
+    def test_python_templates_can_yield_encoded_resources(
+        self, discovery_request_with_auth: DiscoveryRequest, monkeypatch
+    ):
+        encoded = b'{"name":"a","@type":"cluster"}'
+        module = ModuleType("encoded")
+        module.call = lambda **kwargs: iter([encoded])  # type: ignore[attr-defined]
+        template = discovery.select_template(discovery_request_with_auth, "clusters")
+        monkeypatch.setattr(template, "code", module)
+        processed = discovery.render(
+            discovery_request_with_auth, template, discovery.type_urls["v3"]["clusters"]
+        )
+        assert processed.fragment(0) is encoded
+        assert processed.rendered.endswith(b'"resources":[' + encoded + b"]}")
+
+
+class TestSelectVersion:
+    versions = ["default", "1.1", "1.13", "1.1", "__any__", "1.13.5"]
+
+    @staticmethod
+    def select_by_scanning(version, versions):
+        selection = "default"
+        for v in versions:
+            if version.startswith(v):
+                selection = v
+        return selection
+
+    @pytest.mark.parametrize(
+        "version", ["1.13.5", "1.13.1", "1.14.0", "1.10.0", "2.0.0", "default", ""]
+    )
+    def test_index_selects_the_same_version_as_scanning(self, version):
+        index = discovery.VersionIndex(self.versions)
+        assert index.select(version) == self.select_by_scanning(version, self.versions)
+
+    def test_envoy_versions_are_only_parsed_once(self):
+        envoy_version.cache_clear()
+        for _ in range(3):
+            request = mock_discovery_request(version="1.25.3")
+            assert request.envoy_version == "1.25.3"
+        assert envoy_version.cache_info().misses == 1
+        request.node.build_version = "unparseable"
+        assert request.envoy_version == "default"
+        request.node.user_agent_build_version.version.major_number = 2
+        assert request.envoy_version == "2.0.0"
+
+
+class TestFilterResources:
+    generated = [
+        {"name": "a"},
+        {"cluster_name": "b"},
+        {"name": "c"},
+        {"name": "a", "duplicate": True},
+    ]
+
+    def test_resources_matches_everything_when_empty(self):
+        assert "anything" in Resources()
+        assert "a" in Resources(["a"])
+        assert "b" not in Resources(["a"])
+
+    @pytest.mark.parametrize(
+        "requested,expected",
+        [
+            pytest.param([], [0, 1, 2, 3], id="nothing requested"),
+            pytest.param(["c", "a"], [0, 2, 3], id="keeps generated order"),
+            pytest.param(["b", "missing"], [1], id="ignores unknown names"),
+        ],
+    )
+    def test_indexed_filtering_matches_unindexed_filtering(self, requested, expected):
+        index = ProcessedTemplate(resources=self.generated, version_info="1").index
+        requested = Resources(requested)
+        filtered = discovery.filter_resources(self.generated, requested, index)
+        assert filtered == discovery.filter_resources(self.generated, requested)
+        assert filtered == [self.generated[i] for i in expected]
@@ -0,0 +1,143 @@
+import asyncio
+import os
+import threading
+
+import pytest
+from starlette.exceptions import HTTPException
+
+from sovereign import discovery, logs, stats
+from sovereign.rendering import (
+    ProcessRenderer,
+    SharedState,
+    attach,
+    configure_renderer,
+    render_in_worker,
+)
+from sovereign.schemas import DiscoveryRequest, RenderingConfiguration
+from sovereign.utils.executor import BoundedExecutor
+
+
+@pytest.fixture
+def shared(tmp_path):
+    shared = SharedState(str(tmp_path))
+    yield shared
+    shared.close()
+
+
+def test_shared_state_is_written_once_per_generation(shared: SharedState, monkeypatch):
+    path = shared.acquire()
+    assert shared.acquire() == path
+    shared.release(path)
+
+    monkeypatch.setattr(discovery, "content_generation", lambda: ("new",))
+    newer = shared.acquire()
+    assert newer != path
+    # Still in use by a render
+    assert os.path.exists(path)
+    shared.release(path)
+    assert not os.path.exists(path)
+    shared.release(newer)
+    assert os.path.exists(newer)
+
+
+def test_rendering_from_shared_state_matches_rendering_directly(
+    shared: SharedState, discovery_request_with_auth: DiscoveryRequest
+):
+    req = discovery_request_with_auth
+    expected = discovery.render_response(req, "clusters", None)
+    path = shared.acquire()
+    attach(path)
+    version, rendered, fragments, hashes = render_in_worker(
+        path, req, "clusters", None
+    )
+    shared.release(path)
+    assert version == expected.version
+    assert rendered == expected.rendered
+    assert fragments == expected.fragments
+    assert hashes == expected.resource_hashes
+
+
+@pytest.mark.asyncio
+async def test_process_renderer_acquires_shared_state_off_the_event_loop(
+    shared: SharedState, discovery_request_with_auth: DiscoveryRequest, monkeypatch
+):
+    # Renders inline, in place of a worker process
+    renderer = ProcessRenderer(BoundedExecutor(None, logs, stats), shared)
+    acquire = shared.acquire
+    acquired_in = []
+
+    def acquire_in_thread():
+        acquired_in.append(threading.get_ident())
+        return acquire()
+
+    monkeypatch.setattr(shared, "acquire", acquire_in_thread)
+    req = discovery_request_with_auth
+    rendered = await renderer.render(req, "clusters", None)
+    assert acquired_in and threading.get_ident() not in acquired_in
+    assert shared.users == {}
+
+    expected = discovery.render_response(req, "clusters", None)
+    assert rendered.rendered == expected.rendered
+    assert rendered.resources == expected.resources
+    assert rendered.delta({}) == expected.delta({})
+
+
+@pytest.mark.timeout(60)
+@pytest.mark.asyncio
+async def test_process_renderer_renders_in_worker_processes(
+    tmp_path, discovery_request_with_auth: DiscoveryRequest
+):
+    renderer = configure_renderer(
+        RenderingConfiguration(
+            executor="process",
+            concurrency=1,
+            shared_state_directory=str(tmp_path),
+        )
+    )
+    assert isinstance(renderer, ProcessRenderer)
+    req = discovery_request_with_auth
+    try:
+        rendered = await renderer.rendered_response(req, "clusters", None)
+        assert rendered.rendered == discovery.rendered_response(req, "clusters").rendered
+
+        req.node.cluster = "does-not-match-anything"
+        req.node.metadata.pop("auth", None)
+        with pytest.raises(HTTPException) as e:
+            await renderer.rendered_response(req, "clusters", None)
+        assert e.value.status_code == 400
+    finally:
+        renderer.executor.pool.shutdown()
+        renderer.shared.close()
+
+
+@pytest.mark.asyncio
+async def test_identical_concurrent_renders_are_coalesced(
+    discovery_request_with_auth: DiscoveryRequest, mocker
+):
+    renderer = configure_renderer(RenderingConfiguration(executor="inline"))
+    render = mocker.spy(discovery, "render_response")
+    req = discovery_request_with_auth
+    other = req.copy(deep=True)
+    other.node.id = "another-proxy-in-the-same-cluster"
+    first, second = await asyncio.gather(
+        renderer.rendered_response(req, "clusters", None),
+        renderer.rendered_response(other, "clusters", None),
+    )
+    assert render.call_count == 1
+    assert first.rendered == second.rendered
+
+
+@pytest.mark.asyncio
+async def test_thread_renderer_serializes_in_the_render_thread(
+    discovery_request_with_auth: DiscoveryRequest,
+):
+    renderer = configure_renderer(RenderingConfiguration(executor="thread"))
+    logs.clear_log_fields()
+    try:
+        rendered = await renderer.rendered_response(
+            discovery_request_with_auth, "clusters", None
+        )
+        assert rendered._rendered is not None
+        assert isinstance(logs.get_log_fields()["SERIALIZE_MS"], float)
+    finally:
+        renderer.executor.pool.shutdown()
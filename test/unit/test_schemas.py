@@ -1,6 +1,14 @@
+import orjson
 import pytest
-from sovereign.schemas import ContextConfiguration
+from sovereign.schemas import (
+    ContextConfiguration,
+    ContextLoadable,
+    JsonResponseClass,
+    ProcessedTemplate,
+    call_parameters,
+)
 from pydantic import ValidationError
+from sovereign.utils.version_info import digest
 
 
 @pytest.mark.parametrize("input_rate", [1, 5000, 10000])
@@ -54,3 +62,61 @@ def test_context_configuration_raises_on_multiple_refresh_methods() -> None:
         ContextConfiguration(
             context={}, refresh=True, refresh_rate=5, refresh_cron="* * * * *"
         )
+
+
+def test_context_variable_raises_on_invalid_refresh_cron() -> None:
+    with pytest.raises(ValidationError):
+        ContextLoadable(protocol="inline", path="x", refresh_cron="test")
+
+
+def test_context_variable_raises_on_multiple_refresh_methods() -> None:
+    with pytest.raises(RuntimeError, match="for x"):
+        ContextLoadable(
+            protocol="inline", path="x", refresh_rate=5, refresh_cron="* * * * *"
+        )
+
+
+def test_processed_template_renders_the_same_json_as_the_whole_response() -> None:
+    resources = [{"port": 1, "name": "a"}, {"name": "b", "nested": {"x": [1, 2]}}]
+    processed = ProcessedTemplate(resources=resources, version_info="123")
+    assert orjson.loads(processed.rendered) == orjson.loads(
+        JsonResponseClass(content="").render(
+            {"version_info": "123", "resources": resources}
+        )
+    )
+
+
+def test_processed_template_subsets_reuse_serialized_resources() -> None:
+    processed = ProcessedTemplate(
+        resources=[{"name": "a"}, {"name": "b"}], version_info="123"
+    )
+    subset = processed.select([1])
+    assert subset.resources == [{"name": "b"}]
+    assert subset.fragment(0) is processed.fragment(1)
+    assert orjson.loads(subset.rendered)["resources"] == [{"name": "b"}]
+
+
+def test_processed_template_uses_pre_encoded_resources_as_is() -> None:
+    encoded = b'{"name":"b","@type":"cluster"}'
+    processed = ProcessedTemplate(
+        resources=[{"name": "a"}, encoded], version_info="123"
+    )
+    assert processed.count == 2
+    assert processed.fragment(1) is encoded
+    assert processed.resource_hashes[1] == digest(encoded)
+    assert orjson.loads(processed.rendered)["resources"][1] == orjson.loads(encoded)
+    # Only decoded when needed, e.g. to find resources by name
+    assert processed.index == {"a": [0], "b": [1]}
+    assert processed.resources[1] == {"name": "b", "@type": "cluster"}
+    assert processed.select([1]).fragment(0) is encoded
+
+
+def test_python_template_variables_are_the_parameters_of_call() -> None:
+    def call(instances, discovery_request, *, certificates=None):
+        return []
+
+    def call_with_kwargs(instances, **kwargs):
+        return []
+
+    assert call_parameters(call) == {"instances", "discovery_request", "certificates"}
+    assert call_parameters(call_with_kwargs) is None
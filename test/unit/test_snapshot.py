@@ -0,0 +1,145 @@
+import pytest
+from starlette.testclient import TestClient
+from sovereign import XDS_TEMPLATES, discovery, poller, stats, template_context
+from sovereign.config_loader import Loadable
+from sovereign.schemas import CacheStrategy, DiscoveryRequest, XdsTemplate
+from sovereign.snapshot import Prerenderer, Snapshot
+from sovereign.utils.version_info import compute_hash
+from sovereign.views import discovery as discovery_views
+
+
+ROUTES = """
+resources:
+  - name: rds
+    virtual_hosts:
+    {% for instance in instances %}
+      - name: {{ instance.name }}_virtualhost
+        domains: {{ instance.domains|tojson }}
+    {% endfor %}
+"""
+
+
+@pytest.fixture
+def prerenderer(monkeypatch, tmp_path):
+    # Routes that don't use the host header, so that they can be pre-rendered
+    path = tmp_path / "routes.yaml"
+    path.write_text(ROUTES)
+    routes = XdsTemplate(path=Loadable.from_legacy_fmt(f"file+jinja://{path}"))
+    monkeypatch.setitem(XDS_TEMPLATES["default"], "routes", routes)
+    poller.poll()
+    prerenderer = Prerenderer(api_versions=["v3"])
+    prerenderer.snapshot = prerenderer.build()
+    monkeypatch.setattr(discovery_views, "PRERENDER", True)
+    monkeypatch.setattr(discovery_views, "prerenderer", prerenderer)
+    return prerenderer
+
+
+def test_snapshot_contains_every_match_key_and_type(prerenderer: Prerenderer):
+    assert not prerenderer.outdated
+    for xds_type in ("routes", "secrets", "endpoints"):
+        assert ("T1", "default", xds_type, "v3") in prerenderer.snapshot.table
+    # These use the discovery request or host header
+    for xds_type in ("clusters", "listeners"):
+        assert ("T1", "default", xds_type, "v3") not in prerenderer.snapshot.table
+    rendered = prerenderer.snapshot.get(("T1", "default", "routes", "v3"))
+    virtual_hosts = rendered.resources[0]["virtual_hosts"]
+    assert [v["name"] for v in virtual_hosts] == ["httpbin-proxy_virtualhost"]
+
+
+def test_discovery_requests_are_served_from_the_snapshot(
+    prerenderer: Prerenderer,
+    testclient: TestClient,
+    discovery_request_with_auth: DiscoveryRequest,
+):
+    stats.emitted.clear()
+    req = discovery_request_with_auth
+    req.hide_private_keys = False
+    req.resource_names = ["rds"]
+    response = testclient.post("/v3/discovery:routes", json=req.dict())
+    assert response.status_code == 200, response.content
+    assert [r["name"] for r in response.json()["resources"]] == ["rds"]
+    assert stats.emitted.get("snapshot.hit") == 1, stats.emitted
+
+    req.version_info = response.json()["version_info"]
+    response = testclient.post("/v3/discovery:routes", json=req.dict())
+    assert response.status_code == 304, response.content
+
+
+def test_snapshot_versions_match_rendered_versions_with_content_strategy(
+    prerenderer: Prerenderer,
+    testclient: TestClient,
+    discovery_request_with_auth: DiscoveryRequest,
+    monkeypatch,
+):
+    # With the context strategy, versions include fields of the request
+    # that the representative request doesn't share
+    monkeypatch.setattr(discovery, "cache_strategy", CacheStrategy.content)
+    discovery.content_cache.clear()
+    prerenderer.snapshot = Snapshot(generation=None, table={})
+    prerenderer.snapshot = prerenderer.build()
+    req = discovery_request_with_auth
+    req.hide_private_keys = False
+    snapshot_version = testclient.post(
+        "/v3/discovery:routes", json=req.dict()
+    ).json()["version_info"]
+    prerenderer.snapshot = Snapshot(generation=None, table={})
+    rendered_version = testclient.post(
+        "/v3/discovery:routes", json=req.dict()
+    ).json()["version_info"]
+    assert snapshot_version == rendered_version
+
+
+def test_snapshot_only_rerenders_match_keys_whose_instances_changed(
+    prerenderer: Prerenderer, mocker, monkeypatch
+):
+    previous = prerenderer.snapshot
+    fingerprints = dict(poller.match_fingerprints)
+    fingerprints["T1"] = {scope: "changed" for scope in fingerprints["T1"]}
+    monkeypatch.setattr(poller, "match_fingerprints", fingerprints)
+    monkeypatch.setattr(poller, "generation", poller.generation + 1)
+    render = mocker.spy(discovery, "render")
+
+    prerenderer.snapshot = prerenderer.build()
+
+    rendered_keys = {call.args[0].node.cluster for call in render.call_args_list}
+    assert rendered_keys == {"T1"}
+    unchanged = ("X1", "default", "routes", "v3")
+    assert prerenderer.snapshot.get(unchanged) is previous.get(unchanged)
+    changed = ("T1", "default", "routes", "v3")
+    assert prerenderer.snapshot.get(changed) is not previous.get(changed)
+
+
+def test_snapshot_only_rerenders_templates_that_use_a_changed_context_variable(
+    prerenderer: Prerenderer, mocker, monkeypatch
+):
+    fingerprints = {**template_context.fingerprints, "certificates": "changed"}
+    monkeypatch.setattr(template_context, "fingerprints", fingerprints)
+    monkeypatch.setattr(template_context, "fingerprint", compute_hash(fingerprints))
+    monkeypatch.setattr(template_context, "generation", template_context.generation + 1)
+    render = mocker.spy(discovery, "render")
+
+    prerenderer.snapshot = prerenderer.build()
+
+    rendered = {call.args[1] for call in render.call_args_list}
+    assert rendered
+    assert all(template.uses("certificates") for template in rendered)
+    assert XDS_TEMPLATES["default"]["routes"] not in rendered
+
+
+def test_templates_that_use_the_host_header_are_rendered_per_request(
+    prerenderer: Prerenderer,
+    testclient: TestClient,
+    discovery_request_with_auth: DiscoveryRequest,
+):
+    stats.emitted.clear()
+    req = discovery_request_with_auth
+    req.hide_private_keys = False
+    req.resource_names = []
+    for host in ("one.example.com", "two.example.com"):
+        # Same match key as the previous node, but a different host header
+        response = testclient.post(
+            "/v3/discovery:listeners", json=req.dict(), headers={"Host": host}
+        )
+        assert response.status_code == 200, response.content
+        assert host in response.text
+    assert "snapshot.hit" not in stats.emitted, stats.emitted
@@ -1,3 +1,9 @@
+import asyncio
+from decimal import Decimal
+import threading
+
+import pytest
+
 from sovereign import logs, stats
 from sovereign.sources import SourcePoller
 from sovereign.schemas import ConfiguredSource
@@ -54,3 +60,172 @@ def test_source_poller():
 # ie. some value within the source response, which acts as a versioning number
 # so that source refresh can be avoided somehow. Not sure.... need to think
 # more about this.
+
+
+def test_source_poller_generation_only_changes_with_the_data():
+    source = ConfiguredSource(
+        type="inline",
+        scope="default",
+        config={"instances": [{"name": "a", "example": "foo"}]},
+    )
+    poller = SourcePoller(
+        sources=[source],
+        matching_enabled=True,
+        node_match_key="cluster",
+        source_match_key="example",
+        source_refresh_rate=10,
+        logger=logs,
+        stats=stats,
+    )
+    poller.poll()
+    generation = poller.generation
+    poller.poll()
+    assert poller.generation == generation
+
+    poller.sources[0].instances = [{"name": "b", "example": "foo"}]
+    poller.poll()
+    assert poller.generation == generation + 1
+
+
+def test_source_poller_only_reports_match_keys_whose_instances_changed():
+    source = ConfiguredSource(
+        type="inline",
+        scope="default",
+        config={
+            "instances": [
+                {"name": "a", "example": "foo"},
+                {"name": "b", "example": "bar"},
+            ]
+        },
+    )
+    poller = SourcePoller(
+        sources=[source],
+        matching_enabled=True,
+        node_match_key="cluster",
+        source_match_key="example",
+        source_refresh_rate=10,
+        logger=logs,
+        stats=stats,
+    )
+    poller.poll()
+    assert poller.changed_match_keys == {"*", "foo", "bar"}
+    foo = poller.match_fingerprint("foo")
+    bar = poller.match_fingerprint("bar")
+
+    poller.sources[0].instances = [
+        {"name": "a", "example": "foo"},
+        {"name": "b", "example": "bar", "changed": True},
+    ]
+    poller.poll()
+    assert poller.changed_match_keys == {"*", "bar"}
+    assert poller.match_fingerprint("foo") == foo
+    assert poller.match_fingerprint("bar") != bar
+    assert poller.match_fingerprint("unknown") is None
+
+
+def poller_with(instances):
+    return SourcePoller(
+        sources=[
+            ConfiguredSource(
+                type="inline", scope="default", config={"instances": instances}
+            )
+        ],
+        matching_enabled=True,
+        node_match_key="cluster",
+        source_match_key="clusters",
+        source_refresh_rate=10,
+        logger=logs,
+        stats=stats,
+    )
+
+
+@pytest.mark.parametrize(
+    "changed",
+    [
+        # added
+        [{"name": "a", "clusters": ["foo"]}, {"name": "c", "clusters": ["baz"]}],
+        # removed
+        [{"name": "a", "clusters": ["foo"]}],
+        # modified
+        [{"name": "a", "clusters": ["foo"]}, {"name": "b", "clusters": ["bar", "x"]}],
+        # duplicated
+        [{"name": "b", "clusters": ["bar"]}, {"name": "b", "clusters": ["bar"]}],
+        # reordered
+        [{"name": "b", "clusters": ["bar"]}, {"name": "a", "clusters": ["foo"]}],
+        # matches every match key
+        [{"name": "a", "clusters": ["foo"]}, {"name": "b", "clusters": ["*"]}],
+        # matched by substring
+        [{"name": "a", "clusters": "foo-bar"}, {"name": "b", "clusters": ["bar"]}],
+    ],
+)
+def test_match_keys_are_fingerprinted_incrementally(changed):
+    poller = poller_with(
+        [{"name": "a", "clusters": ["foo"]}, {"name": "b", "clusters": ["bar"]}]
+    )
+    poller.poll()
+    poller.sources[0].instances = changed
+    poller.poll()
+
+    fresh = poller_with(changed)
+    fresh.poll()
+    assert poller.match_fingerprints == fresh.match_fingerprints
+
+
+def test_only_changed_instances_are_matched_again(mocker):
+    instances = [
+        {"name": f"service-{i}", "clusters": [f"cluster-{i % 10}"]} for i in range(100)
+    ]
+    poller = poller_with(instances)
+    poller.poll()
+    matching_keys = mocker.spy(poller, "matching_keys")
+    poller.sources[0].instances = instances[:-1] + [
+        {"name": "service-99", "clusters": ["cluster-9"], "changed": True}
+    ]
+    poller.poll()
+    assert matching_keys.call_count == 1
+    assert poller.changed_match_keys == {"*", "cluster-9"}
+
+
+@pytest.mark.asyncio
+async def test_sources_are_polled_off_the_event_loop(mocker):
+    poller = poller_with([{"name": "a", "clusters": ["foo"]}])
+    polled = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    threads = []
+
+    def poll():
+        threads.append(threading.get_ident())
+        loop.call_soon_threadsafe(polled.set)
+
+    mocker.patch.object(poller, "poll", side_effect=poll)
+    task = asyncio.ensure_future(poller.poll_forever())
+    await asyncio.wait_for(polled.wait(), 5)
+    task.cancel()
+    assert threads[0] != threading.get_ident()
+
+
+@pytest.mark.asyncio
+async def test_polls_from_requests_call_on_change():
+    poller = poller_with([{"name": "a", "clusters": ["foo"]}])
+    changed = asyncio.Event()
+    poller.on_change.append(changed.set)
+    task = asyncio.ensure_future(poller.poll_forever())
+    await asyncio.wait_for(changed.wait(), 5)
+    changed.clear()
+
+    # Such as a discovery request finding stale data, in a render thread
+    poller.sources[0].instances = [{"name": "b", "clusters": ["foo"]}]
+    await asyncio.get_running_loop().run_in_executor(None, poller.poll)
+    await asyncio.wait_for(changed.wait(), 5)
+    task.cancel()
+    assert poller.notified_generation == poller.generation
+
+
+def test_instances_without_a_json_form_can_be_polled():
+    poller = poller_with([{"name": "a", "clusters": ["foo"], "weight": Decimal(1)}])
+    poller.poll()
+    poller.sources[0].instances = [
+        {"name": "a", "clusters": ["foo"], "weight": Decimal(2)}
+    ]
+    poller.poll()
+    assert poller.changed_match_keys == {"*", "foo"}
@@ -0,0 +1,21 @@
+import pytest
+
+from sovereign.utils.compression import negotiate
+
+
+@pytest.mark.parametrize(
+    "accept_encoding,expected",
+    [
+        pytest.param("", None, id="nothing accepted"),
+        pytest.param("gzip, deflate", "gzip", id="gzip"),
+        pytest.param("GZIP", "gzip", id="case insensitive"),
+        pytest.param("gzip;q=0", None, id="refused"),
+        pytest.param("identity", None, id="identity"),
+        pytest.param("*", "br", id="wildcard picks the preferred coding"),
+        pytest.param("gzip;q=0.5, br;q=0.4", "gzip", id="by quality"),
+        pytest.param("br;q=0.4, gzip;q=0.5, *;q=0.9", "zstd", id="wildcard quality"),
+        pytest.param("gzip;q=bad, br", "br", id="invalid quality"),
+    ],
+)
+def test_negotiate(accept_encoding, expected):
+    assert negotiate(accept_encoding, ["br", "zstd", "gzip"]) == expected
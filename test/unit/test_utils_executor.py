@@ -0,0 +1,61 @@
+import asyncio
+import threading
+
+import pytest
+from starlette.exceptions import HTTPException
+
+from sovereign import _request_id_ctx_var, logs, stats
+from sovereign.utils.executor import BoundedExecutor
+
+
+def render(value):
+    logs.queue_log_fields(RENDERED_IN=threading.current_thread().name)
+    return value, _request_id_ctx_var.get()
+
+
+@pytest.mark.asyncio
+async def test_inline_executor_runs_on_the_calling_thread():
+    executor = BoundedExecutor(None, logs, stats)
+    assert await executor.run(threading.current_thread) is threading.current_thread()
+
+
+@pytest.mark.asyncio
+async def test_thread_executor_merges_log_fields_and_context_back():
+    executor = BoundedExecutor.threads(2, logs, stats)
+    logs.clear_log_fields()
+    token = _request_id_ctx_var.set("abc")
+    try:
+        assert await executor.run(render, 1) == (1, "abc")
+    finally:
+        _request_id_ctx_var.reset(token)
+    assert logs.get_log_fields()["RENDERED_IN"].startswith("sovereign-render")
+    assert executor.queued == 0
+    assert executor.active == 0
+
+
+@pytest.mark.asyncio
+async def test_log_fields_are_merged_back_when_rendering_fails():
+    def fail():
+        logs.queue_log_fields(ERROR="broken")
+        raise ValueError
+
+    executor = BoundedExecutor.threads(1, logs, stats)
+    logs.clear_log_fields()
+    with pytest.raises(ValueError):
+        await executor.run(fail)
+    assert logs.get_log_fields()["ERROR"] == "broken"
+
+
+@pytest.mark.asyncio
+async def test_renders_are_rejected_when_too_many_are_queued():
+    executor = BoundedExecutor.threads(1, logs, stats, max_queued=0)
+    release = threading.Event()
+    busy = asyncio.ensure_future(executor.run(release.wait))
+    await asyncio.sleep(0)
+    assert executor.active == 1
+    with pytest.raises(HTTPException) as e:
+        await executor.run(render, 1)
+    assert e.value.status_code == 503
+    release.set()
+    await busy
+    assert executor.in_flight == 0
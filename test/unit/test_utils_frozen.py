@@ -0,0 +1,69 @@
+import copy
+import pickle
+
+import pytest
+
+from sovereign import XDS_TEMPLATES, template_context
+from sovereign.schemas import XdsTemplate
+from sovereign.utils.frozen import FrozenDict, FrozenList, freeze
+
+
+@pytest.fixture
+def frozen():
+    return freeze({"certificates": [{"name": "a", "tags": {"x", "y"}}], "n": 1})
+
+
+def test_nested_containers_are_frozen(frozen):
+    assert isinstance(frozen, FrozenDict)
+    assert isinstance(frozen["certificates"], FrozenList)
+    assert isinstance(frozen["certificates"][0], FrozenDict)
+    assert frozen["certificates"][0]["tags"] == frozenset({"x", "y"})
+    assert frozen == {"certificates": [{"name": "a", "tags": {"x", "y"}}], "n": 1}
+    assert freeze(frozen) is frozen
+
+
+@pytest.mark.parametrize(
+    "modify",
+    (
+        lambda d: d.update(n=2),
+        lambda d: d.pop("n"),
+        lambda d: d.__setitem__("n", 2),
+        lambda d: d["certificates"].append({}),
+        lambda d: d["certificates"].__delitem__(0),
+        lambda d: d["certificates"][0].setdefault("key", "secret"),
+    ),
+)
+def test_frozen_containers_cannot_be_modified(frozen, modify):
+    with pytest.raises(TypeError):
+        modify(frozen)
+
+
+def test_copies_can_be_modified(frozen):
+    shallow = copy.copy(frozen)
+    shallow["n"] = 2
+    deep = copy.deepcopy(frozen)
+    deep["certificates"][0]["name"] = "b"
+    assert type(deep) is dict
+    assert type(deep["certificates"]) is list
+    assert frozen["n"] == 1
+    assert frozen["certificates"][0]["name"] == "a"
+
+
+def test_frozen_containers_can_be_pickled(frozen):
+    unpickled = pickle.loads(pickle.dumps(frozen))
+    assert unpickled == frozen
+    assert isinstance(unpickled["certificates"][0], FrozenDict)
+
+
+def test_templates_share_the_context_unless_it_is_mutable(discovery_request):
+    template = XDS_TEMPLATES["default"]["secrets"]
+    first = template_context.get_context(discovery_request, template)
+    second = template_context.get_context(discovery_request, template)
+    assert first["certificates"] is second["certificates"]
+    assert first["certificates"] is template_context.context["certificates"]
+
+    mutable = XdsTemplate(path=template.loadable, mutable_context=True)
+    copied = template_context.get_context(discovery_request, mutable)
+    assert copied["certificates"] == first["certificates"]
+    assert copied["certificates"] is not first["certificates"]
+    assert not isinstance(copied["certificates"], (FrozenDict, FrozenList))
@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+
+from sovereign.utils.generations import Generations
+
+
+@pytest.mark.asyncio
+async def test_waiters_are_woken_up_by_a_new_generation():
+    current = [1]
+    generations = Generations(lambda: current[0])
+    generation = generations.latest()
+    waiters = [asyncio.ensure_future(generations.wait(generation)) for _ in range(3)]
+    await asyncio.sleep(0)
+    generations.check()
+    assert not any(waiter.done() for waiter in waiters)
+
+    current[0] = 2
+    generations.check()
+    assert await asyncio.gather(*waiters) == [True, True, True]
+    assert generations.waiters == set()
+
+
+@pytest.mark.asyncio
+async def test_waiting_for_an_outdated_generation_returns_immediately():
+    generations = Generations(lambda: 2)
+    assert await generations.wait(1, timeout=0)
+
+
+@pytest.mark.asyncio
+async def test_waiting_times_out():
+    generations = Generations(lambda: 1)
+    assert not await generations.wait(generations.latest(), timeout=0.01)
+    assert generations.waiters == set()
@@ -0,0 +1,26 @@
+from sovereign.utils.lru import LRUCache
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_a_new_generation_empties_the_cache():
+    cache = LRUCache(maxsize=10)
+    cache.set("a", 1, generation=(1, 1))
+    assert cache.get("a", generation=(1, 1)) == 1
+    assert cache.get("a", generation=(2, 1)) is None
+    assert len(cache) == 0
+
+
+def test_a_cache_without_size_stores_nothing():
+    cache = LRUCache(maxsize=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
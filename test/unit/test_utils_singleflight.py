@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from sovereign import stats
+from sovereign.utils.singleflight import SingleFlight
+
+
+class Counter:
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self, value):
+        self.calls += 1
+        await self.release.wait()
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_with_the_same_key_share_one_call():
+    flight, fn = SingleFlight(stats), Counter()
+    calls = [asyncio.ensure_future(flight.run("a", fn, i)) for i in range(3)]
+    other = asyncio.ensure_future(flight.run("b", fn, "other"))
+    await asyncio.sleep(0)
+    fn.release.set()
+    assert await asyncio.gather(*calls) == [0, 0, 0]
+    assert await other == "other"
+    assert fn.calls == 2
+    assert flight.calls == {}
+
+
+@pytest.mark.asyncio
+async def test_exceptions_are_raised_to_every_caller():
+    flight, fn = SingleFlight(stats), Counter()
+    calls = [asyncio.ensure_future(flight.run("a", fn, ValueError())) for _ in range(2)]
+    await asyncio.sleep(0)
+    fn.release.set()
+    for call in calls:
+        with pytest.raises(ValueError):
+            await call
+
+
+@pytest.mark.asyncio
+async def test_cancelling_the_first_caller_does_not_cancel_the_others():
+    flight, fn = SingleFlight(stats), Counter()
+    first = asyncio.ensure_future(flight.run("a", fn, 1))
+    second = asyncio.ensure_future(flight.run("a", fn, 2))
+    await asyncio.sleep(0)
+    first.cancel()
+    fn.release.set()
+    assert await second == 1
+    assert first.cancelled()
@@ -0,0 +1,71 @@
+import datetime
+from decimal import Decimal
+from enum import Enum
+
+import pytest
+
+from sovereign.schemas import Locality
+from sovereign.utils import version_info
+from sovereign.utils.version_info import (
+    canonical_json,
+    combine_hashes,
+    compute_hash,
+    fingerprint_of,
+)
+
+
+class Color(Enum):
+    red = 1
+
+
+def test_hash_does_not_depend_on_key_order():
+    assert compute_hash({"a": 1, "b": [1, 2]}) == compute_hash({"b": [1, 2], "a": 1})
+
+
+def test_hash_changes_with_content():
+    assert compute_hash({"a": 1}) != compute_hash({"a": 2})
+    assert compute_hash([1, 2]) != compute_hash([2, 1])
+
+
+def test_hash_supports_pydantic_models_and_non_string_keys():
+    assert compute_hash(Locality(zone="a")) == compute_hash(Locality(zone="a"))
+    assert compute_hash(Locality(zone="a")) != compute_hash(Locality(zone="b"))
+    assert canonical_json({1: "a", "b": 2}) == b'{"1":"a","b":2}'
+
+
+def test_combined_hashes_depend_on_every_hash_and_their_order():
+    a, b = compute_hash("a"), compute_hash("b")
+    assert combine_hashes([a, b]) == combine_hashes([a, b])
+    assert combine_hashes([a, b]) != combine_hashes([b, a])
+    assert combine_hashes([a]) != combine_hashes([a, b])
+
+
+def test_hash_of_modules_and_functions_does_not_use_their_address():
+    import json
+
+    assert canonical_json([json, json.dumps]) == b'["json","json.dumps"]'
+
+
+@pytest.mark.parametrize("orjson_installed", [True, False])
+def test_hash_supports_enums_sets_and_dates(orjson_installed, monkeypatch):
+    monkeypatch.setattr(version_info, "ORJSON_INSTALLED", orjson_installed)
+    assert canonical_json(
+        [Color.red, {"b", "a"}, datetime.date(2023, 1, 2)]
+    ) == b'[1,["a","b"],"2023-01-02"]'
+
+
+@pytest.mark.parametrize("orjson_installed", [True, False])
+def test_hash_of_unknown_types_raises(orjson_installed, monkeypatch):
+    monkeypatch.setattr(version_info, "ORJSON_INSTALLED", orjson_installed)
+    with pytest.raises(TypeError):
+        compute_hash({"a": object()})
+
+
+def test_values_without_a_json_form_can_be_fingerprinted():
+    assert fingerprint_of({"a": 1}) == compute_hash({"a": 1})
+    assert fingerprint_of(Decimal("1.5")) == fingerprint_of(Decimal("1.5"))
+    assert fingerprint_of(b"a") != fingerprint_of(b"b")
+    # Neither JSON nor picklable
+    value = lambda: None  # noqa: E731
+    unpicklable = {"f": value, "x": object()}
+    assert fingerprint_of(unpicklable) == fingerprint_of(unpicklable)